@@ -9,3 +9,39 @@ __version__ = "0.2.3"
 # we'll try to discover what the user has actually set the
 # port to, but if we fail for some reason, fall back to this
 DEFAULT_STREAMING_API_PORT = 5005
+
+# standard config file name, can be overridden in settings.json
+DEFAULT_CONFIG_FILE = "oobabot-config.yml"
+
+# the defaults below are for the command line's subcommands.  They
+# live here so that its help can show them without importing each
+# subcommand's module, which would slow down every subcommand.
+
+# where the standalone server listens, which the load test also
+# starts it on
+DEFAULT_SERVER_HOST = "0.0.0.0"
+DEFAULT_SERVER_PORT = 1234
+
+# gradio's own defaults.  Status polling doesn't go through the
+# queue, so these only need to be raised for the slower actions,
+# like starting the bot or testing a token, to overlap.
+DEFAULT_SERVER_CONCURRENCY_COUNT = 1
+DEFAULT_SERVER_MAX_THREADS = 40
+
+# text-generation-webui reads its command line flags from this
+# file in its root directory, when it's started by its scripts
+CMD_FLAGS_FILE = "CMD_FLAGS.txt"
+
+# multiples of production data sizes to benchmark at
+DEFAULT_BENCHMARK_SCALES = [1, 10, 100]
+
+DEFAULT_LOAD_TEST_CLIENTS = [1, 10, 50, 100]
+DEFAULT_LOAD_TEST_STAGE_SECONDS = 30.0
+
+# matches POLL_FAST_MS in oobabot_log.js
+DEFAULT_LOAD_TEST_POLL_SECONDS = 0.5
+
+# busier than a typical bot, so that every poll has news
+DEFAULT_LOAD_TEST_FAKE_BOT_OPTIONS = (
+    "log_lines_per_second=20,voice_messages_per_second=1"
+)
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the plugin's hot paths, run against synthetic
+data so that they don't need Discord or a running oobabooga.
+
+Each benchmark is run at multiples of the size the plugin sees
+in production, and the results are written as JSON, so that runs
+from different commits can be compared:
+
+    oobabot-plugin benchmark --output before.json
+    ...
+    oobabot-plugin benchmark --compare before.json
+"""
+
+import datetime
+import importlib.metadata
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import typing
+
+import oobabot_plugin
+from oobabot_plugin import character_catalog
+from oobabot_plugin import fake_bot
+from oobabot_plugin import log_store
+from oobabot_plugin import strings
+from oobabot_plugin import transcript_view
+
+if typing.TYPE_CHECKING:
+    from oobabot_plugin import worker
+
+# the sizes of things at 1x scale.  oobabot keeps this many voice
+# messages in its transcript, and the log panel shows this many
+# lines.  Character folders vary a lot; this is a large-ish one.
+TRANSCRIPT_MESSAGES = 300
+LOG_LINES = 5000
+CHARACTER_FILES = 100
+
+DEFAULT_SCALES = oobabot_plugin.DEFAULT_BENCHMARK_SCALES
+
+# each benchmark runs at least this many times, and for at least
+# this long, but no more than MAX_ITERATIONS times
+MIN_ITERATIONS = 5
+MIN_SECONDS = 1.0
+MAX_ITERATIONS = 10000
+
+# how many lines are logged between each delta read of the log
+LOG_LINES_PER_DELTA = 10
+
+# the random data is the same on every run
+SEED = 1234
+
+
+class BenchmarkResult(typing.NamedTuple):
+    """
+    The timings of one benchmark at one scale.
+    """
+
+    name: str
+    scale: int
+
+    # how many messages, lines or files the benchmark ran over
+    size: int
+
+    iterations: int
+    min_seconds: float
+    median_seconds: float
+    mean_seconds: float
+    max_seconds: float
+
+
+class _Case(typing.NamedTuple):
+    # how many messages, lines or files the benchmark runs over
+    size: int
+
+    # the code being timed
+    run: typing.Callable[[], typing.Any]
+
+    # called, untimed, before each run
+    setup: typing.Optional[typing.Callable[[], None]] = None
+
+
+class _Fixture:
+    """
+    The state shared by the benchmarks: a folder to run in, a
+    worker, and the data they've made so far.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.rnd = random.Random(SEED)
+        self.characters_folder = os.path.join(
+            folder, character_catalog.CHARACTERS_FOLDER
+        )
+        os.makedirs(self.characters_folder, exist_ok=True)
+        self.character_count = 0
+        self._worker: typing.Optional["worker.OobabotWorker"] = None
+
+    def get_worker(self) -> "worker.OobabotWorker":
+        if self._worker is None:
+            # these pull in gradio, so only load them if a
+            # benchmark needs them
+            # pylint: disable=import-outside-toplevel
+            import gradio as gr
+
+            from oobabot_plugin import layout
+            from oobabot_plugin import worker
+
+            # pylint: enable=import-outside-toplevel
+
+            ui_layout = layout.OobabotLayout()
+            self._worker = worker.OobabotWorker(
+                0,
+                os.path.join(self.folder, "config.yml"),
+                ui_layout,
+            )
+            with gr.Blocks():
+                ui_layout.layout_ui(
+                    has_plausible_token=False,
+                    stable_diffusion_keywords=[],
+                    api_extension_loaded=True,
+                    is_using_character=True,
+                    is_voice_enabled=False,
+                )
+        return self._worker
+
+    def fill_logs(self, count: int) -> int:
+        """
+        Logs lines until the log store holds count of them, or
+        as many as fit.  Returns how many it holds.
+        """
+        self.get_worker()
+        store = log_store.get()
+        for _ in range(count - len(store.entries)):
+            store.handle(fake_bot.make_log_record(self.rnd))
+        return len(store.entries)
+
+    def fill_characters(self, count: int) -> None:
+        """
+        Adds character files until there are count of them.
+        """
+        extensions = character_catalog.EXTENSIONS
+        while self.character_count < count:
+            extension = extensions[self.character_count % len(extensions)]
+            filename = f"Character {self.character_count:06d}.{extension}"
+            path = os.path.join(self.characters_folder, filename)
+            with open(path, "w", encoding="utf-8") as file:
+                file.write("name: benchmark\n")
+            self.character_count += 1
+        # the catalog doesn't trust a folder which has only just
+        # changed, so make it look like it changed a while ago
+        past = time.time() - 60
+        os.utime(self.characters_folder, (past, past))
+
+
+def _bench_transcript_html(fixture: _Fixture, scale: int) -> _Case:
+    messages = fake_bot.make_transcript(TRANSCRIPT_MESSAGES * scale, fixture.rnd)
+    return _Case(
+        len(messages),
+        lambda: transcript_view.get_transcript_html(
+            messages, fake_bot.make_fancy_author
+        ),
+    )
+
+
+def _bench_transcript_html_coalesced(fixture: _Fixture, scale: int) -> _Case:
+    messages = fake_bot.make_transcript(TRANSCRIPT_MESSAGES * scale, fixture.rnd)
+    return _Case(
+        len(messages),
+        lambda: transcript_view.get_transcript_html(
+            messages, fake_bot.make_fancy_author, coalesce_tokens=True
+        ),
+    )
+
+
+def _bench_transcript_view_new_message(fixture: _Fixture, scale: int) -> _Case:
+    # the bot's transcript is a ring buffer, so each new message
+    # pushes out the oldest one
+    messages = fake_bot.make_transcript(TRANSCRIPT_MESSAGES * scale, fixture.rnd)
+    view = transcript_view.TranscriptView(lambda: messages, fake_bot.make_fancy_author)
+    view.get_html()
+
+    def add_message():
+        start_time = messages[-1].start_time + datetime.timedelta(seconds=2)
+        messages.append(fake_bot.make_voice_message(fixture.rnd, start_time))
+        del messages[0]
+
+    return _Case(len(messages), view.get_html, add_message)
+
+
+def _bench_transcript_view_unchanged(fixture: _Fixture, scale: int) -> _Case:
+    messages = fake_bot.make_transcript(TRANSCRIPT_MESSAGES * scale, fixture.rnd)
+    view = transcript_view.TranscriptView(lambda: messages, fake_bot.make_fancy_author)
+    view.get_html()
+    return _Case(len(messages), view.get_html)
+
+
+def _bench_get_logs(fixture: _Fixture, scale: int) -> _Case:
+    size = fixture.fill_logs(LOG_LINES * scale)
+    return _Case(size, fixture.get_worker().get_logs)
+
+
+def _bench_get_logs_delta(fixture: _Fixture, scale: int) -> _Case:
+    size = fixture.fill_logs(LOG_LINES * scale)
+    store = log_store.get()
+    seen_etag = store.sequence
+
+    def log_lines():
+        nonlocal seen_etag
+        seen_etag = store.sequence
+        for _ in range(LOG_LINES_PER_DELTA):
+            store.handle(fake_bot.make_log_record(fixture.rnd))
+
+    return _Case(size, lambda: fixture.get_worker().get_logs(seen_etag), log_lines)
+
+
+def _bench_input_handlers(fixture: _Fixture, scale: int) -> _Case:
+    fixture.fill_characters(CHARACTER_FILES * scale)
+    bot_worker = fixture.get_worker()
+    handlers = list(
+        bot_worker.get_input_handlers(strings.get_available_characters).values()
+    )
+    # pick a character, so that its file has to be looked up
+    character = strings.get_available_characters()[-1]
+    for handler in handlers:
+        if "persona_file" in handler.setting_names():
+            handler.write_to_settings(character)
+
+    def round_trip():
+        for handler in handlers:
+            handler.write_to_settings(handler.read_from_settings())
+
+    return _Case(fixture.character_count, round_trip)
+
+
+def _bench_get_available_characters(fixture: _Fixture, scale: int) -> _Case:
+    fixture.fill_characters(CHARACTER_FILES * scale)
+    strings.get_available_characters()
+    return _Case(fixture.character_count, strings.get_available_characters)
+
+
+def _bench_scan_characters(fixture: _Fixture, scale: int) -> _Case:
+    # what get_available_characters costs when the folder has changed
+    fixture.fill_characters(CHARACTER_FILES * scale)
+    return _Case(
+        fixture.character_count,
+        lambda: character_catalog.CharacterCatalog(
+            character_catalog.CHARACTERS_FOLDER
+        ).character_names(),
+    )
+
+
+BENCHMARKS: typing.Dict[str, typing.Callable[[_Fixture, int], _Case]] = {
+    "transcript_html": _bench_transcript_html,
+    "transcript_html_coalesced": _bench_transcript_html_coalesced,
+    "transcript_view_new_message": _bench_transcript_view_new_message,
+    "transcript_view_unchanged": _bench_transcript_view_unchanged,
+    "worker_get_logs": _bench_get_logs,
+    "worker_get_logs_delta": _bench_get_logs_delta,
+    "input_handlers_round_trip": _bench_input_handlers,
+    "get_available_characters": _bench_get_available_characters,
+    "scan_characters": _bench_scan_characters,
+}
+
+
+def _time_case(name: str, scale: int, case: _Case) -> BenchmarkResult:
+    timings: typing.List[float] = []
+    started = time.perf_counter()
+    while len(timings) < MAX_ITERATIONS and (
+        len(timings) < MIN_ITERATIONS or time.perf_counter() - started < MIN_SECONDS
+    ):
+        if case.setup is not None:
+            case.setup()
+        before = time.perf_counter()
+        case.run()
+        timings.append(time.perf_counter() - before)
+    return BenchmarkResult(
+        name=name,
+        scale=scale,
+        size=case.size,
+        iterations=len(timings),
+        min_seconds=min(timings),
+        median_seconds=statistics.median(timings),
+        mean_seconds=statistics.mean(timings),
+        max_seconds=max(timings),
+    )
+
+
+def run_benchmarks(
+    scales: typing.List[int],
+    names: typing.Optional[typing.List[str]] = None,
+) -> typing.List[BenchmarkResult]:
+    """
+    Runs the named benchmarks, or all of them, at each scale.
+
+    This runs in a temporary folder, which holds the characters
+    folder and config file the benchmarks use.
+    """
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="oobabot-benchmark-") as folder:
+        os.chdir(folder)
+        try:
+            fixture = _Fixture(folder)
+            for scale in sorted(scales):
+                for name, benchmark in BENCHMARKS.items():
+                    if names and name not in names:
+                        continue
+                    result = _time_case(name, scale, benchmark(fixture, scale))
+                    print(
+                        f"{name} x{scale}: {result.median_seconds * 1000:.3f} ms",
+                        file=sys.stderr,
+                    )
+                    results.append(result)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def _package_version(package: str) -> str:
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def results_to_json(results: typing.List[BenchmarkResult]) -> str:
+    """
+    Returns the results, and what they were run on, as JSON.
+    """
+    return json.dumps(
+        {
+            "oobabot_plugin_version": _package_version("oobabot-plugin"),
+            "oobabot_version": _package_version("oobabot"),
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+            "created": time.time(),
+            "results": [result._asdict() for result in results],
+        },
+        indent=2,
+    )
+
+
+def format_comparison(
+    baseline: typing.Dict[str, typing.Any], results: typing.List[BenchmarkResult]
+) -> str:
+    """
+    Returns a table of how the median times compare to those
+    in an earlier run's JSON.
+    """
+    baseline_medians = {
+        (result["name"], result["scale"]): result["median_seconds"]
+        for result in baseline.get("results", [])
+    }
+    lines = [f"{'benchmark':<40} {'before ms':>12} {'after ms':>12} {'ratio':>8}"]
+    for result in results:
+        before = baseline_medians.get((result.name, result.scale))
+        label = f"{result.name} x{result.scale}"
+        after_ms = f"{result.median_seconds * 1000:.3f}"
+        if before is None:
+            lines.append(f"{label:<40} {'-':>12} {after_ms:>12} {'-':>8}")
+            continue
+        ratio = result.median_seconds / before if before else float("inf")
+        lines.append(
+            f"{label:<40} {before * 1000:>12.3f} {after_ms:>12} {ratio:>7.2f}x"
+        )
+    return "\n".join(lines)
+
+
+def main(
+    _cwd: str,
+    scales: typing.Optional[typing.List[int]] = None,
+    only: typing.Optional[typing.List[str]] = None,
+    output: typing.Optional[str] = None,
+    compare: typing.Optional[str] = None,
+) -> None:
+    """
+    Runs the benchmarks, and writes their results as JSON to the
+    output file, or to stdout.  If compare is the path to the
+    results of an earlier run, also prints how they compare.
+    """
+    unknown = [name for name in only or [] if name not in BENCHMARKS]
+    if unknown:
+        print(
+            f"Unknown benchmarks: {', '.join(unknown)}.  "
+            + f"Choose from: {', '.join(BENCHMARKS)}",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    baseline = None
+    if compare:
+        with open(compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    results = run_benchmarks(scales or DEFAULT_SCALES, only)
+
+    results_json = results_to_json(results)
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            file.write(results_json + "\n")
+    else:
+        print(results_json)
+
+    if baseline is not None:
+        print(format_comparison(baseline, results), file=sys.stderr)
@@ -16,10 +16,11 @@ import oobabot
 
 import oobabot_plugin
 from oobabot_plugin import controller
+from oobabot_plugin import fake_bot
+from oobabot_plugin import status_feed
 from oobabot_plugin import strings
 
-# standard config file name, can be overridden in settings.json
-DEFAULT_CONFIG_FILE = "oobabot-config.yml"
+DEFAULT_CONFIG_FILE = oobabot_plugin.DEFAULT_CONFIG_FILE
 
 
 # allow our logging to use the original version of StreamHandler.emit,
@@ -54,7 +55,7 @@ def log_script_py_version(script_py_version: str):
 def plugin_ui(
     script_py_version: str = "",
     params: typing.Optional[dict] = None,
-) -> None:
+) -> controller.OobabotController:
     """
     Creates custom gradio elements when the UI is launched.
     """
@@ -96,18 +97,68 @@ def plugin_ui(
     if params and params.get("config_file"):
         config_file = params["config_file"]
 
+    # can be enabled in settings.json with:
+    #   "oobabot-run_in_subprocess": true
+    run_in_subprocess = bool(params and params.get("run_in_subprocess"))
+
+    # can be enabled in settings.json with:
+    #   "oobabot-log_spool": true
+    log_spool = bool(params and params.get("log_spool"))
+
+    # can be enabled in settings.json with:
+    #   "oobabot-transcript_archive": true
+    transcript_archive = bool(params and params.get("transcript_archive"))
+
+    # can be set in settings.json with, e.g.:
+    #   "oobabot-transcript_window_messages": 50
+    #   "oobabot-transcript_window_minutes": 10
+    transcript_window_messages = None
+    if params and params.get("transcript_window_messages"):
+        transcript_window_messages = int(params["transcript_window_messages"])
+    transcript_window_minutes = None
+    if params and params.get("transcript_window_minutes"):
+        transcript_window_minutes = float(params["transcript_window_minutes"])
+
+    # renders runs of similar-confidence tokens in the live voice
+    # transcript as one element each.  Can be enabled with:
+    #   "oobabot-coalesce_transcript_tokens": true
+    coalesce_transcript_tokens = bool(
+        params and params.get("coalesce_transcript_tokens")
+    )
+
+    # runs a stand-in for the bot, for load testing.  Can be
+    # enabled in settings.json with:
+    #   "oobabot-fake_bot": true
+    # or with options, as described in fake_bot.parse_options:
+    #   "oobabot-fake_bot": "log_lines_per_second=100"
+    fake_bot_options = None
+    fake_bot_param = params.get("fake_bot") if params else None
+    if fake_bot_param is True:
+        fake_bot_options = fake_bot.FakeBotOptions()
+    elif isinstance(fake_bot_param, str):
+        fake_bot_options = fake_bot.parse_options(fake_bot_param)
+
     # create the controller, which will load our config file.
     # we need to do this before the UI is constructed
     ui_controller = controller.OobabotController(
         streaming_port,
         config_file,
         api_extension_loaded,
+        run_in_subprocess=run_in_subprocess,
+        log_spool=log_spool,
+        transcript_archive=transcript_archive,
+        transcript_window_messages=transcript_window_messages,
+        transcript_window_minutes=transcript_window_minutes,
+        coalesce_transcript_tokens=coalesce_transcript_tokens,
+        fake_bot=fake_bot_options,
     )
 
     ui_controller.init_ui()
 
     if script_py_version:
-        hack_the_planet()
+        hack_the_planet(ui_controller.status_feed)
+
+    return ui_controller
 
 
 # pylint: disable=unused-argument
@@ -139,10 +190,56 @@ def custom_js(
 # pylint: enable=unused-argument
 
 
-def hack_the_planet():
+def hack_the_planet(feed: typing.Optional[status_feed.StatusFeed]):
     threading.Thread(
         target=add_uvicorn_graceful_shutdown_timeout_if_there_isnt_one_already
     ).start()
+    if feed is not None:
+        threading.Thread(target=mount_status_feed, args=(feed,)).start()
+
+
+def mount_status_feed(feed: status_feed.StatusFeed):
+    # the status feed needs a route on oobabooga's gradio app, which
+    # only exists once oobabooga has launched it.  That happens after
+    # our UI has been created, so wait for it here.
+    #
+    # If this doesn't work, the UI will still update itself, just
+    # less often.
+    try:
+        # pylint: disable=import-outside-toplevel
+        from modules import shared  # type: ignore
+
+        # pylint: enable=import-outside-toplevel
+
+        interface = None
+        if shared.gradio:
+            interface = shared.gradio.get("interface")
+
+        attempts_remaining = 120
+        while (
+            interface is not None
+            and getattr(interface, "server_app", None) is None
+            and attempts_remaining > 0
+        ):
+            time.sleep(0.5)
+            attempts_remaining -= 1
+
+        server_app = getattr(interface, "server_app", None)
+        if server_app is not None:
+            feed.mount(server_app)
+            return
+
+    except ImportError as err:
+        if oobabot_logger:
+            oobabot_logger.warning(
+                "oobabot: could not load shared module: %s",
+                err,
+            )
+    if oobabot_logger is not None:
+        oobabot_logger.warning(
+            "oobabot: could not find oobabooga's web server, so the UI will "
+            + "update more slowly."
+        )
 
 
 # pylint: disable=too-many-nested-blocks
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+Runs oobabot in a child process, rather than in a thread.
+
+This keeps the bot's discord and voice work from competing
+for the GIL with gradio and with the model host process.
+
+The parent talks to the child over a Unix socket, using
+multiprocessing's connection protocol.  The child forwards
+its log records to the parent, where they're logged as if
+the bot were running in-process.  The parent can ask the
+child for the voice transcript and author information, and
+can ask it to stop.
+
+The child is run as `python -m oobabot_plugin.bot_process`,
+rather than with multiprocessing's spawn, since that would
+re-import the host process's main module into the child.
+"""
+
+import io
+import itertools
+import logging
+import logging.handlers
+from multiprocessing import connection
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import typing
+
+from oobabot import fancy_logger
+from oobabot import oobabot
+from oobabot import types
+
+from oobabot_plugin import live_settings
+
+# the child reads its authentication key from here, so that
+# it doesn't show up in the process list
+AUTHKEY_ENV_VAR = "OOBABOT_PLUGIN_AUTHKEY"
+
+
+class BotProcess:
+    """
+    The parent's handle on a bot running in a child process.
+
+    Once the child has exited, calls which ask it for
+    information return empty results, except for the transcript,
+    which stays as it was last seen.
+    """
+
+    # how long to wait for the child to answer a call
+    CALL_TIMEOUT_SECONDS = 5.0
+
+    # how long to wait for the child to connect after starting
+    CONNECT_TIMEOUT_SECONDS = 30.0
+
+    # how long the child has to stop gracefully before we kill it
+    STOP_TIMEOUT_SECONDS = 10.0
+
+    def __init__(self, cli_args: typing.List[str]):
+        self.cli_args = cli_args
+        self.process: typing.Optional[subprocess.Popen] = None
+        self.conn: typing.Optional[connection.Connection] = None
+        self.connected = threading.Event()
+
+        # calls can be made from any thread.  The reader thread
+        # hands each result to whoever is waiting for it.
+        self.send_lock = threading.Lock()
+        self.call_ids = itertools.count()
+        self.pending_lock = threading.Lock()
+        self.pending: typing.Dict[
+            int, typing.Tuple[threading.Event, typing.List[typing.Any]]
+        ] = {}
+
+        # we keep our own copy of each transcript message, so that
+        # the same message is the same object from call to call.
+        # Messages are identified by a serial number the child assigns.
+        self.transcript_lock = threading.Lock()
+        self.transcript_messages: typing.Dict[int, "types.VoiceMessage"] = {}
+
+    def start(self) -> None:
+        """
+        Starts the child process.  Returns immediately; the child
+        connects back in the background.
+        """
+        socket_dir = tempfile.mkdtemp(prefix="oobabot-")
+        address = os.path.join(socket_dir, "bot.sock")
+        authkey = os.urandom(32)
+
+        env = dict(os.environ)
+        env[AUTHKEY_ENV_VAR] = authkey.hex()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "oobabot_plugin.bot_process", address]
+            + self.cli_args,
+            env=env,
+        )
+        threading.Thread(
+            target=self._read_from_child,
+            args=(address, authkey, socket_dir),
+            daemon=True,
+        ).start()
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout: typing.Optional[float] = None) -> None:
+        """
+        Asks the child to stop, and waits for it to exit.  If it
+        doesn't exit within timeout seconds, it's killed.
+        """
+        if self.process is None:
+            return
+        if timeout is None:
+            timeout = self.STOP_TIMEOUT_SECONDS
+        # the timeout covers asking, too.  Don't wait for an answer,
+        # since a child which is hung won't give one.
+        deadline = time.monotonic() + timeout
+        self._send_call("stop")
+        try:
+            self.process.wait(timeout=max(0.0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            fancy_logger.get().warning(
+                "oobabot_plugin: bot process did not stop in time, killing it"
+            )
+            self.process.kill()
+            self.process.wait()
+
+    def get_transcript(self) -> typing.List["types.VoiceMessage"]:
+        with self.transcript_lock:
+            since_serial = max(self.transcript_messages, default=-1)
+            result = self._call("transcript", since_serial)
+            if result is None:
+                # an empty transcript would look like the start of a
+                # new call, so keep showing what we had
+                return list(self.transcript_messages.values())
+            serials, new_messages = result
+            self.transcript_messages.update(new_messages)
+            self.transcript_messages = {
+                serial: self.transcript_messages[serial] for serial in serials
+            }
+            return list(self.transcript_messages.values())
+
+    def fancy_author_info(self, user_id: int) -> typing.Optional["types.FancyAuthor"]:
+        return self._call("fancy_author_info", user_id)
+
+    def apply_settings(
+        self, settings_yaml: str, setting_names: typing.List[str]
+    ) -> bool:
+        """
+        Loads the given settings in the child, and applies the
+        named ones to the running bot.
+        """
+        return bool(self._call("apply_settings", settings_yaml, setting_names))
+
+    def _call(self, method: str, *args) -> typing.Any:
+        """
+        Calls a method in the child, and returns its result.
+        Returns None if the child isn't there to answer.
+        """
+        if not self.connected.is_set() or self.conn is None:
+            return None
+        call_id = next(self.call_ids)
+        done = threading.Event()
+        result: typing.List[typing.Any] = []
+        with self.pending_lock:
+            self.pending[call_id] = (done, result)
+        try:
+            with self.send_lock:
+                self.conn.send(("call", call_id, method, args))
+            done.wait(timeout=self.CALL_TIMEOUT_SECONDS)
+        except (OSError, EOFError, ValueError):
+            pass
+        finally:
+            with self.pending_lock:
+                del self.pending[call_id]
+        if result:
+            return result[0]
+        return None
+
+    def _send_call(self, method: str, *args) -> None:
+        """
+        Calls a method in the child without waiting for its result.
+        """
+        if not self.connected.is_set() or self.conn is None:
+            return
+        try:
+            with self.send_lock:
+                self.conn.send(("call", next(self.call_ids), method, args))
+        except (OSError, EOFError, ValueError):
+            pass
+
+    def _connect(self, address: str, authkey: bytes) -> bool:
+        deadline = time.monotonic() + self.CONNECT_TIMEOUT_SECONDS
+        while self.is_alive() and time.monotonic() < deadline:
+            try:
+                self.conn = connection.Client(address, "AF_UNIX", authkey=authkey)
+                return True
+            except (FileNotFoundError, ConnectionRefusedError):
+                time.sleep(0.1)
+        return False
+
+    def _read_from_child(self, address: str, authkey: bytes, socket_dir: str):
+        if not self._connect(address, authkey):
+            # the child cleans up the socket once we've connected,
+            # but if we never did, that's up to us
+            shutil.rmtree(socket_dir, ignore_errors=True)
+            fancy_logger.get().error("oobabot_plugin: could not connect to bot process")
+            return
+
+        self.connected.set()
+        try:
+            while True:
+                message = self.conn.recv()  # type: ignore
+                if message[0] == "log":
+                    # log it as if it came from this process
+                    fancy_logger.get().handle(message[1])
+                elif message[0] == "result":
+                    with self.pending_lock:
+                        waiter = self.pending.get(message[1])
+                    if waiter is not None:
+                        waiter[1].append(message[2])
+                        waiter[0].set()
+        except (OSError, EOFError):
+            pass
+        finally:
+            self.connected.clear()
+            self.conn.close()  # type: ignore
+
+
+class _ConnectionQueue:
+    """
+    Looks enough like a queue for QueueHandler to send log
+    records to the parent through it.
+    """
+
+    def __init__(self, send: typing.Callable[[typing.Any], None]):
+        self.send = send
+
+    def put_nowait(self, record: logging.LogRecord) -> None:
+        self.send(("log", record))
+
+
+class _BotChild:
+    """
+    The child's side of BotProcess.  Runs the bot on the main
+    thread, and answers calls from the parent on another.
+    """
+
+    def __init__(self, conn: connection.Connection, cli_args: typing.List[str]):
+        self.conn = conn
+        self.cli_args = cli_args
+        self.send_lock = threading.Lock()
+        self.bot: typing.Optional[oobabot.Oobabot] = None
+
+        # id(message) -> (serial, message).  Holding on to the message
+        # keeps its id from being reused while we remember it.
+        self.serials: typing.Dict[int, typing.Tuple[int, "types.VoiceMessage"]] = {}
+        self.next_serial = itertools.count()
+
+    def send(self, message: typing.Any) -> None:
+        with self.send_lock:
+            try:
+                self.conn.send(message)
+            except (OSError, ValueError):
+                # the parent is gone, nobody to tell
+                pass
+
+    def run(self) -> None:
+        fancy_logger.get().addHandler(
+            logging.handlers.QueueHandler(_ConnectionQueue(self.send))  # type: ignore
+        )
+        try:
+            self.bot = oobabot.Oobabot(self.cli_args)
+        except Exception as err:  # pylint: disable=broad-except
+            fancy_logger.get().error("oobabot_plugin: could not load bot: %s", err)
+            return
+        # the parent keeps the logs shown in the UI, so we don't
+        # need oobabot's own buffer of them
+        fancy_logger.get().removeHandler(fancy_logger.recent_logs)
+
+        threading.Thread(target=self._serve, daemon=True).start()
+        self.bot.start()
+
+    def _serve(self) -> None:
+        while True:
+            try:
+                _, call_id, method, args = self.conn.recv()
+            except (OSError, EOFError):
+                # the parent has gone away, so we should too
+                if self.bot is not None:
+                    self.bot.stop()
+                return
+            try:
+                result = getattr(self, "_handle_" + method)(*args)
+            except Exception as err:  # pylint: disable=broad-except
+                fancy_logger.get().error(
+                    "oobabot_plugin: error handling %s: %s", method, err
+                )
+                result = None
+            self.send(("result", call_id, result))
+
+    def _handle_stop(self) -> bool:
+        return self.bot.stop()  # type: ignore
+
+    def _handle_apply_settings(
+        self, settings_yaml: str, setting_names: typing.List[str]
+    ) -> bool:
+        error = self.bot.settings.load_from_yaml_stream(  # type: ignore
+            io.StringIO(settings_yaml)
+        )
+        if error is not None:
+            fancy_logger.get().error(
+                "oobabot_plugin: could not load settings: %s", error
+            )
+            return False
+        return live_settings.apply(self.bot, setting_names)  # type: ignore
+
+    def _handle_fancy_author_info(
+        self, user_id: int
+    ) -> typing.Optional["types.FancyAuthor"]:
+        return self.bot.fancy_author_info(user_id)  # type: ignore
+
+    def _handle_transcript(
+        self, since_serial: int
+    ) -> typing.Tuple[typing.List[int], typing.Dict[int, "types.VoiceMessage"],]:
+        """
+        Returns the serial numbers of every message in the
+        transcript, along with any messages the parent hasn't
+        seen yet.
+        """
+        serials = []
+        new_messages = {}
+        current = {}
+        for message in self.bot.current_voice_transcript:  # type: ignore
+            known = self.serials.get(id(message))
+            if known is None:
+                known = (next(self.next_serial), message)
+            current[id(message)] = known
+            serials.append(known[0])
+            if known[0] > since_serial:
+                new_messages[known[0]] = message
+        self.serials = current
+        return (serials, new_messages)
+
+
+def main() -> None:
+    address = sys.argv[1]
+    cli_args = sys.argv[2:]
+    authkey = bytes.fromhex(os.environ.pop(AUTHKEY_ENV_VAR))
+
+    with connection.Listener(address, "AF_UNIX", authkey=authkey) as listener:
+        conn = listener.accept()
+    # the listener removes the socket when closed, so we're
+    # done with the directory the parent made for it
+    os.rmdir(os.path.dirname(address))
+    try:
+        _BotChild(conn, cli_args).run()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -38,7 +38,10 @@ class ButtonEnablers:
 
         enable_when_token_plausible(layout.discord_token_save_button)
         enable_when_token_plausible(layout.ive_done_all_this_button)
-        enable_when_token_plausible(layout.start_button)
+        layout.start_button.attach_load_event(
+            lambda: layout.start_button.update(interactive=self.can_start()),
+            None,
+        )
 
         # initialize the discord invite link value
         layout.discord_invite_link_html.attach_load_event(
@@ -75,13 +78,17 @@ class ButtonEnablers:
             ],
         )
 
-        # monitor the running state all the time, to monitor
-        # for two cases:
-        #   1. the bot was already running when the user loaded the page
-        #   2. the bot stopped on its own, perhaps due to an error
-        layout.running_state_textbox.attach_load_event(
+        # the running state can also change on its own, for instance
+        # when the bot stops due to an error.  The status feed will
+        # tell the page when this happens, and it will click the
+        # refresh button.  The controller's status poll also keeps
+        # it up to date, in case the feed isn't connected.  Like the
+        # status poll, these skip the queue.
+        layout.running_state_refresh_button.click(
             self.running_state_update,
-            every=strings.QUICK_UPDATE_INTERVAL_SECONDS,
+            inputs=None,
+            outputs=[layout.running_state_textbox],
+            queue=False,
         )
 
         # enable or disable all other input controls based on the running state
@@ -98,46 +105,62 @@ class ButtonEnablers:
                 layout.advanced_yaml_editor,
                 *self._get_input_handlers().keys(),
             ],
+            queue=False,
         )
 
     # a hidden textbox which reflects the running state
     # of the bot.  This can be one of these values:
     #  - "" (empty string) - unknown state (during startup)
     #  - "no_token" - there is no token set
+    #  - "starting" - bot is starting
     #  - "running" - bot is running
+    #  - "stopping" - bot is stopping
     #  - "stopped" - bot is stopped
-    def _current_running_state(self, is_running=None) -> str:
-        if is_running is None:
-            is_running = self.worker.is_running()
-        if not self.is_token_plausible:
+    #  - "failed" - bot failed to start, exited unexpectedly,
+    #    or did not stop in time
+    def current_running_state(self) -> str:
+        if not self.can_start():
             return "no_token"
-        if is_running:
-            return "running"
-        return "stopped"
+        return self.worker.get_state()
 
-    def running_state_update(self, is_running=None):
+    def can_start(self) -> bool:
+        # the stand-in bot doesn't connect to Discord, so it
+        # doesn't need a token
+        return self.is_token_plausible or self.worker.fake_bot is not None
+
+    def running_state_update(self):
         return self.layout.running_state_textbox.update(
-            value=self._current_running_state(is_running)
+            value=self.current_running_state()
         )
 
     # lots to do here:
-    #  if the bot is running, disable all inputs
+    #  if the bot is running, disable all inputs except those
+    #  which can be applied to the running bot
     #  if the bot is stopped, but has a valid token, enable all inputs
     #  if the bot is stopped and does not have a valid token, disable
     #  all inputs except for the advanced settings editor
     def _handle_running_state_change(self, running_state: str):
-        if running_state == "running":
+        if running_state in ("starting", "running"):
             enable_stop = True
             enable_advanced = False
             enable_inputs_and_start = False
+            # settings which don't need a restart can still be changed
+            enable_live_inputs = running_state == "running"
+        elif running_state == "stopping":
+            enable_stop = False
+            enable_advanced = False
+            enable_inputs_and_start = False
+            enable_live_inputs = False
         elif running_state in ("no_token", ""):
             enable_stop = False
             enable_advanced = True
             enable_inputs_and_start = False
-        elif running_state == "stopped":
+            enable_live_inputs = False
+        elif running_state in ("stopped", "failed"):
             enable_stop = False
             enable_advanced = True
             enable_inputs_and_start = True
+            enable_live_inputs = True
         else:
             raise ValueError(f"unknown running state: {running_state}")
 
@@ -156,9 +179,7 @@ class ButtonEnablers:
             ),
             self.layout.start_button.update(interactive=enable_inputs_and_start),
             self.layout.stop_button.update(interactive=enable_stop),
-            self.layout.save_settings_button.update(
-                interactive=enable_inputs_and_start
-            ),
+            self.layout.save_settings_button.update(interactive=enable_live_inputs),
             self.layout.discord_token_save_button.update(
                 interactive=enable_inputs_and_start
             ),
@@ -173,6 +194,8 @@ class ButtonEnablers:
                 # when we're missing a token, be sure to leave the
                 # token textbox enabled!
                 enable = enable_advanced
+            elif enable_live_inputs and self.worker.is_live_applicable(handler):
+                enable = True
             if enable:
                 results.append(handler.enabled())
             else:
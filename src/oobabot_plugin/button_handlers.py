@@ -126,12 +126,22 @@ class ButtonHandlers:
         # so pass each in turn to our input handler
 
         results = []
+        changed_handlers = []
         # iterate over args and input_handlers in parallel
         for new_value, handler in zip(args, self._get_input_handlers().values()):
+            old_value = handler.read_from_settings()
             update = handler.update_component_from_event(new_value)
             results.append(update)
+            if handler.read_from_settings() != old_value:
+                changed_handlers.append(handler)
 
+        # only touch the disk if something actually changed
+        if changed_handlers:
+            self.worker.mark_settings_changed()
         self.worker.save_settings()
+
+        # if the bot is running, push what we can into it
+        self.worker.apply_settings(changed_handlers)
         return results
 
     def _handle_save_discord_token(self, *args):
@@ -261,13 +271,11 @@ class ButtonHandlers:
         # 3. start the bot
 
         save_results = self._handle_save_click(*args)
-        # optimistically declare that we're running so that the buttons
-        # are updated immediately.  If this turns out to be wrong, we'll
-        # fix it in the next periodic update.
-        save_results.append(self.button_enablers.running_state_update(is_running=True))
 
-        # now start the bot!
+        # this returns right away, with the bot in the "starting"
+        # state.  The periodic update will pick up when it's running.
         self.worker.start()
+        save_results.append(self.button_enablers.running_state_update())
 
         return tuple(save_results)
 
@@ -277,6 +285,8 @@ class ButtonHandlers:
         # 2. update the running state text box
         #    This will cascade to other inputs being enabled,
         #    and enable the Start button
-        self.worker.reload()
+        # stopping can take a while, so this returns right away with
+        # the bot in the "stopping" state, rather than tying up the UI
+        self.worker.stop()
 
-        return self.button_enablers.running_state_update(is_running=False)
+        return self.button_enablers.running_state_update()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+An index of the character files in the ./characters folder.
+
+The characters folder can hold thousands of files, and may be
+on a slow network mount, so rather than scanning it every time
+we need a character, we keep an index and only rescan when the
+folder's modification time changes.  Adding, removing or
+renaming a file changes the folder's mtime; editing a file
+doesn't, but that doesn't change which characters exist.
+"""
+
+import os
+import threading
+import time
+import typing
+
+CHARACTERS_FOLDER = "characters"
+
+# when several files have the same name, later extensions
+# win.  This matches the order chat.py checks them in.
+EXTENSIONS = ["yml", "yaml", "json"]
+
+# filesystems can have coarse mtimes, so a file added just
+# after we scanned might not change the folder's mtime.  Don't
+# trust a scan made this soon after the folder last changed.
+MTIME_GRANULARITY_SECONDS = 2.0
+
+
+class _Index(typing.NamedTuple):
+    # (st_mtime_ns, st_ino) of the folder when it was scanned
+    folder_identity: typing.Optional[typing.Tuple[int, int]]
+
+    # sorted character names, without duplicates
+    names: typing.List[str]
+
+    # character name -> absolute path of its file
+    filepaths: typing.Dict[str, str]
+
+    # lower-cased character name -> character name.  If several
+    # names differ only by case, the first one in sorted order wins.
+    names_by_lower_name: typing.Dict[str, str]
+
+    # the values of filepaths, for quick membership checks
+    known_filepaths: typing.FrozenSet[str]
+
+
+_EMPTY_INDEX = _Index(None, [], {}, {}, frozenset())
+
+
+class CharacterCatalog:
+    """
+    Lists the characters in a folder, and maps between character
+    names and their files.  Safe to use from multiple threads.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.index = _EMPTY_INDEX
+        # set if the current index can't be trusted to be complete
+        self.needs_rescan = True
+
+    def character_names(self) -> typing.List[str]:
+        """
+        Returns the names of all characters, sorted.
+        """
+        return list(self._get_index().names)
+
+    def filepath(self, character: str) -> str:
+        """
+        Returns the absolute path to the file for the given character,
+        or the empty string if there's no such character.
+        """
+        return self._get_index().filepaths.get(character, "")
+
+    def character_name(self, filename: str) -> str:
+        """
+        Returns the name of the character stored in the given file,
+        or the empty string if it isn't one of our characters.
+
+        Case may have been lost in the filename, so it's matched
+        against character names case-insensitively.
+        """
+        if not filename:
+            return ""
+        index = self._get_index()
+        # files outside our folder, which we don't know
+        # exist, need to be checked
+        if filename not in index.known_filepaths and not os.path.exists(filename):
+            return ""
+        stem = os.path.splitext(os.path.basename(filename))[0]
+        return index.names_by_lower_name.get(stem.lower(), "")
+
+    def _get_index(self) -> _Index:
+        try:
+            stat = os.stat(self.folder)
+            folder_identity = (stat.st_mtime_ns, stat.st_ino)
+        except OSError:
+            folder_identity = None
+
+        with self.lock:
+            if self.needs_rescan or folder_identity != self.index.folder_identity:
+                self.index = self._scan(folder_identity)
+                self.needs_rescan = folder_identity is not None and (
+                    time.time() - folder_identity[0] / 1e9 < MTIME_GRANULARITY_SECONDS
+                )
+            return self.index
+
+    def _scan(self, folder_identity: typing.Optional[typing.Tuple[int, int]]) -> _Index:
+        if folder_identity is None:
+            return _EMPTY_INDEX
+
+        folder_path = os.path.abspath(os.path.realpath(self.folder))
+        filepaths_by_extension: typing.Dict[str, typing.Dict[str, str]] = {
+            extension: {} for extension in EXTENSIONS
+        }
+        try:
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    name, dot_extension = os.path.splitext(entry.name)
+                    by_name = filepaths_by_extension.get(dot_extension[1:])
+                    if by_name is not None and name:
+                        by_name[name] = os.path.join(folder_path, entry.name)
+        except OSError:
+            return _EMPTY_INDEX
+
+        filepaths: typing.Dict[str, str] = {}
+        for extension in EXTENSIONS:
+            filepaths.update(filepaths_by_extension[extension])
+
+        names = sorted(filepaths)
+        names_by_lower_name: typing.Dict[str, str] = {}
+        for name in names:
+            names_by_lower_name.setdefault(name.lower(), name)
+
+        return _Index(
+            folder_identity,
+            names,
+            filepaths,
+            names_by_lower_name,
+            frozenset(filepaths.values()),
+        )
+
+
+_catalog = CharacterCatalog(CHARACTERS_FOLDER)
+
+
+def get() -> CharacterCatalog:
+    """
+    Returns the catalog of characters in ./characters
+    """
+    return _catalog
@@ -4,13 +4,64 @@ Controller for the oobabot UI plugin.  Contains
 all behavior for the UI, but no UI components.
 """
 
+import datetime
+import json
+import logging
+import re
+import typing
+
 from oobabot_plugin import button_enablers
 from oobabot_plugin import button_handlers
+from oobabot_plugin import fake_bot as fake_bot_module
 from oobabot_plugin import layout
+from oobabot_plugin import log_store
+from oobabot_plugin import status_feed
 from oobabot_plugin import strings
 from oobabot_plugin import transcript_view
 from oobabot_plugin import worker
 
+# what the log search accepts for its time range.  Times
+# without a date are for today.
+LOG_TIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%H:%M:%S",
+    "%H:%M",
+]
+
+
+def _parse_log_time(text: str, is_end: bool) -> typing.Optional[float]:
+    """
+    Returns the time the user typed in, as seconds since the
+    epoch, or None if they left it blank.  If is_end is set,
+    returns the end of the minute or second the user gave,
+    rather than its start.
+    """
+    text = text.strip()
+    if not text:
+        return None
+    for time_format in LOG_TIME_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(text, time_format)
+        except ValueError:
+            continue
+        if "%Y" not in time_format:
+            parsed = datetime.datetime.combine(datetime.date.today(), parsed.time())
+        if is_end:
+            precision = datetime.timedelta(seconds=1 if "%S" in time_format else 60)
+            parsed += precision - datetime.timedelta(microseconds=1)
+        return parsed.timestamp()
+    raise ValueError(f"couldn't understand the time '{text}'")
+
+
+def _parse_call_id(call: str) -> typing.Optional[int]:
+    """
+    Returns the id of a call from the menu of past calls, whose
+    entries start with "#<id> ".
+    """
+    match = re.match(r"#(\d+) ", call)
+    return int(match.group(1)) if match else None
+
 
 class OobabotController:
     """
@@ -24,10 +75,33 @@ class OobabotController:
         port: int,
         config_file: str,
         api_extension_loaded: bool,
+        run_in_subprocess: bool = False,
+        log_spool: bool = False,
+        transcript_archive: bool = False,
+        transcript_window_messages: typing.Optional[int] = None,
+        transcript_window_minutes: typing.Optional[float] = None,
+        coalesce_transcript_tokens: bool = False,
+        fake_bot: typing.Optional[fake_bot_module.FakeBotOptions] = None,
     ):
         self.layout = layout.OobabotLayout()
-        self.worker = worker.OobabotWorker(port, config_file, self.layout)
+        self.worker = worker.OobabotWorker(
+            port,
+            config_file,
+            self.layout,
+            run_in_subprocess=run_in_subprocess,
+            log_spool=log_spool,
+            transcript_archive=transcript_archive,
+            fake_bot=fake_bot,
+        )
         self.api_extension_loaded = api_extension_loaded
+        self.transcript_window_messages = transcript_window_messages
+        self.transcript_window_age = (
+            datetime.timedelta(minutes=transcript_window_minutes)
+            if transcript_window_minutes is not None
+            else None
+        )
+        self.coalesce_transcript_tokens = coalesce_transcript_tokens
+        self.status_feed: typing.Optional[status_feed.StatusFeed] = None
 
     ##################################
     # oobabooga <> extension interface
@@ -44,23 +118,28 @@ class OobabotController:
         )
         stable_diffusion_keywords = [str(x) for x in image_words]
 
-        is_using_character = self.worker.is_using_character(
-            strings.get_available_characters,
-        )
+        is_using_character = self.worker.is_using_character()
 
         t_view = transcript_view.TranscriptView(
             self.worker.get_transcript,
             self.worker.get_fancy_author,
+            coalesce_tokens=self.coalesce_transcript_tokens,
+            window_messages=self.transcript_window_messages,
+            window_age=self.transcript_window_age,
         )
 
         self.layout.layout_ui(
-            get_log_etag=self.worker.get_log_etag,
             has_plausible_token=plausible_token,
             stable_diffusion_keywords=stable_diffusion_keywords,
             api_extension_loaded=self.api_extension_loaded,
             is_using_character=is_using_character,
-            get_transcript_html=t_view.get_html,
             is_voice_enabled=self.worker.is_voice_enabled(),
+            has_log_spool=self.worker.has_log_spool(),
+            has_transcript_archive=self.worker.has_transcript_archive(),
+            has_transcript_window=(
+                self.transcript_window_messages is not None
+                or self.transcript_window_age is not None
+            ),
         )
 
         # create our own handlers for every input event which will map
@@ -83,15 +162,424 @@ class OobabotController:
             is_using_character, self.layout, self.worker, enablers
         )
 
-        # when the log etag changes, update the log html
+        # pushes changes to the browser as they happen.  This isn't
+        # serving anything until it's mounted on the gradio app, which
+        # can only happen once the app is running.
+        self.status_feed = status_feed.StatusFeed(
+            self.worker,
+            enablers.current_running_state,
+            t_view.get_update if self.layout.transcript_html is not None else None,
+        )
+
+        self._init_status_poll(enablers, t_view)
+
+        # when the log etag changes, send the browser whatever lines
+        # it hasn't seen yet, and have it append them to the log html.
+        # Like the status poll, this skips the queue.
         self.layout.log_etag_textbox.change(
-            lambda _etag: self.layout.log_output_html.update(
-                value=self.worker.get_logs(),
-            ),
-            inputs=[self.layout.log_etag_textbox],
-            outputs=[self.layout.log_output_html],
+            self._get_log_update,
+            inputs=[self.layout.log_etag_textbox, self.layout.log_seen_etag_state],
+            outputs=[self.layout.log_seen_etag_state, self.layout.log_update_textbox],
+            queue=False,
+        ).then(
+            None,
+            inputs=[self.layout.log_update_textbox],
+            outputs=None,
+            _js="(update) => { oobabot_apply_log_update(update); }",
         )
 
+        self._init_log_search()
+        self._init_log_history()
+        self._init_transcript_archive()
+        self._init_transcript_window(t_view)
+
         # start the bot if the setting is enabled
         if self.worker.bot.settings.oobabooga_settings.get("plugin_auto_start"):
             self.worker.start()
+
+    def _init_status_poll(
+        self,
+        enablers: button_enablers.ButtonEnablers,
+        t_view: transcript_view.TranscriptView,
+    ) -> None:
+        # rather than each part of the page polling for itself, a
+        # single poll per browser session fetches a version for
+        # every part.  The page copies each version into its own
+        # hidden textbox, whose change event fetches the update,
+        # so only the parts which have changed cost a request.
+        version_keys = ["log", "running_state"]
+        version_textboxes = [
+            self.layout.log_etag_textbox,
+            self.layout.running_state_textbox,
+        ]
+        transcript_version_textbox = self.layout.transcript_version_textbox
+        transcript_update_textbox = self.layout.transcript_update_textbox
+        if transcript_version_textbox is not None:
+            version_keys.append("transcript")
+            version_textboxes.append(transcript_version_textbox)
+            # the page sends the version it's showing, and gets back
+            # only the rows which have changed since then
+            transcript_version_textbox.change(
+                lambda shown_version: self._get_transcript_update(
+                    t_view, shown_version
+                ),
+                inputs=[transcript_version_textbox],
+                outputs=[transcript_update_textbox],
+                _js="(_version) => oobabot_shown_transcript_version()",
+                queue=False,
+            ).then(
+                None,
+                inputs=[transcript_update_textbox],
+                outputs=None,
+                _js="(update) => { oobabot_apply_transcript(update); }",
+            )
+
+        def get_status_versions() -> str:
+            versions: typing.Dict[str, typing.Union[int, str]] = {
+                "log": self.worker.get_log_etag(),
+                # the running state is small enough to be its own version
+                "running_state": enablers.current_running_state(),
+            }
+            if transcript_version_textbox is not None:
+                versions["transcript"] = t_view.get_version()
+            return json.dumps(versions)
+
+        # the page decides how often to poll, depending on whether
+        # anything is changing and whether anyone can see it.
+        #
+        # Polls, and the updates they trigger, are quick and never
+        # block, so they skip gradio's queue and run straight away
+        # on its thread pool.  That way they aren't stuck behind a
+        # slow action, like starting the bot or testing a token.
+        self.layout.status_versions_textbox.attach_load_event(
+            get_status_versions,
+            None,
+        )
+        self.layout.status_poll_button.click(
+            get_status_versions,
+            inputs=None,
+            outputs=[self.layout.status_versions_textbox],
+            queue=False,
+        )
+        self.layout.status_versions_textbox.change(
+            None,
+            inputs=[self.layout.status_versions_textbox],
+            outputs=version_textboxes,
+            _js="(versions, ...current) => oobabot_split_status_versions("
+            + f"versions, {json.dumps(version_keys)}, current)",
+        )
+
+    def _init_log_search(self) -> None:
+        search_inputs = [
+            self.layout.log_search_level_dropdown,
+            self.layout.log_search_logger_dropdown,
+            self.layout.log_search_since_textbox,
+            self.layout.log_search_until_textbox,
+            self.layout.log_search_text_textbox,
+            self.layout.log_search_regex_checkbox,
+        ]
+        search_outputs = [
+            self.layout.log_search_html,
+            self.layout.log_search_logger_dropdown,
+        ]
+        self.layout.log_search_button.click(
+            self._search_logs,
+            inputs=search_inputs,
+            outputs=search_outputs,
+        )
+        # pressing enter in the search box searches too
+        self.layout.log_search_text_textbox.submit(
+            self._search_logs,
+            inputs=search_inputs,
+            outputs=search_outputs,
+        )
+        self.layout.log_search_clear_button.click(
+            lambda: self.layout.log_search_html.update(value="", visible=False),
+            inputs=None,
+            outputs=[self.layout.log_search_html],
+        )
+
+    def _search_logs(
+        self,
+        level: str,
+        logger_name: str,
+        since: str,
+        until: str,
+        text: str,
+        is_regex: bool,
+    ):
+        # the loggers we've heard from change as the bot runs
+        logger_update = self.layout.log_search_logger_dropdown.update(
+            choices=[layout.OobabotLayout.LOG_LOGGER_ALL]
+            + self.worker.get_log_sources(),
+        )
+        min_level = logging.NOTSET
+        if level in layout.OobabotLayout.LOG_LEVELS[1:]:
+            min_level = logging.getLevelName(level)
+        logger_name = (logger_name or "").strip()
+        if logger_name == layout.OobabotLayout.LOG_LOGGER_ALL:
+            logger_name = ""
+
+        try:
+            query = log_store.LogQuery(
+                min_level=min_level,
+                logger_name=logger_name,
+                since=_parse_log_time(since or "", is_end=False),
+                until=_parse_log_time(until or "", is_end=True),
+                pattern=self._make_log_pattern(text or "", is_regex),
+            )
+        except (ValueError, re.error) as err:
+            return (
+                self.layout.log_search_html.update(
+                    value=strings.format_log_search_error(str(err)),
+                    visible=True,
+                ),
+                logger_update,
+            )
+
+        result = self.worker.search_logs(query)
+        return (
+            self.layout.log_search_html.update(
+                value=strings.format_log_search_results(result.lines, result.has_more),
+                visible=True,
+            ),
+            logger_update,
+        )
+
+    @staticmethod
+    def _make_log_pattern(
+        text: str, is_regex: bool
+    ) -> typing.Optional[typing.Pattern[str]]:
+        if not text:
+            return None
+        if is_regex:
+            return re.compile(text)
+        return re.compile(re.escape(text), re.IGNORECASE)
+
+    def _init_log_history(self) -> None:
+        cursor_state = self.layout.log_history_cursor_state
+        newest_button = self.layout.log_history_newest_button
+        older_button = self.layout.log_history_older_button
+        download_button = self.layout.log_history_download_button
+        if (
+            cursor_state is None
+            or newest_button is None
+            or older_button is None
+            or download_button is None
+        ):
+            # the log spool isn't enabled
+            return
+
+        history_outputs = [
+            self.layout.log_history_html,
+            cursor_state,
+            older_button,
+        ]
+        newest_button.click(
+            lambda: self._get_log_history(None),
+            inputs=None,
+            outputs=history_outputs,
+        )
+        older_button.click(
+            self._get_log_history,
+            inputs=[cursor_state],
+            outputs=history_outputs,
+        )
+        download_button.click(
+            self._export_logs,
+            inputs=None,
+            outputs=[self.layout.log_history_file],
+        )
+
+    def _get_log_history(self, cursor: typing.Optional[str]):
+        page = self.worker.get_log_history(cursor)
+        return (
+            self.layout.log_history_html.update(  # type: ignore
+                value=strings.format_log_lines(page.lines),
+            ),
+            page.older_cursor,
+            self.layout.log_history_older_button.update(  # type: ignore
+                interactive=page.older_cursor is not None,
+            ),
+        )
+
+    def _export_logs(self):
+        return self.layout.log_history_file.update(  # type: ignore
+            value=self.worker.export_logs(),
+            visible=True,
+        )
+
+    def _init_transcript_archive(self) -> None:
+        calls_cursor_state = self.layout.archive_calls_cursor_state
+        call_dropdown = self.layout.archive_call_dropdown
+        newest_calls_button = self.layout.archive_newest_calls_button
+        older_calls_button = self.layout.archive_older_calls_button
+        messages_cursor_state = self.layout.archive_messages_cursor_state
+        from_start_button = self.layout.archive_from_start_button
+        next_page_button = self.layout.archive_next_page_button
+        search_textbox = self.layout.archive_search_textbox
+        search_button = self.layout.archive_search_button
+        if (
+            calls_cursor_state is None
+            or call_dropdown is None
+            or newest_calls_button is None
+            or older_calls_button is None
+            or messages_cursor_state is None
+            or from_start_button is None
+            or next_page_button is None
+            or search_textbox is None
+            or search_button is None
+        ):
+            # the transcript archive isn't enabled
+            return
+
+        # fill in the menu of calls whenever the page is loaded
+        call_dropdown.attach_load_event(
+            lambda: self._get_archived_calls(None)[0],
+            None,
+        )
+        calls_outputs = [call_dropdown, calls_cursor_state, older_calls_button]
+        newest_calls_button.click(
+            lambda: self._get_archived_calls(None),
+            inputs=None,
+            outputs=calls_outputs,
+        )
+        older_calls_button.click(
+            self._get_older_archived_calls,
+            inputs=[calls_cursor_state],
+            outputs=calls_outputs,
+        )
+
+        page_outputs = [
+            self.layout.archive_call_html,
+            messages_cursor_state,
+            next_page_button,
+        ]
+        call_dropdown.change(
+            lambda call: self._get_archived_call_page(call, None),
+            inputs=[call_dropdown],
+            outputs=page_outputs,
+        )
+        from_start_button.click(
+            lambda call: self._get_archived_call_page(call, None),
+            inputs=[call_dropdown],
+            outputs=page_outputs,
+        )
+        next_page_button.click(
+            self._get_archived_call_page,
+            inputs=[call_dropdown, messages_cursor_state],
+            outputs=page_outputs,
+        )
+
+        search_button.click(
+            self._search_transcripts,
+            inputs=[search_textbox],
+            outputs=[self.layout.archive_search_html],
+        )
+        # pressing enter in the search box searches too
+        search_textbox.submit(
+            self._search_transcripts,
+            inputs=[search_textbox],
+            outputs=[self.layout.archive_search_html],
+        )
+
+    def _init_transcript_window(self, t_view: transcript_view.TranscriptView) -> None:
+        earlier_count_state = self.layout.earlier_count_state
+        load_earlier_button = self.layout.load_earlier_button
+        if earlier_count_state is None or load_earlier_button is None:
+            # the live transcript isn't windowed
+            return
+
+        # each press shows another page of messages from before the
+        # window, as many as the bot still has
+        load_earlier_button.click(
+            lambda count: self._get_earlier_messages(
+                t_view, count + t_view.EARLIER_MESSAGES_PAGE_SIZE
+            ),
+            inputs=[earlier_count_state],
+            outputs=[
+                self.layout.earlier_html,
+                earlier_count_state,
+                load_earlier_button,
+            ],
+        )
+
+    def _get_earlier_messages(self, t_view: transcript_view.TranscriptView, count: int):
+        html, has_more = t_view.get_earlier_html(count)
+        return (
+            self.layout.earlier_html.update(  # type: ignore
+                value=html,
+                visible=True,
+            ),
+            count,
+            self.layout.load_earlier_button.update(  # type: ignore
+                interactive=has_more,
+            ),
+        )
+
+    def _get_archived_calls(self, before_call_id: typing.Optional[int]):
+        page = self.worker.get_archived_calls(before_call_id)
+        return (
+            self.layout.archive_call_dropdown.update(  # type: ignore
+                choices=[call.describe() for call in page.calls],
+            ),
+            page.older_cursor,
+            self.layout.archive_older_calls_button.update(  # type: ignore
+                interactive=page.older_cursor is not None,
+            ),
+        )
+
+    def _get_older_archived_calls(self, before_call_id: typing.Optional[int]):
+        if before_call_id is None:
+            # the menu still holds the calls from when the page was
+            # loaded, which were the newest page
+            before_call_id = self.worker.get_archived_calls().older_cursor
+        return self._get_archived_calls(before_call_id)
+
+    def _get_archived_call_page(
+        self, call: typing.Optional[str], cursor: typing.Optional[str]
+    ):
+        call_id = _parse_call_id(call or "")
+        if call_id is None:
+            page = worker.ArchivedCallPage("", None)
+        else:
+            page = self.worker.get_archived_call_page(call_id, cursor)
+        return (
+            self.layout.archive_call_html.update(  # type: ignore
+                value=page.html,
+            ),
+            page.next_cursor,
+            self.layout.archive_next_page_button.update(  # type: ignore
+                interactive=page.next_cursor is not None,
+            ),
+        )
+
+    def _search_transcripts(self, text: str):
+        result = self.worker.search_transcripts(text or "")
+        return self.layout.archive_search_html.update(  # type: ignore
+            value=strings.format_transcript_search_results(
+                result.hits, result.has_more
+            ),
+            visible=True,
+        )
+
+    def _get_transcript_update(
+        self, t_view: transcript_view.TranscriptView, shown_version: str
+    ):
+        try:
+            since_version = int(shown_version)
+        except (TypeError, ValueError):
+            since_version = -1
+        update = t_view.get_update(since_version)
+        return self.layout.transcript_update_textbox.update(
+            value=json.dumps(update._asdict()),
+        )
+
+    def _get_log_update(self, _etag: str, seen_etag: int):
+        log_update = self.worker.get_logs(since_etag=seen_etag)
+        return (
+            log_update.etag,
+            self.layout.log_update_textbox.update(
+                value=json.dumps(log_update._asdict()),
+            ),
+        )
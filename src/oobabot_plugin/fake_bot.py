@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+A stand-in for oobabot which doesn't talk to Discord or to the
+streaming API, for load and latency testing the plugin.
+
+It loads its settings like the real bot, and while it's running
+it writes log lines and adds to a voice transcript at set rates,
+so that the UI has realistic work to do on a machine without
+access to either service.
+"""
+
+import collections
+import datetime
+import logging
+import random
+import threading
+import time
+import typing
+
+from oobabot import fancy_logger
+from oobabot import oobabot
+from oobabot import transcript
+from oobabot import types
+
+from oobabot_plugin import transcript_archive
+
+# speakers in the made up voice calls.  The first one is the bot.
+BOT_USER_ID = 1
+USER_IDS = [2, 3, 4, 5]
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while we talk about "
+    + "what to have for dinner and whether it will rain tomorrow"
+).split()
+
+
+class FakeBotOptions(typing.NamedTuple):
+    """
+    How busy the fake bot is, and how slow to start and stop.
+    """
+
+    log_lines_per_second: float = 10.0
+
+    # set to 0 to have voice disabled, as if discrivener
+    # weren't installed
+    voice_messages_per_second: float = 0.5
+
+    # how long start() takes before the bot is up, standing in
+    # for connecting to Discord, and how long it takes to exit
+    # once stop() is called
+    start_seconds: float = 2.0
+    stop_seconds: float = 1.0
+
+    # how long each author lookup takes
+    author_lookup_seconds: float = 0.0
+
+    # the random data is the same on every run with the same seed
+    seed: int = 0
+
+
+def parse_options(text: str) -> FakeBotOptions:
+    """
+    Reads options from a comma-separated list of name=value
+    pairs, e.g. "log_lines_per_second=100,start_seconds=0".
+    Options which aren't given keep their defaults.
+    """
+    values: typing.Dict[str, typing.Any] = {}
+    for pair in text.split(","):
+        if not pair.strip():
+            continue
+        name, _, value = pair.partition("=")
+        name = name.strip()
+        if name not in FakeBotOptions._fields:
+            raise ValueError(
+                f"unknown fake bot option '{name}', "
+                + f"choose from: {', '.join(FakeBotOptions._fields)}"
+            )
+        field_type = FakeBotOptions.__annotations__[name]
+        try:
+            values[name] = field_type(value.strip())
+        except ValueError as err:
+            raise ValueError(f"bad value for fake bot option '{name}': {err}") from err
+    return FakeBotOptions(**values)
+
+
+def make_voice_message(
+    rnd: random.Random, start_time: datetime.datetime
+) -> "types.VoiceMessage":
+    """
+    Returns a made up voice message, from the bot about a fifth
+    of the time and otherwise from one of the users.
+    """
+    if rnd.random() < 0.2:
+        text = " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(5, 40)))
+        return transcript_archive.ArchivedMessage(
+            BOT_USER_ID,
+            start_time,
+            datetime.timedelta(seconds=1),
+            text,
+        )
+    # whisper is usually confident, with the occasional bad patch
+    tokens = []
+    confidence = 90
+    for _ in range(rnd.randint(1, 30)):
+        if rnd.random() < 0.1:
+            confidence = rnd.randint(0, 100)
+        tokens.append((" " + rnd.choice(WORDS), confidence))
+    return transcript_archive.ArchivedUserMessage(
+        rnd.choice(USER_IDS),
+        start_time,
+        datetime.timedelta(seconds=rnd.uniform(0.5, 5.0)),
+        tokens,
+    )
+
+
+def make_transcript(
+    count: int, rnd: random.Random
+) -> typing.List["types.VoiceMessage"]:
+    """
+    Returns a made up voice call, with messages a few seconds apart.
+    """
+    start_time = datetime.datetime(2023, 1, 1)
+    messages = []
+    for _ in range(count):
+        start_time += datetime.timedelta(seconds=rnd.choice([0.2, 0.5, 2, 5]))
+        messages.append(make_voice_message(rnd, start_time))
+    return messages
+
+
+def make_fancy_author(user_id: int) -> "types.FancyAuthor":
+    """
+    Returns display information for one of the made up speakers.
+    """
+    return types.FancyAuthor(
+        user_id=user_id,
+        author_is_bot=user_id == BOT_USER_ID,
+        author_name=f"speaker {user_id}",
+        author_accent_color=(0, 128, 255),
+        author_avatar_url=f"https://example.com/avatars/{user_id}.png",
+    )
+
+
+def make_log_record(rnd: random.Random) -> logging.LogRecord:
+    """
+    Returns a made up log record, like the ones the bot writes.
+    """
+    level = rnd.choice([logging.DEBUG, logging.INFO, logging.INFO, logging.WARNING])
+    return logging.LogRecord(
+        name=fancy_logger.get().name,
+        level=level,
+        pathname=__file__,
+        lineno=0,
+        msg="Request from %s in %s: %s",
+        args=(
+            f"user{rnd.randint(1, 50)}",
+            f"#channel-{rnd.randint(1, 5)}",
+            " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 20))),
+        ),
+        exc_info=None,
+    )
+
+
+class FakeOobabot(oobabot.Oobabot):
+    """
+    Takes the place of oobabot.Oobabot.  Settings are loaded by
+    the real class; everything which would touch Discord or the
+    streaming API is made up.
+
+    There's no runtime, so settings can't be applied live.
+    """
+
+    # how often the bot wakes up to add log lines and messages
+    TICK_SECONDS = 0.05
+
+    def __init__(self, cli_args: typing.List[str], options: FakeBotOptions):
+        super().__init__(cli_args)
+        self.options = options
+        self.rnd = random.Random(options.seed)
+        self.stop_event = threading.Event()
+
+        # like the real bot's transcript, a ring buffer which is
+        # emptied for each new call
+        self.transcript_lock = threading.Lock()
+        self.messages: typing.Deque["types.VoiceMessage"] = collections.deque(
+            maxlen=transcript.Transcript.NUM_LINES
+        )
+
+    def start(self):
+        """
+        Runs the fake bot.  Blocks until stop() is called.
+        """
+        self.stop_event.clear()
+        fancy_logger.get().info("Starting fake oobabot, with %s", self.options)
+        if self.stop_event.wait(self.options.start_seconds):
+            return
+        with self.transcript_lock:
+            self.messages.clear()
+
+        logger = fancy_logger.get()
+        # lines and messages which are due, but not yet written
+        log_lines_due = 0.0
+        messages_due = 0.0
+        last_tick = time.monotonic()
+        while not self.stop_event.wait(self.TICK_SECONDS):
+            now = time.monotonic()
+            elapsed = now - last_tick
+            last_tick = now
+
+            log_lines_due += elapsed * self.options.log_lines_per_second
+            while log_lines_due >= 1:
+                record = make_log_record(self.rnd)
+                if logger.isEnabledFor(record.levelno):
+                    logger.handle(record)
+                log_lines_due -= 1
+
+            messages_due += elapsed * self.options.voice_messages_per_second
+            while messages_due >= 1:
+                message = make_voice_message(self.rnd, datetime.datetime.now())
+                with self.transcript_lock:
+                    self.messages.append(message)
+                messages_due -= 1
+
+        time.sleep(self.options.stop_seconds)
+        fancy_logger.get().info("Fake oobabot stopped")
+
+    def stop(self) -> bool:
+        self.stop_event.set()
+        return True
+
+    @classmethod
+    def test_discord_token(cls, discord_token: str) -> bool:
+        return True
+
+    @classmethod
+    def generate_invite_url(cls, discord_token: str) -> str:
+        return "https://discord.com/oauth2/authorize?client_id=0"
+
+    def is_voice_enabled(self) -> bool:
+        return self.options.voice_messages_per_second > 0
+
+    @property
+    def current_voice_transcript(
+        self,
+    ) -> typing.List["types.VoiceMessage"]:
+        with self.transcript_lock:
+            return list(self.messages)
+
+    def fancy_author_info(self, user_id: int) -> typing.Optional["types.FancyAuthor"]:
+        if user_id != BOT_USER_ID and user_id not in USER_IDS:
+            return None
+        if self.options.author_lookup_seconds:
+            time.sleep(self.options.author_lookup_seconds)
+        return make_fancy_author(user_id)
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+Runs the bot without the web UI, for hosts where loading gradio
+would cost more memory and startup time than the bot itself.
+
+The bot is driven by the same worker, and the same config file,
+as it is from the UI.  Its logs go to stderr, and if it fails it
+is restarted, waiting longer after each failure in a row.
+
+Nothing here may import gradio, directly or through the UI
+modules.
+"""
+
+import logging
+import os
+import shlex
+import signal
+import sys
+import threading
+import time
+import typing
+
+from oobabot import fancy_logger
+
+import oobabot_plugin
+from oobabot_plugin import fake_bot as fake_bot_module
+from oobabot_plugin import worker as oobabot_worker
+
+CMD_FLAGS_FILE = oobabot_plugin.CMD_FLAGS_FILE
+STREAMING_PORT_FLAG = "--api-streaming-port"
+
+# how long to wait before restarting a bot which has failed.  This
+# doubles with each failure in a row, up to the maximum.  Once the
+# bot has been running for a while, the next failure counts as the
+# first again.
+RESTART_DELAY_SECONDS = 5.0
+MAX_RESTART_DELAY_SECONDS = 300.0
+STABLE_RUN_SECONDS = 600.0
+
+# how often to check on the bot
+POLL_SECONDS = 1.0
+
+
+def find_streaming_port(cwd: str, streaming_port: typing.Optional[int]) -> int:
+    """
+    Returns the port of the streaming API.  If it isn't given,
+    this looks for it among the flags text-generation-webui is
+    started with, in case we're run from its root directory.
+    Otherwise, it's the API's default.
+    """
+    if streaming_port:
+        return streaming_port
+
+    path = os.path.join(cwd, CMD_FLAGS_FILE)
+    if not os.path.isfile(path):
+        return oobabot_plugin.DEFAULT_STREAMING_API_PORT
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            # like text-generation-webui, skip commented out lines
+            flags = shlex.split(
+                " ".join(
+                    line
+                    for line in file.read().splitlines()
+                    if not line.strip().startswith("#")
+                )
+            )
+    except (OSError, ValueError) as err:
+        fancy_logger.get().warning(
+            "oobabot_plugin: could not read %s, using the default "
+            + "streaming port: %s",
+            path,
+            err,
+        )
+        return oobabot_plugin.DEFAULT_STREAMING_API_PORT
+
+    for index, flag in enumerate(flags):
+        if flag == STREAMING_PORT_FLAG and index + 1 < len(flags):
+            value = flags[index + 1]
+        elif flag.startswith(STREAMING_PORT_FLAG + "="):
+            value = flag.partition("=")[2]
+        else:
+            continue
+        try:
+            return int(value)
+        except ValueError:
+            fancy_logger.get().warning(
+                "oobabot_plugin: bad %s in %s: %s", STREAMING_PORT_FLAG, path, value
+            )
+    return oobabot_plugin.DEFAULT_STREAMING_API_PORT
+
+
+def _add_console_handler() -> None:
+    # oobabot only logs to the console when it's run from its own
+    # command line, so do that ourselves.  Colors are only for
+    # a terminal, not for a log file or journal.
+    handler = logging.StreamHandler(sys.stderr)
+    if sys.stderr.isatty():
+        handler.setFormatter(
+            fancy_logger.ColorfulLoggingFormatter(
+                coloring_book=fancy_logger.make_coloring_book(
+                    fancy_logger.apply_color_console
+                ),
+            )
+        )
+    else:
+        handler.setFormatter(
+            logging.Formatter("%(asctime)s %(levelname)5s %(message)s")
+        )
+    fancy_logger.get().addHandler(handler)
+
+
+class _Supervisor:
+    """
+    Keeps the bot running until it's asked to stop, restarting
+    it after it fails.
+    """
+
+    def __init__(self, bot_worker: oobabot_worker.OobabotWorker, restart: bool):
+        self.worker = bot_worker
+        self.restart = restart
+        self.stop_event = threading.Event()
+        self.restart_delay = RESTART_DELAY_SECONDS
+        self.restart_at: typing.Optional[float] = None
+        self.running_since: typing.Optional[float] = None
+
+    def request_stop(self, signum: int, _frame: typing.Any) -> None:
+        fancy_logger.get().info(
+            "oobabot_plugin: got %s, stopping oobabot.  Send it again "
+            + "to quit right away.",
+            signal.Signals(signum).name,
+        )
+        self.stop_event.set()
+        # so that a bot which won't stop can't keep us from exiting
+        signal.signal(signum, signal.SIG_DFL)
+
+    def run(self) -> bool:
+        """
+        Starts the bot, and blocks until stop_event is set, or
+        until the bot fails and isn't to be restarted.  Returns
+        False if it failed.
+        """
+        self.worker.start()
+        while not self.stop_event.wait(POLL_SECONDS):
+            if not self._check():
+                return False
+        return True
+
+    def _check(self) -> bool:
+        now = time.monotonic()
+        state = self.worker.get_state()
+        if state == oobabot_worker.RUNNING:
+            self.restart_at = None
+            if self.running_since is None:
+                self.running_since = now
+            elif now - self.running_since >= STABLE_RUN_SECONDS:
+                self.restart_delay = RESTART_DELAY_SECONDS
+            return True
+        if state != oobabot_worker.FAILED:
+            return True
+
+        self.running_since = None
+        if not self.restart:
+            fancy_logger.get().error("oobabot_plugin: oobabot failed, exiting")
+            return False
+        if self.restart_at is None:
+            fancy_logger.get().warning(
+                "oobabot_plugin: restarting oobabot in %.0f seconds",
+                self.restart_delay,
+            )
+            self.restart_at = now + self.restart_delay
+            self.restart_delay = min(
+                self.restart_delay * 2,
+                MAX_RESTART_DELAY_SECONDS,
+            )
+        elif now >= self.restart_at:
+            self.restart_at = None
+            self.worker.start()
+        return True
+
+    def stop(self) -> bool:
+        """
+        Stops the bot, and waits for it.  Returns False if it
+        didn't stop in time.
+        """
+        self.worker.stop()
+        while self.worker.get_state() not in (
+            oobabot_worker.STOPPED,
+            oobabot_worker.FAILED,
+        ):
+            time.sleep(POLL_SECONDS / 10)
+        return not self.worker.is_running()
+
+
+def main(
+    cwd: str,
+    config_file: typing.Optional[str] = None,
+    streaming_port: typing.Optional[int] = None,
+    run_in_subprocess: bool = False,
+    log_spool: bool = False,
+    transcript_archive: bool = False,
+    fake_bot: typing.Optional[str] = None,
+    no_restart: bool = False,
+) -> None:
+    _add_console_handler()
+
+    if config_file is None:
+        config_file = os.path.join(cwd, oobabot_plugin.DEFAULT_CONFIG_FILE)
+    fake_bot_options = None
+    if fake_bot is not None:
+        try:
+            fake_bot_options = fake_bot_module.parse_options(fake_bot)
+        except ValueError as err:
+            print(err, file=sys.stderr)
+            sys.exit(1)
+
+    bot_worker = oobabot_worker.OobabotWorker(
+        find_streaming_port(cwd, streaming_port),
+        config_file,
+        None,
+        run_in_subprocess=run_in_subprocess,
+        log_spool=log_spool,
+        transcript_archive=transcript_archive,
+        fake_bot=fake_bot_options,
+    )
+
+    # the stand-in bot doesn't connect to Discord
+    if fake_bot_options is None and not bot_worker.has_discord_token():
+        # leave a config file with the defaults filled in, to edit
+        bot_worker.save_settings()
+        bot_worker.settings_writer.flush()
+        fancy_logger.get().error(
+            "oobabot_plugin: there's no Discord token in %s.  Add one "
+            + "there, or set it up from the UI, then try again.",
+            os.path.abspath(config_file),
+        )
+        sys.exit(1)
+
+    supervisor = _Supervisor(bot_worker, restart=not no_restart)
+    signal.signal(signal.SIGINT, supervisor.request_stop)
+    signal.signal(signal.SIGTERM, supervisor.request_stop)
+
+    succeeded = supervisor.run()
+    if not supervisor.stop():
+        # the bot's thread can't be killed, and would keep us
+        # from exiting
+        bot_worker.settings_writer.flush()
+        os._exit(1)  # pylint: disable=protected-access
+    if not succeeded:
+        sys.exit(1)
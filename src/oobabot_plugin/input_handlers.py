@@ -6,12 +6,13 @@ components and oobabot settings.
 
 
 import abc
-import pathlib
 import typing
 
 import gradio as gr
 import oobabot.overengineered_settings_parser
 
+from oobabot_plugin import character_catalog
+
 
 class ComponentToSetting(abc.ABC):
     """
@@ -36,6 +37,13 @@ class ComponentToSetting(abc.ABC):
         its value.
         """
 
+    @abc.abstractmethod
+    def setting_names(self) -> typing.List[str]:
+        """
+        Returns the names of the settings that this component
+        writes to.
+        """
+
     def init_component_from_setting(self):
         def init_component():
             return self.component.update(
@@ -85,6 +93,9 @@ class SimpleComponentToSetting(ComponentToSetting):
         val = self.settings_group.get(self.setting_name)
         return val
 
+    def setting_names(self) -> typing.List[str]:
+        return [self.setting_name]
+
 
 class CharacterComponentToSetting(SimpleComponentToSetting):
     """
@@ -95,49 +106,43 @@ class CharacterComponentToSetting(SimpleComponentToSetting):
     character selection.
     """
 
-    FOLDER = "characters"
-
     def __init__(
         self,
         component: gr.components.IOComponent,
         settings_group: oobabot.overengineered_settings_parser.ConfigSettingGroup,
         setting_name: str,
         fn_get_character_list: typing.Callable[[], typing.List[str]],
+        fn_on_choices_loaded: typing.Optional[
+            typing.Callable[[typing.List[str]], None]
+        ] = None,
     ):
+        """
+        fn_on_choices_loaded: called with the list of characters
+            whenever it's sent to the dropdown
+        """
         super().__init__(component, settings_group, setting_name)
         self.fn_get_character_list = fn_get_character_list
+        self.fn_on_choices_loaded = fn_on_choices_loaded
+
+    def _get_choices(self) -> typing.List[str]:
+        choices = self.fn_get_character_list()
+        if self.fn_on_choices_loaded is not None:
+            self.fn_on_choices_loaded(choices)
+        return choices
 
     @classmethod
     def character_name_to_filepath(cls, character: str) -> str:
-        # this is how it's done in chat.py... there's no method to
-        # call, so just do the same thing here
-        filename = ""
-        for extension in ["yml", "yaml", "json"]:
-            filepath = pathlib.Path(f"{cls.FOLDER}/{character}.{extension}")
-            if filepath.exists():
-                filename = str(filepath.resolve())
-        return filename
+        # like chat.py, if there are several files for the
+        # character, the .json wins, then .yaml, then .yml
+        return character_catalog.get().filepath(character)
 
     def write_to_settings(self, new_value: str) -> None:
         filename = self.character_name_to_filepath(new_value)
         super().write_to_settings(filename)
 
     @classmethod
-    def filename_to_character_name(
-        cls,
-        filename: str,
-        fn_get_character_list: typing.Callable[[], typing.List[str]],
-    ) -> str:
-        if not filename:
-            return ""
-        path = pathlib.Path(str(filename))
-        if not path.exists():
-            return ""
-        characters = fn_get_character_list()
-        for character in characters:
-            if character.lower() == path.stem.lower():
-                return character
-        return ""
+    def filename_to_character_name(cls, filename: str) -> str:
+        return character_catalog.get().character_name(filename)
 
     def read_from_settings(self) -> str:
         # turning the path back into the character name just means
@@ -147,16 +152,13 @@ class CharacterComponentToSetting(SimpleComponentToSetting):
         # also, the file may no longer exist, in that case we'll just
         # return the empty string
         filename = super().read_from_settings()
-        return self.filename_to_character_name(
-            str(filename),
-            self.fn_get_character_list,
-        )
+        return self.filename_to_character_name(str(filename))
 
     def update_component_from_event(self, new_value: str) -> dict:
         self.write_to_settings(new_value)
         result = self.component.update(
             value=self.read_from_settings(),
-            choices=self.fn_get_character_list(),
+            choices=self._get_choices(),
         )
         return result
 
@@ -170,7 +172,7 @@ class CharacterComponentToSetting(SimpleComponentToSetting):
             return self.component.update(
                 value=character_name,
                 interactive=True,
-                choices=self.fn_get_character_list(),
+                choices=self._get_choices(),
             )
 
         self.component.attach_load_event(
@@ -262,6 +264,9 @@ class ResponseRadioComponentToSetting(ComponentToSetting):
             bool(self.settings_group.get("stream_responses")),
         )
 
+    def setting_names(self) -> typing.List[str]:
+        return ["dont_split_responses", "stream_responses"]
+
 
 class CheckboxGroupToSetting(ComponentToSetting):
     """
@@ -294,3 +299,6 @@ class CheckboxGroupToSetting(ComponentToSetting):
             if self.settings_group.get(option_setting):
                 options_on.append(option_ui_string)
         return options_on
+
+    def setting_names(self) -> typing.List[str]:
+        return [option_setting for option_setting, _ in self.options]
@@ -12,7 +12,7 @@ import os
 import shutil
 import sys
 
-from oobabot_plugin import server
+import oobabot_plugin
 
 
 def ensure_in_oobabooga_dir(cwd: str) -> None:
@@ -94,25 +94,277 @@ def main():
     )
     subparsers = parser.add_subparsers()
 
-    subparsers.add_parser("server", help="Run our standalone web server.").set_defaults(
-        func=server.web_main
+    server_parser = subparsers.add_parser(
+        "server", help="Run our standalone web server."
     )
+    server_parser.add_argument(
+        "--host",
+        default=oobabot_plugin.DEFAULT_SERVER_HOST,
+        help="Address to listen on (default: %(default)s).",
+    )
+    server_parser.add_argument(
+        "--port",
+        type=int,
+        default=oobabot_plugin.DEFAULT_SERVER_PORT,
+        help="Port to listen on (default: %(default)s).",
+    )
+    server_parser.add_argument(
+        "--concurrency-count",
+        type=int,
+        default=oobabot_plugin.DEFAULT_SERVER_CONCURRENCY_COUNT,
+        help="How many queued actions, like starting the bot or testing "
+        + "a token, can run at once (default: %(default)s).  Status "
+        + "updates don't wait in this queue.",
+    )
+    server_parser.add_argument(
+        "--max-size",
+        type=int,
+        help="How many actions can wait in the queue before more are "
+        + "turned away (default: no limit).",
+    )
+    server_parser.add_argument(
+        "--max-threads",
+        type=int,
+        default=oobabot_plugin.DEFAULT_SERVER_MAX_THREADS,
+        help="Size of the thread pool that runs all requests, queued or "
+        + "not (default: %(default)s).",
+    )
+    server_parser.add_argument(
+        "--run-in-subprocess",
+        action="store_true",
+        help="Run the bot in a separate process from the web server.",
+    )
+    server_parser.add_argument(
+        "--log-spool",
+        action="store_true",
+        help="Also keep the bot's logs on disk, next to the config file.",
+    )
+    server_parser.add_argument(
+        "--transcript-archive",
+        action="store_true",
+        help="Keep the transcripts of past voice calls on disk, "
+        + "next to the config file.",
+    )
+    server_parser.add_argument(
+        "--transcript-window-messages",
+        type=int,
+        metavar="N",
+        help="Only show the newest N messages of the live voice transcript.",
+    )
+    server_parser.add_argument(
+        "--transcript-window-minutes",
+        type=float,
+        metavar="T",
+        help="Only show the last T minutes of the live voice transcript.",
+    )
+    server_parser.add_argument(
+        "--coalesce-transcript-tokens",
+        action="store_true",
+        help="In the live voice transcript, render runs of words with "
+        + "similar confidence as one element, rather than one per word.  "
+        + "Less for the browser to lay out, but more to download.",
+    )
+    server_parser.add_argument(
+        "--fake-bot",
+        nargs="?",
+        const="",
+        metavar="OPTIONS",
+        help="Run a stand-in for the bot which makes up logs and voice "
+        + "transcripts, rather than connecting to Discord.  For load testing.  "
+        + "OPTIONS are name=value pairs separated by commas, e.g. "
+        + "log_lines_per_second=100,voice_messages_per_second=2",
+    )
+    server_parser.set_defaults(subcommand="server")
+
+    run_parser = subparsers.add_parser(
+        "run",
+        help="Run the bot without the web UI, restarting it if it fails.",
+    )
+    run_parser.add_argument(
+        "--config-file",
+        metavar="FILE",
+        help="The bot's config file, as written by the UI "
+        + f"(default: {oobabot_plugin.DEFAULT_CONFIG_FILE}).",
+    )
+    run_parser.add_argument(
+        "--streaming-port",
+        type=int,
+        help="Port of text-generation-webui's streaming API.  If not given, "
+        + f"it's read from {oobabot_plugin.CMD_FLAGS_FILE}, if run from the "
+        + "root directory of an oobabooga install, or else defaults to "
+        + f"{oobabot_plugin.DEFAULT_STREAMING_API_PORT}.",
+    )
+    run_parser.add_argument(
+        "--run-in-subprocess",
+        action="store_true",
+        help="Run the bot in a child process.",
+    )
+    run_parser.add_argument(
+        "--log-spool",
+        action="store_true",
+        help="Also keep the bot's logs on disk, next to the config file.",
+    )
+    run_parser.add_argument(
+        "--transcript-archive",
+        action="store_true",
+        help="Keep the transcripts of past voice calls on disk, "
+        + "next to the config file.",
+    )
+    run_parser.add_argument(
+        "--fake-bot",
+        nargs="?",
+        const="",
+        metavar="OPTIONS",
+        help="Run a stand-in for the bot, as for the server's --fake-bot.",
+    )
+    run_parser.add_argument(
+        "--no-restart",
+        action="store_true",
+        help="Exit if the bot fails, rather than restarting it.",
+    )
+    run_parser.set_defaults(subcommand="run")
+
+    benchmark_parser = subparsers.add_parser(
+        "benchmark",
+        help="Time the plugin's hot paths on synthetic data.",
+    )
+    benchmark_parser.add_argument(
+        "--scales",
+        type=int,
+        nargs="+",
+        metavar="SCALE",
+        help="Multiples of production data sizes to run at "
+        + "(default: "
+        + " ".join(str(s) for s in oobabot_plugin.DEFAULT_BENCHMARK_SCALES)
+        + ").",
+    )
+    benchmark_parser.add_argument(
+        "--only",
+        nargs="+",
+        metavar="BENCHMARK",
+        help="Only run these benchmarks (default: all of them).",
+    )
+    benchmark_parser.add_argument(
+        "--output",
+        metavar="FILE",
+        help="Write the results as JSON to this file, rather than stdout.",
+    )
+    benchmark_parser.add_argument(
+        "--compare",
+        metavar="FILE",
+        help="Compare the results with an earlier run's JSON.",
+    )
+    benchmark_parser.set_defaults(subcommand="benchmark")
+
+    load_test_parser = subparsers.add_parser(
+        "load-test",
+        help="Simulate many browsers using the standalone server.",
+    )
+    load_test_parser.add_argument(
+        "--url",
+        help="Test the server already running here, rather than starting "
+        + "one with a stand-in bot.",
+    )
+    load_test_parser.add_argument(
+        "--server-pid",
+        type=int,
+        help="With --url, the process id of that server, so that its CPU "
+        + "and memory use can be measured.",
+    )
+    load_test_parser.add_argument(
+        "--port",
+        type=int,
+        default=oobabot_plugin.DEFAULT_SERVER_PORT,
+        help="Port to start the server on (default: %(default)s).",
+    )
+    load_test_parser.add_argument(
+        "--server-args",
+        default="",
+        metavar="ARGS",
+        help="Other options for the server it starts, e.g. "
+        + '"--concurrency-count 4 --max-threads 80".',
+    )
+    load_test_parser.add_argument(
+        "--clients",
+        type=int,
+        nargs="+",
+        metavar="N",
+        help="How many browsers to simulate, in each stage of the test "
+        + "(default: "
+        + " ".join(str(n) for n in oobabot_plugin.DEFAULT_LOAD_TEST_CLIENTS)
+        + ").",
+    )
+    load_test_parser.add_argument(
+        "--seconds",
+        type=float,
+        default=oobabot_plugin.DEFAULT_LOAD_TEST_STAGE_SECONDS,
+        help="How long each stage runs (default: %(default)s).",
+    )
+    load_test_parser.add_argument(
+        "--poll-ms",
+        type=float,
+        default=oobabot_plugin.DEFAULT_LOAD_TEST_POLL_SECONDS * 1000,
+        help="How often each browser polls for status (default: %(default)s).",
+    )
+    load_test_parser.add_argument(
+        "--fake-bot",
+        dest="fake_bot_options",
+        default=oobabot_plugin.DEFAULT_LOAD_TEST_FAKE_BOT_OPTIONS,
+        metavar="OPTIONS",
+        help="Options for the stand-in bot, as for the server's --fake-bot "
+        + "(default: %(default)s).",
+    )
+    load_test_parser.add_argument(
+        "--output",
+        metavar="FILE",
+        help="Write the results as JSON to this file, rather than stdout.",
+    )
+    load_test_parser.set_defaults(subcommand="load-test")
 
     subparsers.add_parser("install", help="Install the oobabot plugin.").set_defaults(
-        func=do_install
+        subcommand="install"
     )
 
     subparsers.add_parser(
         "uninstall", help="Uninstall the oobabot plugin."
-    ).set_defaults(func=do_uninstall)
+    ).set_defaults(subcommand="uninstall")
 
     args = parser.parse_args()
-    if not args or not hasattr(args, "func"):
+    if not args or not hasattr(args, "subcommand"):
         parser.print_help()
         sys.exit(0)
 
+    # pass any subcommand options along as keyword arguments
+    kwargs = vars(args)
+    subcommand = kwargs.pop("subcommand")
+
+    # pylint: disable=import-outside-toplevel
+    # only import what the subcommand needs.  The others pull in
+    # oobabot, gradio or aiohttp, which are slow to load.
+    if subcommand == "server":
+        from oobabot_plugin import server
+
+        func = server.web_main
+    elif subcommand == "run":
+        from oobabot_plugin import headless
+
+        func = headless.main
+    elif subcommand == "benchmark":
+        from oobabot_plugin import benchmark
+
+        func = benchmark.main
+    elif subcommand == "load-test":
+        from oobabot_plugin import load_test
+
+        func = load_test.main
+    elif subcommand == "install":
+        func = do_install
+    else:
+        func = do_uninstall
+    # pylint: enable=import-outside-toplevel
+
     cwd = os.getcwd()
-    args.func(cwd)
+    func(cwd, **kwargs)
 
 
 # python main
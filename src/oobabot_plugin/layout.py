@@ -77,6 +77,26 @@ class OobabotLayout:
 
         self.transcript_markdown: typing.Optional[gr.Markdown]
         self.transcript_html: typing.Optional[gr.HTML]
+        self.transcript_version_textbox: typing.Optional[gr.Textbox]
+        self.transcript_update_textbox: typing.Optional[gr.Textbox]
+
+        # these are only created if the transcript archive is enabled
+        self.archive_calls_cursor_state: typing.Optional[gr.State] = None
+        self.archive_call_dropdown: typing.Optional[gr.Dropdown] = None
+        self.archive_newest_calls_button: typing.Optional[gr.Button] = None
+        self.archive_older_calls_button: typing.Optional[gr.Button] = None
+        self.archive_messages_cursor_state: typing.Optional[gr.State] = None
+        self.archive_from_start_button: typing.Optional[gr.Button] = None
+        self.archive_next_page_button: typing.Optional[gr.Button] = None
+        self.archive_call_html: typing.Optional[gr.HTML] = None
+        self.archive_search_textbox: typing.Optional[gr.Textbox] = None
+        self.archive_search_button: typing.Optional[gr.Button] = None
+        self.archive_search_html: typing.Optional[gr.HTML] = None
+
+        # these are only created if the live transcript is windowed
+        self.earlier_count_state: typing.Optional[gr.State] = None
+        self.load_earlier_button: typing.Optional[gr.Button] = None
+        self.earlier_html: typing.Optional[gr.HTML] = None
 
         #############################################
         # Runtime section
@@ -88,18 +108,40 @@ class OobabotLayout:
         self.plugin_auto_start_checkbox: gr.Checkbox
         self.stop_button: gr.Button
         self.log_etag_textbox: gr.Textbox
+        self.log_seen_etag_state: gr.State
+        self.log_update_textbox: gr.Textbox
         self.log_output_html: gr.HTML
+        self.log_search_level_dropdown: gr.Dropdown
+        self.log_search_logger_dropdown: gr.Dropdown
+        self.log_search_since_textbox: gr.Textbox
+        self.log_search_until_textbox: gr.Textbox
+        self.log_search_text_textbox: gr.Textbox
+        self.log_search_regex_checkbox: gr.Checkbox
+        self.log_search_button: gr.Button
+        self.log_search_clear_button: gr.Button
+        self.log_search_html: gr.HTML
+        # these are only created if the log spool is enabled
+        self.log_history_cursor_state: typing.Optional[gr.State] = None
+        self.log_history_newest_button: typing.Optional[gr.Button] = None
+        self.log_history_older_button: typing.Optional[gr.Button] = None
+        self.log_history_download_button: typing.Optional[gr.Button] = None
+        self.log_history_file: typing.Optional[gr.File] = None
+        self.log_history_html: typing.Optional[gr.HTML] = None
         self.running_state_textbox: gr.Textbox
+        self.running_state_refresh_button: gr.Button
+        self.status_versions_textbox: gr.Textbox
+        self.status_poll_button: gr.Button
 
     def layout_ui(
         self,
-        get_log_etag: typing.Callable[[], int],
         has_plausible_token: bool,
         stable_diffusion_keywords: typing.List[str],
         api_extension_loaded: bool,
         is_using_character: bool,
-        get_transcript_html: typing.Callable[[], str],
         is_voice_enabled: bool,
+        has_log_spool: bool = False,
+        has_transcript_archive: bool = False,
+        has_transcript_window: bool = False,
     ) -> None:
         with gr.Blocks():
             self.tab_config = gr.Tab(
@@ -127,10 +169,7 @@ class OobabotLayout:
                             is_using_character,
                         )
                     with gr.Column(scale=2):
-                        self._init_runtime_ui(
-                            get_log_etag,
-                            api_extension_loaded,
-                        )
+                        self._init_runtime_ui(api_extension_loaded, has_log_spool)
 
             with self.tab_advanced:
                 self._init_advanced_ui()
@@ -138,6 +177,8 @@ class OobabotLayout:
             if self.tab_audio is None:
                 self.transcript_markdown = None
                 self.transcript_html = None
+                self.transcript_version_textbox = None
+                self.transcript_update_textbox = None
             else:
                 with self.tab_audio:
                     with gr.Column():
@@ -145,12 +186,89 @@ class OobabotLayout:
                             strings.get_transcript_markdown(),
                             elem_classes="oobabot-transcript-markdown",
                         )
+                        if has_transcript_archive:
+                            self._init_transcript_archive_ui()
+                        if has_transcript_window:
+                            self._init_transcript_window_ui()
                         self.transcript_html = gr.HTML(
                             label="Oobabot Transcript",
-                            value=get_transcript_html,
-                            every=strings.QUICK_UPDATE_INTERVAL_SECONDS,
+                            value="",
                             elem_classes=["oobabot-audio-output"],
                         )
+                        # changes whenever the transcript does, and
+                        # is used to trigger an update of its html
+                        self.transcript_version_textbox = gr.Textbox(
+                            value="",
+                            interactive=False,
+                            visible=False,
+                            elem_id="oobabot-transcript-version",
+                        )
+                        # the rows of the transcript which have changed,
+                        # as JSON.  These are applied to transcript_html
+                        # by oobabot_log.js, which only keeps the part
+                        # that's on screen in the page.
+                        self.transcript_update_textbox = gr.Textbox(
+                            value="",
+                            interactive=False,
+                            visible=False,
+                            elem_id="oobabot-transcript-update",
+                        )
+
+    def _init_transcript_archive_ui(self) -> None:
+        # looks back through the transcripts of earlier calls,
+        # which are kept on disk
+        with gr.Accordion(
+            "Past Calls", open=False, elem_id="oobabot-transcript-archive"
+        ):
+            # where the page of calls in the menu ends, so that we
+            # know where to read the page of older calls from
+            self.archive_calls_cursor_state = gr.State(None)
+            with gr.Row():
+                self.archive_call_dropdown = gr.Dropdown(
+                    label="Call",
+                    choices=[],
+                    value=None,
+                    interactive=True,
+                )
+                self.archive_newest_calls_button = gr.Button(value="Newest Calls")
+                self.archive_older_calls_button = gr.Button(value="Older Calls")
+
+            # where the page of messages being shown ends
+            self.archive_messages_cursor_state = gr.State(None)
+            with gr.Row():
+                self.archive_from_start_button = gr.Button(value="From Start")
+                self.archive_next_page_button = gr.Button(
+                    value="Next Page",
+                    interactive=False,
+                )
+            self.archive_call_html = gr.HTML(
+                value="",
+                elem_classes=["oobabot-transcript-archive-call"],
+            )
+
+            with gr.Row():
+                self.archive_search_textbox = gr.Textbox(
+                    label="Search past calls",
+                    placeholder="words to look for",
+                    interactive=True,
+                )
+                self.archive_search_button = gr.Button(value="Search")
+            self.archive_search_html = gr.HTML(
+                value="",
+                visible=False,
+                elem_classes=["oobabot-transcript-search-results"],
+            )
+
+    def _init_transcript_window_ui(self) -> None:
+        # the live transcript only shows the newest messages, so
+        # these show the ones from before them, when asked for
+        self.earlier_count_state = gr.State(0)
+        self.load_earlier_button = gr.Button(value="Load Earlier Messages")
+        self.earlier_html = gr.HTML(
+            value="",
+            visible=False,
+            elem_classes=["oobabot-transcript-earlier"],
+        )
 
     #############################################
     # Configuration tab
@@ -382,10 +500,14 @@ class OobabotLayout:
     # Runtime tab
     #############################################
 
+    LOG_LEVEL_ALL = "All"
+    LOG_LEVELS = [LOG_LEVEL_ALL, "DEBUG", "INFO", "WARNING", "ERROR"]
+    LOG_LOGGER_ALL = "All"
+
     def _init_runtime_ui(
         self,
-        get_log_etag: typing.Callable[[], int],
         api_extension_loaded: bool,
+        has_log_spool: bool,
     ) -> None:
         with gr.Row():
             self.start_button = gr.Button(
@@ -408,6 +530,26 @@ class OobabotLayout:
                 visible=False,
                 elem_id="oobabot-is-running",
             )
+            # clicked by oobabot_log.js when the status feed
+            # tells it that the running state has changed
+            self.running_state_refresh_button = gr.Button(
+                visible=False,
+                elem_id="oobabot-running-state-refresh",
+            )
+            # the versions of the log, running state and transcript,
+            # as JSON.  oobabot_log.js polls for this by clicking the
+            # poll button, as often as it sees fit, and copies each
+            # version into the textbox which triggers its update.
+            self.status_versions_textbox = gr.Textbox(
+                "",
+                interactive=False,
+                visible=False,
+                elem_id="oobabot-status-versions",
+            )
+            self.status_poll_button = gr.Button(
+                visible=False,
+                elem_id="oobabot-status-poll",
+            )
 
         self.status_html = gr.HTML(
             strings.status_heading(""),
@@ -419,18 +561,110 @@ class OobabotLayout:
                 + "`Oobabot` will not work unless it is enabled.",
                 elem_id="oobabot-api-not-loaded",
             )
+        self._init_log_search_ui()
+        if has_log_spool:
+            self._init_log_history_ui()
         with gr.Row():
             # this value changes every time the log is updated
-            # it is used to trigger a full HTML update
+            # it is used to trigger an update of the log html
             self.log_etag_textbox = gr.Textbox(
-                value=get_log_etag,
-                every=strings.QUICK_UPDATE_INTERVAL_SECONDS,
+                value="",
                 interactive=False,
                 visible=False,
                 elem_id="oobabot-log-etag",
             )
-            self.log_output_html = gr.HTML(
+            # the etag of the last log update this browser session
+            # has applied, so that we only need to send it new lines
+            self.log_seen_etag_state = gr.State(-1)
+            # the update itself, as JSON.  This is applied to
+            # log_output_html by oobabot_log.js, rather than by
+            # re-rendering the whole log.
+            self.log_update_textbox = gr.Textbox(
                 value="",
+                interactive=False,
+                visible=False,
+                elem_id="oobabot-log-update",
+            )
+            self.log_output_html = gr.HTML(
+                value='<div class="oobabot-log"></div>',
                 label="Oobabot Log",
+                elem_id="oobabot-log-output",
                 elem_classes=["oobabot-output"],
             )
+
+    def _init_log_search_ui(self) -> None:
+        # the search runs on the server, against everything the log
+        # store holds, and only the matching lines are sent back
+        with gr.Accordion("Search Logs", open=False, elem_id="oobabot-log-search"):
+            with gr.Row():
+                self.log_search_level_dropdown = gr.Dropdown(
+                    choices=self.LOG_LEVELS,
+                    value=self.LOG_LEVEL_ALL,
+                    label="Lowest level",
+                    interactive=True,
+                )
+                self.log_search_logger_dropdown = gr.Dropdown(
+                    choices=[self.LOG_LOGGER_ALL],
+                    value=self.LOG_LOGGER_ALL,
+                    label="Logger",
+                    info="Also includes its child loggers.",
+                    allow_custom_value=True,
+                    interactive=True,
+                )
+                self.log_search_since_textbox = gr.Textbox(
+                    label="From",
+                    placeholder="HH:MM[:SS] or YYYY-MM-DD HH:MM[:SS]",
+                    interactive=True,
+                )
+                self.log_search_until_textbox = gr.Textbox(
+                    label="To",
+                    placeholder="HH:MM[:SS] or YYYY-MM-DD HH:MM[:SS]",
+                    interactive=True,
+                )
+            with gr.Row():
+                self.log_search_text_textbox = gr.Textbox(
+                    label="Message contains",
+                    interactive=True,
+                )
+                self.log_search_regex_checkbox = gr.Checkbox(
+                    label="Regular expression",
+                    value=False,
+                    interactive=True,
+                )
+                self.log_search_button = gr.Button(
+                    value="🔍 Search",
+                    elem_id="oobabot-log-search-button",
+                )
+                self.log_search_clear_button = gr.Button(
+                    value="Clear",
+                    elem_id="oobabot-log-search-clear",
+                )
+            self.log_search_html = gr.HTML(
+                value="",
+                visible=False,
+                elem_classes=["oobabot-output", "oobabot-log-search-results"],
+            )
+
+    def _init_log_history_ui(self) -> None:
+        # pages back through the logs kept on disk, which go back
+        # further than the log panel, and survive restarts
+        with gr.Accordion("Log History", open=False, elem_id="oobabot-log-history"):
+            # where the page being shown starts, so that we know
+            # where to read the page before it from
+            self.log_history_cursor_state = gr.State(None)
+            with gr.Row():
+                self.log_history_newest_button = gr.Button(value="Newest")
+                self.log_history_older_button = gr.Button(
+                    value="Older",
+                    interactive=False,
+                )
+                self.log_history_download_button = gr.Button(value="Download")
+            self.log_history_file = gr.File(
+                label="Oobabot Logs",
+                interactive=False,
+                visible=False,
+            )
+            self.log_history_html = gr.HTML(
+                value="",
+                elem_classes=["oobabot-output", "oobabot-log-history"],
+            )
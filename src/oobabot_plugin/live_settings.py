@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+Applies settings changes to a running bot, for the settings
+where that can be done without reconnecting to discord.
+
+oobabot copies its settings into its runtime objects when
+it starts, so each setting here knows which of those objects
+to update.  Any setting not listed here only takes effect the
+next time the bot is started.
+
+The bot reads those objects on its event loop, so that's where
+they're changed.
+"""
+
+import asyncio
+from concurrent import futures
+import re
+import typing
+
+from oobabot import fancy_logger
+from oobabot import oobabot
+from oobabot import runtime as oobabot_runtime
+from oobabot import settings as oobabot_settings
+
+ApplyFn = typing.Callable[[oobabot_runtime.Runtime, oobabot_settings.Settings], None]
+
+# how long to wait for the bot's event loop to get around to
+# applying the settings
+APPLY_TIMEOUT_SECONDS = 5.0
+
+
+def _apply_wakewords(
+    runtime: oobabot_runtime.Runtime,
+    settings: oobabot_settings.Settings,
+) -> None:
+    persona = runtime.persona
+    wakewords = [str(word) for word in settings.persona_settings.get_list("wakewords")]
+    # when the persona comes from a character file, Persona also
+    # listens for the character's name
+    if (
+        settings.persona_settings.get_str("persona_file")
+        and persona.ai_name
+        and persona.ai_name not in wakewords
+    ):
+        wakewords.append(persona.ai_name)
+
+    # the voice client holds on to this same list, so change it
+    # in place.  A voice call already in progress keeps the
+    # wakewords it started with.
+    persona.wakewords[:] = wakewords
+    persona.wakeword_patterns = [
+        re.compile(rf"\b{wakeword}\b", re.IGNORECASE) for wakeword in wakewords
+    ]
+
+
+def _apply_history(
+    runtime: oobabot_runtime.Runtime,
+    settings: oobabot_settings.Settings,
+) -> None:
+    discord_settings = settings.discord_settings
+    dont_split_responses = bool(discord_settings.get("dont_split_responses"))
+
+    prompt_generator = runtime.prompt_generator
+    prompt_generator.history_lines = discord_settings.get("history_lines")
+    prompt_generator.dont_split_responses = dont_split_responses
+    # the space left over for history depends on both of these
+    # pylint: disable-next=protected-access
+    prompt_generator._init_history_available_chars()
+
+    runtime.discord_bot.dont_split_responses = dont_split_responses
+    runtime.discord_bot.stream_responses = bool(
+        discord_settings.get("stream_responses")
+    )
+
+
+def _apply_ignore_dms(
+    runtime: oobabot_runtime.Runtime,
+    settings: oobabot_settings.Settings,
+) -> None:
+    ignore_dms = bool(settings.discord_settings.get("ignore_dms"))
+    runtime.decide_to_respond.ignore_dms = ignore_dms
+    runtime.discord_bot.ignore_dms = ignore_dms
+
+
+def _apply_reply_in_thread(
+    runtime: oobabot_runtime.Runtime,
+    settings: oobabot_settings.Settings,
+) -> None:
+    reply_in_thread = bool(settings.discord_settings.get("reply_in_thread"))
+    runtime.bot_commands.reply_in_thread = reply_in_thread
+    runtime.discord_bot.reply_in_thread = reply_in_thread
+
+
+def _apply_extra_prompt_text(
+    runtime: oobabot_runtime.Runtime,
+    settings: oobabot_settings.Settings,
+) -> None:
+    # if stable diffusion is off, it picks this up when it's
+    # turned on, which needs a restart anyway
+    if runtime.stable_diffusion_client is not None:
+        runtime.stable_diffusion_client.extra_prompt_text = (
+            settings.stable_diffusion_settings.get_str("extra_prompt_text")
+        )
+
+
+def _apply_nothing(
+    _runtime: oobabot_runtime.Runtime,
+    _settings: oobabot_settings.Settings,
+) -> None:
+    # this setting is only used by the plugin, not the bot
+    pass
+
+
+# setting name -> function which applies it to a running bot
+LIVE_SETTINGS: typing.Dict[str, ApplyFn] = {
+    "wakewords": _apply_wakewords,
+    "history_lines": _apply_history,
+    "dont_split_responses": _apply_history,
+    "stream_responses": _apply_history,
+    "ignore_dms": _apply_ignore_dms,
+    "reply_in_thread": _apply_reply_in_thread,
+    "extra_prompt_text": _apply_extra_prompt_text,
+    "plugin_auto_start": _apply_nothing,
+}
+
+
+def is_live(setting_name: str) -> bool:
+    """
+    Returns True if the setting can be changed while the
+    bot is running.
+    """
+    return setting_name in LIVE_SETTINGS
+
+
+def apply(bot: oobabot.Oobabot, setting_names: typing.Iterable[str]) -> bool:
+    """
+    Pushes the bot's current values for the given settings
+    into its runtime.  Settings which can't be applied live
+    are ignored.
+
+    Returns False if the bot has no runtime to apply them to,
+    or if its event loop didn't apply them in time.
+    """
+    # several settings can share the same function, only call it once
+    apply_fns: typing.List[ApplyFn] = []
+    for setting_name in setting_names:
+        apply_fn = LIVE_SETTINGS.get(setting_name)
+        if apply_fn is not None and apply_fn not in apply_fns:
+            apply_fns.append(apply_fn)
+
+    # the bot can't start or stop its runtime while we hold this.
+    # Starting holds it while the bot tests its connections, which
+    # can take a while, so don't wait forever.
+    # pylint: disable-next=consider-using-with
+    if not bot.runtime_lock.acquire(timeout=APPLY_TIMEOUT_SECONDS):
+        fancy_logger.get().warning(
+            "oobabot_plugin: the bot is busy, so the settings will take "
+            + "effect when it restarts"
+        )
+        return False
+    try:
+        runtime = bot.runtime
+        if runtime is None:
+            return False
+        return _apply_on_loop(runtime, bot.settings, apply_fns)
+    finally:
+        bot.runtime_lock.release()
+
+
+def _apply_on_loop(
+    runtime: oobabot_runtime.Runtime,
+    settings: oobabot_settings.Settings,
+    apply_fns: typing.List[ApplyFn],
+) -> bool:
+    def apply_all() -> None:
+        for apply_fn in apply_fns:
+            apply_fn(runtime, settings)
+
+    # until the bot has connected to discord, there's no loop
+    # reading the runtime, so it's safe to change it from here
+    loop = runtime.discord_bot.loop
+    if not isinstance(loop, asyncio.AbstractEventLoop):
+        apply_all()
+        return True
+
+    done: futures.Future = futures.Future()
+
+    def apply_on_loop() -> None:
+        try:
+            apply_all()
+        except Exception as err:  # pylint: disable=broad-except
+            done.set_exception(err)
+        else:
+            done.set_result(None)
+
+    try:
+        loop.call_soon_threadsafe(apply_on_loop)
+    except RuntimeError as err:
+        # the loop has already been closed
+        fancy_logger.get().warning(
+            "oobabot_plugin: could not apply settings to the bot: %s", err
+        )
+        return False
+    try:
+        # raises whatever the apply functions raised
+        done.result(timeout=APPLY_TIMEOUT_SECONDS)
+    except futures.TimeoutError:
+        fancy_logger.get().warning(
+            "oobabot_plugin: the bot didn't apply settings within %.1f seconds",
+            APPLY_TIMEOUT_SECONDS,
+        )
+        return False
+    return True
@@ -0,0 +1,636 @@
+# -*- coding: utf-8 -*-
+"""
+A load generator for the standalone server.
+
+It runs the server with a stand-in bot (see fake_bot.py), then
+simulates browser sessions against it, each doing what
+oobabot_log.js does in a page which is being looked at: run the
+page's load events, poll for status versions as fast as the
+page ever does, and fetch the log, transcript and running state
+updates whenever their versions change.
+
+The number of sessions is stepped up in stages, and for each
+stage it reports request latency percentiles, how long requests
+waited in gradio's queue, requests which failed or were late,
+and the server's CPU and memory use:
+
+    oobabot-plugin load-test --clients 1 10 50 100 --output load.json
+"""
+
+import asyncio
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+import uuid
+
+import aiohttp
+from oobabot import settings as oobabot_settings
+
+import oobabot_plugin
+from oobabot_plugin import fake_bot
+
+DEFAULT_CLIENTS = oobabot_plugin.DEFAULT_LOAD_TEST_CLIENTS
+DEFAULT_STAGE_SECONDS = oobabot_plugin.DEFAULT_LOAD_TEST_STAGE_SECONDS
+DEFAULT_POLL_SECONDS = oobabot_plugin.DEFAULT_LOAD_TEST_POLL_SECONDS
+DEFAULT_FAKE_BOT_OPTIONS = oobabot_plugin.DEFAULT_LOAD_TEST_FAKE_BOT_OPTIONS
+
+REQUEST_TIMEOUT_SECONDS = 30.0
+SERVER_START_TIMEOUT_SECONDS = 120.0
+SAMPLE_INTERVAL_SECONDS = 1.0
+
+# what each kind of request is, by the element which triggers it
+POLL = "poll"
+LOG_UPDATE = "log_update"
+TRANSCRIPT_UPDATE = "transcript_update"
+RUNNING_STATE = "running_state"
+LOAD = "load"
+
+_TRIGGERS = {
+    POLL: ("oobabot-status-poll", "click"),
+    LOG_UPDATE: ("oobabot-log-etag", "change"),
+    TRANSCRIPT_UPDATE: ("oobabot-transcript-version", "change"),
+    RUNNING_STATE: ("oobabot-is-running", "change"),
+}
+
+
+class Endpoints(typing.NamedTuple):
+    """
+    The gradio functions a page calls, found in the server's config.
+    """
+
+    # kind -> fn_index, for the kinds the page has
+    fn_indexes: typing.Dict[str, int]
+
+    # the fn_index of each load event which runs on the server
+    load_fn_indexes: typing.List[int]
+
+    # the fn_indexes which go through gradio's queue, rather
+    # than being called directly
+    queued: typing.Set[int]
+
+
+def find_endpoints(config: typing.Dict[str, typing.Any]) -> Endpoints:
+    """
+    Finds the functions the page calls in a gradio config.
+    """
+    elem_ids = {
+        component["id"]: component.get("props", {}).get("elem_id")
+        for component in config["components"]
+    }
+    # the server queues every event unless it's told not to
+    queue_by_default = config.get("enable_queue", False)
+    fn_indexes = {}
+    load_fn_indexes = []
+    queued = set()
+    for fn_index, dependency in enumerate(config["dependencies"]):
+        if not dependency["backend_fn"]:
+            continue
+        if dependency["queue"] or (dependency["queue"] is None and queue_by_default):
+            queued.add(fn_index)
+        if dependency["trigger"] == "load":
+            load_fn_indexes.append(fn_index)
+            continue
+        for kind, (elem_id, trigger) in _TRIGGERS.items():
+            if dependency["trigger"] == trigger and any(
+                elem_ids.get(target) == elem_id for target in dependency["targets"]
+            ):
+                fn_indexes.setdefault(kind, fn_index)
+    if POLL not in fn_indexes or LOG_UPDATE not in fn_indexes:
+        raise ValueError("this doesn't look like the oobabot-plugin server")
+    return Endpoints(fn_indexes, load_fn_indexes, queued)
+
+
+def _percentile(sorted_values: typing.List[float], percent: float) -> float:
+    # nearest rank
+    index = max(0, int(len(sorted_values) * percent / 100.0 + 0.5) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def _summarize(seconds: typing.List[float]) -> typing.Dict[str, float]:
+    if not seconds:
+        return {}
+    values = sorted(seconds)
+    return {
+        "p50_ms": _percentile(values, 50) * 1000,
+        "p90_ms": _percentile(values, 90) * 1000,
+        "p99_ms": _percentile(values, 99) * 1000,
+        "max_ms": values[-1] * 1000,
+    }
+
+
+class _Stats:
+    """
+    What happened to the requests made during one stage.
+    """
+
+    def __init__(self) -> None:
+        # kind -> seconds from making the request to its result
+        self.latencies: typing.Dict[str, typing.List[float]] = {}
+        # kind -> seconds spent waiting in gradio's queue
+        self.queue_waits: typing.Dict[str, typing.List[float]] = {}
+        # kind -> requests which failed, timed out, or were
+        # turned away because the queue was full
+        self.failed: typing.Dict[str, int] = {}
+        # polls which were due while the previous one was
+        # still waiting for its result
+        self.late_polls = 0
+        # updates which had to send everything, rather than just
+        # what changed, because the session had fallen behind
+        self.resyncs = 0
+
+    def add(
+        self, kind: str, latency: float, queue_wait: typing.Optional[float]
+    ) -> None:
+        self.latencies.setdefault(kind, []).append(latency)
+        if queue_wait is not None:
+            self.queue_waits.setdefault(kind, []).append(queue_wait)
+
+    def add_failure(self, kind: str) -> None:
+        self.failed[kind] = self.failed.get(kind, 0) + 1
+
+    def requests(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        result = {}
+        for kind, latencies in self.latencies.items():
+            summary: typing.Dict[str, float] = {"count": len(latencies)}
+            summary.update(_summarize(latencies))
+            queue_summary = _summarize(self.queue_waits.get(kind, []))
+            summary.update(
+                {"queue_" + name: value for name, value in queue_summary.items()}
+            )
+            result[kind] = summary
+        return result
+
+
+class _Session:
+    """
+    One simulated browser session.
+    """
+
+    def __init__(
+        self,
+        http: aiohttp.ClientSession,
+        url: str,
+        endpoints: Endpoints,
+        stats: _Stats,
+        poll_seconds: float,
+    ):
+        self.http = http
+        self.url = url
+        self.endpoints = endpoints
+        self.stats = stats
+        self.poll_seconds = poll_seconds
+        self.session_hash = uuid.uuid4().hex[:11]
+        self.versions: typing.Dict[str, typing.Any] = {}
+        self.transcript_version = -1
+        self.seen_log_update = False
+        self.seen_transcript_update = False
+        self.tasks: typing.Set["asyncio.Task[None]"] = set()
+
+    async def call(
+        self, kind: str, fn_index: int, data: typing.List[typing.Any]
+    ) -> typing.Optional[typing.List[typing.Any]]:
+        """
+        Calls a gradio function the way the page would, and
+        returns its outputs, or None if it failed.
+        """
+        started = time.monotonic()
+        try:
+            if fn_index in self.endpoints.queued:
+                queue_wait, output = await asyncio.wait_for(
+                    self._call_queued(fn_index, data), REQUEST_TIMEOUT_SECONDS
+                )
+            else:
+                queue_wait = None
+                output = await asyncio.wait_for(
+                    self._call_direct(fn_index, data), REQUEST_TIMEOUT_SECONDS
+                )
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            output = None
+        if output is None:
+            self.stats.add_failure(kind)
+            return None
+        self.stats.add(kind, time.monotonic() - started, queue_wait)
+        return output
+
+    async def _call_direct(
+        self, fn_index: int, data: typing.List[typing.Any]
+    ) -> typing.Optional[typing.List[typing.Any]]:
+        async with self.http.post(
+            self.url + "/run/predict",
+            json={
+                "data": data,
+                "fn_index": fn_index,
+                "session_hash": self.session_hash,
+                "event_data": None,
+            },
+        ) as response:
+            if response.status != 200:
+                return None
+            return (await response.json())["data"]
+
+    async def _call_queued(
+        self, fn_index: int, data: typing.List[typing.Any]
+    ) -> typing.Tuple[typing.Optional[float], typing.Optional[typing.List[typing.Any]]]:
+        started = time.monotonic()
+        queue_wait = None
+        ws_url = "ws" + self.url[len("http") :] + "/queue/join"
+        async with self.http.ws_connect(ws_url) as socket:
+            async for message in socket:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                body = json.loads(message.data)
+                if body["msg"] == "send_hash":
+                    await socket.send_json(
+                        {"fn_index": fn_index, "session_hash": self.session_hash}
+                    )
+                elif body["msg"] == "send_data":
+                    await socket.send_json(
+                        {
+                            "data": data,
+                            "event_data": None,
+                            "fn_index": fn_index,
+                            "session_hash": self.session_hash,
+                        }
+                    )
+                elif body["msg"] == "process_starts":
+                    queue_wait = time.monotonic() - started
+                elif body["msg"] == "process_completed":
+                    if not body.get("success"):
+                        return (queue_wait, None)
+                    return (queue_wait, body["output"]["data"])
+                elif body["msg"] == "queue_full":
+                    return (None, None)
+        return (None, None)
+
+    def _spawn(self, coroutine: typing.Coroutine[typing.Any, typing.Any, None]):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, stop: asyncio.Event) -> None:
+        # the page runs all of its load events at once
+        await asyncio.gather(
+            *(
+                self.call(LOAD, fn_index, [])
+                for fn_index in self.endpoints.load_fn_indexes
+            )
+        )
+        poll: typing.Optional["asyncio.Task[None]"] = None
+        while not stop.is_set():
+            if poll is not None and not poll.done():
+                self.stats.late_polls += 1
+            poll = asyncio.ensure_future(self._poll())
+            self.tasks.add(poll)
+            poll.add_done_callback(self.tasks.discard)
+            try:
+                await asyncio.wait_for(stop.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+        if self.tasks:
+            await asyncio.wait(list(self.tasks), timeout=REQUEST_TIMEOUT_SECONDS)
+
+    async def _poll(self) -> None:
+        output = await self.call(POLL, self.endpoints.fn_indexes[POLL], [])
+        if not output:
+            return
+        versions = json.loads(_value(output[0]))
+        changed = [
+            kind
+            for kind, version in versions.items()
+            if self.versions.get(kind) != version
+        ]
+        self.versions = versions
+        if "log" in changed:
+            self._spawn(self._update_log(versions["log"]))
+        if "transcript" in changed and TRANSCRIPT_UPDATE in self.endpoints.fn_indexes:
+            self._spawn(self._update_transcript())
+        if "running_state" in changed and RUNNING_STATE in self.endpoints.fn_indexes:
+            self._spawn(self._update_running_state(versions["running_state"]))
+
+    async def _update_log(self, etag: int) -> None:
+        # the seen etag is kept in the session's state on the server
+        output = await self.call(
+            LOG_UPDATE, self.endpoints.fn_indexes[LOG_UPDATE], [str(etag), None]
+        )
+        if not output:
+            return
+        update = json.loads(_value(output[-1]))
+        if self.seen_log_update and not update["is_delta"]:
+            self.stats.resyncs += 1
+        self.seen_log_update = True
+
+    async def _update_transcript(self) -> None:
+        output = await self.call(
+            TRANSCRIPT_UPDATE,
+            self.endpoints.fn_indexes[TRANSCRIPT_UPDATE],
+            [str(self.transcript_version)],
+        )
+        if not output:
+            return
+        update = json.loads(_value(output[0]))
+        if update["version"] < self.transcript_version:
+            # an older request finished after a newer one
+            return
+        if self.seen_transcript_update and not update["is_delta"]:
+            self.stats.resyncs += 1
+        self.seen_transcript_update = True
+        self.transcript_version = update["version"]
+
+    async def _update_running_state(self, running_state: str) -> None:
+        await self.call(
+            RUNNING_STATE, self.endpoints.fn_indexes[RUNNING_STATE], [running_state]
+        )
+
+
+def _value(output: typing.Any) -> typing.Any:
+    # outputs are either values, or component updates holding them
+    if isinstance(output, dict):
+        return output.get("value")
+    return output
+
+
+class _ProcessSampler:
+    """
+    Samples a process's CPU and memory use, from /proc.  On
+    systems without /proc, there's nothing to report.
+    """
+
+    def __init__(self, pid: typing.Optional[int]):
+        self.pid = pid
+        self.cpu_percents: typing.List[float] = []
+        self.rss_bytes: typing.List[int] = []
+
+    def _read(self) -> typing.Optional[typing.Tuple[float, int]]:
+        if self.pid is None:
+            return None
+        try:
+            with open(f"/proc/{self.pid}/stat", "r", encoding="utf-8") as file:
+                # the command name can contain spaces, but not ")"
+                fields = file.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{self.pid}/statm", "r", encoding="utf-8") as file:
+                resident_pages = int(file.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        return (cpu_seconds, resident_pages * os.sysconf("SC_PAGE_SIZE"))
+
+    async def run(self, stop: asyncio.Event) -> None:
+        previous = self._read()
+        previous_time = time.monotonic()
+        while previous is not None and not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), SAMPLE_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            sample = self._read()
+            now = time.monotonic()
+            if sample is None:
+                return
+            self.cpu_percents.append(
+                100.0 * (sample[0] - previous[0]) / (now - previous_time)
+            )
+            self.rss_bytes.append(sample[1])
+            previous, previous_time = sample, now
+
+    def summary(self) -> typing.Dict[str, typing.Optional[float]]:
+        if not self.cpu_percents:
+            return {
+                "cpu_percent_mean": None,
+                "cpu_percent_max": None,
+                "rss_mb_max": None,
+            }
+        return {
+            "cpu_percent_mean": sum(self.cpu_percents) / len(self.cpu_percents),
+            "cpu_percent_max": max(self.cpu_percents),
+            "rss_mb_max": max(self.rss_bytes) / (1024 * 1024),
+        }
+
+
+async def _get_config(
+    http: aiohttp.ClientSession, url: str, timeout: float
+) -> typing.Dict[str, typing.Any]:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with http.get(url + "/config") as response:
+                if response.status == 200:
+                    return await response.json()
+        except aiohttp.ClientError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"no server answered at {url}")
+        await asyncio.sleep(1.0)
+
+
+async def _wait_until_running(
+    http: aiohttp.ClientSession, url: str, endpoints: Endpoints
+) -> None:
+    # the bot is started by the plugin_auto_start setting, and
+    # there's nothing much to measure until it's up
+    stats = _Stats()
+    session = _Session(http, url, endpoints, stats, DEFAULT_POLL_SECONDS)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        output = await session.call(POLL, endpoints.fn_indexes[POLL], [])
+        if output and json.loads(_value(output[0])).get("running_state") == "running":
+            return
+        await asyncio.sleep(1.0)
+    print("the bot didn't start, measuring anyway", file=sys.stderr)
+
+
+async def _run_stage(
+    http: aiohttp.ClientSession,
+    url: str,
+    endpoints: Endpoints,
+    clients: int,
+    seconds: float,
+    poll_seconds: float,
+    server_pid: typing.Optional[int],
+) -> typing.Dict[str, typing.Any]:
+    stats = _Stats()
+    stop = asyncio.Event()
+    sessions = [
+        _Session(http, url, endpoints, stats, poll_seconds) for _ in range(clients)
+    ]
+    sampler = _ProcessSampler(server_pid)
+    started = time.monotonic()
+    tasks = [asyncio.ensure_future(session.run(stop)) for session in sessions]
+    sampler_task = asyncio.ensure_future(sampler.run(stop))
+    await asyncio.sleep(seconds)
+    stop.set()
+    await asyncio.gather(*tasks, sampler_task)
+
+    result: typing.Dict[str, typing.Any] = {
+        "clients": clients,
+        "seconds": time.monotonic() - started,
+        "requests": stats.requests(),
+        "failed": stats.failed,
+        "late_polls": stats.late_polls,
+        "resyncs": stats.resyncs,
+    }
+    result.update(sampler.summary())
+    return result
+
+
+def _format_stage(result: typing.Dict[str, typing.Any]) -> str:
+    poll = result["requests"].get(POLL, {})
+    failed = sum(result["failed"].values())
+    cpu = result["cpu_percent_mean"]
+    rss = result["rss_mb_max"]
+    return (
+        f"{result['clients']:>5} clients: "
+        + f"poll p50 {poll.get('p50_ms', 0):.1f} ms, "
+        + f"p99 {poll.get('p99_ms', 0):.1f} ms, "
+        + f"{failed} failed, {result['late_polls']} late polls, "
+        + f"{result['resyncs']} resyncs, "
+        + (f"cpu {cpu:.0f}%, " if cpu is not None else "")
+        + (f"rss {rss:.0f} MB" if rss is not None else "")
+    )
+
+
+async def run_load_test(
+    url: str,
+    clients: typing.List[int],
+    seconds: float,
+    poll_seconds: float,
+    server_pid: typing.Optional[int] = None,
+) -> typing.List[typing.Dict[str, typing.Any]]:
+    """
+    Runs a stage for each number of clients against the server at
+    url, and returns what happened in each.  If server_pid is given,
+    the server's CPU and memory use are sampled too.
+    """
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        config = await _get_config(http, url, SERVER_START_TIMEOUT_SECONDS)
+        endpoints = find_endpoints(config)
+        await _wait_until_running(http, url, endpoints)
+        results = []
+        for count in clients:
+            result = await _run_stage(
+                http, url, endpoints, count, seconds, poll_seconds, server_pid
+            )
+            print(_format_stage(result), file=sys.stderr)
+            results.append(result)
+        return results
+
+
+def _write_config(folder: str) -> None:
+    settings = oobabot_settings.Settings()
+    config_file = os.path.join(folder, oobabot_plugin.DEFAULT_CONFIG_FILE)
+    settings.load(["--config", config_file])
+    settings.oobabooga_settings.set("plugin_auto_start", True)
+    with open(config_file, "w", encoding="utf-8") as file:
+        settings.write_to_stream(file)
+
+
+def launch_server(
+    folder: str, fake_bot_options: str, server_args: typing.List[str]
+) -> subprocess.Popen:
+    """
+    Starts the standalone server, with a stand-in bot, in the
+    given folder.  Its output goes to server.log there.
+    """
+    # check these now, rather than have the server fail to start
+    fake_bot.parse_options(fake_bot_options)
+    _write_config(folder)
+    with open(os.path.join(folder, "server.log"), "wb") as log_file:
+        return subprocess.Popen(  # pylint: disable=consider-using-with
+            [
+                sys.executable,
+                "-m",
+                "oobabot_plugin.install",
+                "server",
+                "--fake-bot",
+                fake_bot_options,
+                *server_args,
+            ],
+            cwd=folder,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+        )
+
+
+def _print_server_log(folder: str, lines: int = 40) -> None:
+    try:
+        with open(os.path.join(folder, "server.log"), "r", encoding="utf-8") as file:
+            tail = file.readlines()[-lines:]
+    except OSError:
+        return
+    print("last lines from the server:", file=sys.stderr)
+    print("".join(tail), file=sys.stderr)
+
+
+def results_to_json(
+    results: typing.List[typing.Dict[str, typing.Any]],
+    options: typing.Dict[str, typing.Any],
+) -> str:
+    return json.dumps(
+        {"created": time.time(), "options": options, "stages": results},
+        indent=2,
+    )
+
+
+def main(
+    _cwd: str,
+    url: typing.Optional[str] = None,
+    server_pid: typing.Optional[int] = None,
+    port: int = oobabot_plugin.DEFAULT_SERVER_PORT,
+    server_args: str = "",
+    clients: typing.Optional[typing.List[int]] = None,
+    seconds: float = DEFAULT_STAGE_SECONDS,
+    poll_ms: float = DEFAULT_POLL_SECONDS * 1000,
+    fake_bot_options: str = DEFAULT_FAKE_BOT_OPTIONS,
+    output: typing.Optional[str] = None,
+) -> None:
+    """
+    Runs the load test against the server at url, or if that's
+    not given, against a server it starts with a stand-in bot,
+    on the given port and with any other server_args.
+    Writes the results as JSON to the output file, or to stdout.
+    """
+    clients = clients or DEFAULT_CLIENTS
+    options = {
+        "clients": clients,
+        "seconds": seconds,
+        "poll_ms": poll_ms,
+        "fake_bot": fake_bot_options if url is None else None,
+        "server_args": server_args if url is None else None,
+    }
+    with tempfile.TemporaryDirectory(prefix="oobabot-load-test-") as folder:
+        server = None
+        if url is None:
+            server = launch_server(
+                folder,
+                fake_bot_options,
+                ["--port", str(port), *shlex.split(server_args)],
+            )
+            server_pid = server.pid
+            url = f"http://localhost:{port}"
+        try:
+            results = asyncio.run(
+                run_load_test(url, clients, seconds, poll_ms / 1000, server_pid)
+            )
+        except Exception:
+            if server is not None:
+                _print_server_log(folder)
+            raise
+        finally:
+            if server is not None:
+                server.terminate()
+                try:
+                    server.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    server.kill()
+
+    results_json = results_to_json(results, options)
+    if output:
+        with open(output, "w", encoding="utf-8") as file:
+            file.write(results_json + "\n")
+    else:
+        print(results_json)
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+Keeps the bot's logs on disk, so that they survive restarts.
+
+Log lines are appended to segment files in a folder next to the
+config file.  Once a segment reaches its size limit, a new one
+is started, and once there are too many segments, the oldest
+is deleted, so the spool never grows past a fixed size.
+
+Each record is written as a single line, with any newlines in
+its message escaped, so that lines can be read back starting
+from any point in the spool.  Reads go through memory-mapped
+segments, so paging back through history doesn't need to read
+whole files, or hold them in memory.
+"""
+
+import logging
+import mmap
+import os
+import re
+import shutil
+import typing
+
+from oobabot import fancy_logger
+
+from oobabot_plugin import log_store
+
+SEGMENT_PREFIX = "oobabot-"
+SEGMENT_SUFFIX = ".log"
+SEGMENT_PATTERN = re.compile(
+    re.escape(SEGMENT_PREFIX) + r"(\d+)" + re.escape(SEGMENT_SUFFIX)
+)
+
+# the folder, next to the config file, which holds the segments
+DEFAULT_FOLDER_NAME = "oobabot-logs"
+
+_ESCAPES = {"\\": "\\\\", "\n": "\\n", "\r": "\\r"}
+_ESCAPE_PATTERN = re.compile(r"[\\\n\r]")
+_UNESCAPES = {value: key for key, value in _ESCAPES.items()}
+_UNESCAPE_PATTERN = re.compile(r"\\[\\nr]")
+
+
+def _escape(text: str) -> str:
+    return _ESCAPE_PATTERN.sub(lambda match: _ESCAPES[match.group()], text)
+
+
+def _unescape(text: str) -> str:
+    return _UNESCAPE_PATTERN.sub(lambda match: _UNESCAPES[match.group()], text)
+
+
+def segment_name(number: int) -> str:
+    return f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}"
+
+
+class SpoolLine(typing.NamedTuple):
+    """
+    A single log line read back from the spool.
+    """
+
+    timestamp: str
+    levelname: str
+    logger_name: str
+    message: str
+
+    @classmethod
+    def parse(cls, line: str) -> "SpoolLine":
+        # timestamps contain a space, so there are five fields
+        fields = line.split(" ", 4)
+        if len(fields) < 5:
+            # not something we wrote, show it as-is
+            return cls("", "", "", _unescape(line))
+        date, clock, levelname, logger_name, message = fields
+        return cls(f"{date} {clock}", levelname, logger_name, _unescape(message))
+
+    def to_html(self) -> str:
+        levelno = logging.getLevelName(self.levelname)
+        if not isinstance(levelno, int):
+            levelno = logging.NOTSET
+        return log_store.format_html(
+            self.timestamp, levelno, self.levelname, self.message
+        )
+
+
+class SpoolPage(typing.NamedTuple):
+    """
+    A page of lines read back from the spool, oldest first.
+    """
+
+    lines: typing.List[SpoolLine]
+
+    # pass this back to read the page before this one, or None
+    # if this page reaches the start of the spool
+    older_cursor: typing.Optional[str]
+
+
+class LogSpool(logging.Handler):
+    """
+    A logging handler which appends log lines to a rotating
+    set of size-capped segment files.
+    """
+
+    DEFAULT_SEGMENT_BYTES = 4 * 1024 * 1024
+    DEFAULT_MAX_SEGMENTS = 16
+
+    def __init__(
+        self,
+        folder: str,
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+        max_segments: int = DEFAULT_MAX_SEGMENTS,
+    ):
+        super().__init__()
+        self.folder = folder
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        os.makedirs(folder, exist_ok=True)
+
+        # carry on from whatever segments are already there
+        self.segments = self._find_segments()
+        if not self.segments:
+            self.segments = [1]
+        # opened when first needed.  Like logging.FileHandler, we
+        # reopen the file if we're written to after being closed,
+        # since logging.config closes every handler it finds,
+        # even ones it leaves attached to their loggers.
+        self.file: typing.Optional[typing.BinaryIO] = None
+
+    def _find_segments(self) -> typing.List[int]:
+        numbers = []
+        for filename in os.listdir(self.folder):
+            match = SEGMENT_PATTERN.fullmatch(filename)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def _segment_path(self, number: int) -> str:
+        return os.path.join(self.folder, segment_name(number))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # logging.Handler.handle() holds our lock while calling this
+        try:
+            message = record.getMessage()
+            if record.exc_info and not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            if record.exc_text:
+                message = f"{message}\n{record.exc_text}"
+            line = " ".join(
+                (
+                    log_store.format_timestamp(record.created),
+                    record.levelname,
+                    record.name.replace(" ", "_"),
+                    _escape(message),
+                )
+            )
+            data = (line + "\n").encode("utf-8", errors="replace")
+
+            if self.file is None:
+                self.file = self._open_segment()
+            if self.file.tell() > 0 and self.file.tell() + len(data) > (
+                self.segment_bytes
+            ):
+                self._rotate()
+                self.file = self._open_segment()
+            self.file.write(data)
+            # readers map the file, so it needs to be on disk
+            self.file.flush()
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def _open_segment(self) -> typing.BinaryIO:
+        return open(  # pylint: disable=consider-using-with
+            self._segment_path(self.segments[-1]), "ab"
+        )
+
+    def _rotate(self) -> None:
+        if self.file is not None:
+            self.file.close()
+        self.segments.append(self.segments[-1] + 1)
+        while len(self.segments) > self.max_segments:
+            try:
+                os.remove(self._segment_path(self.segments[0]))
+            except OSError:
+                # it may still be open for reading somewhere that
+                # won't let us delete it.  Leave it behind rather
+                # than stop logging.
+                pass
+            del self.segments[0]
+
+    def close(self) -> None:
+        self.acquire()
+        try:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        finally:
+            self.release()
+        super().close()
+
+    def read_page(self, count: int, cursor: typing.Optional[str] = None) -> SpoolPage:
+        """
+        Returns up to count lines, ending just before the cursor
+        from an earlier page, or the newest lines if there's no
+        cursor.
+        """
+        self.acquire()
+        try:
+            segments = list(self.segments)
+        finally:
+            self.release()
+
+        if cursor is None:
+            segment_index = len(segments) - 1
+            end: typing.Optional[int] = None
+        else:
+            number, offset = (int(part) for part in cursor.split(":"))
+            # if the segment has rotated away, there's nothing older
+            if number not in segments:
+                return SpoolPage([], None)
+            segment_index = segments.index(number)
+            end = offset
+
+        # collected newest first, since we're reading backwards
+        lines: typing.List[SpoolLine] = []
+        older_cursor: typing.Optional[str] = None
+        while segment_index >= 0:
+            number = segments[segment_index]
+            start, segment_lines = self._read_segment_tail(
+                number, end, count - len(lines)
+            )
+            lines.extend(segment_lines)
+            if start > 0:
+                older_cursor = f"{number}:{start}"
+                break
+            if len(lines) >= count:
+                if segment_index > 0:
+                    older_cursor = f"{segments[segment_index - 1]}:-1"
+                break
+            segment_index -= 1
+            end = None
+
+        lines.reverse()
+        return SpoolPage(lines, older_cursor)
+
+    def _read_segment_tail(
+        self, number: int, end: typing.Optional[int], count: int
+    ) -> typing.Tuple[int, typing.List[SpoolLine]]:
+        """
+        Reads up to count lines from the given segment, ending at
+        the byte offset end, or at the end of the segment if end
+        is None or negative.  Returns the lines, newest first, and
+        the offset of the oldest of them.
+        """
+        try:
+            with open(self._segment_path(number), "rb") as file:
+                size = os.fstat(file.fileno()).st_size
+                if size == 0:
+                    return (0, [])
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if end is None or end < 0 or end > size:
+                        # a line might still be being written, so
+                        # stop at the end of the last complete one
+                        end = mapped.rfind(b"\n") + 1
+                    lines = []
+                    position = end
+                    while position > 0 and len(lines) < count:
+                        start = mapped.rfind(b"\n", 0, position - 1) + 1
+                        lines.append(
+                            SpoolLine.parse(
+                                mapped[start : position - 1].decode(
+                                    "utf-8", errors="replace"
+                                )
+                            )
+                        )
+                        position = start
+                    return (position, lines)
+        except (OSError, ValueError):
+            # the segment was rotated away while we were reading it
+            return (0, [])
+
+    def export(self, destination: typing.BinaryIO) -> None:
+        """
+        Copies every segment, oldest first, into the given file.
+        """
+        self.acquire()
+        try:
+            segments = list(self.segments)
+        finally:
+            self.release()
+        for number in segments:
+            try:
+                with open(self._segment_path(number), "rb") as file:
+                    shutil.copyfileobj(file, destination)
+            except OSError:
+                pass
+
+
+def folder_for_config(config_file: str) -> str:
+    """
+    Returns the folder to spool logs to, given the config file.
+    """
+    return os.path.join(
+        os.path.dirname(os.path.abspath(config_file)), DEFAULT_FOLDER_NAME
+    )
+
+
+def install(folder: str) -> LogSpool:
+    """
+    Has the bot's logger write its records to a spool in the
+    given folder.  If it's already doing that, as it will be
+    when the UI is reloaded, returns the existing spool.
+    """
+    logger = fancy_logger.get()
+    for handler in logger.handlers:
+        if isinstance(handler, LogSpool) and handler.folder == folder:
+            return handler
+    spool = LogSpool(folder)
+    logger.addHandler(spool)
+    return spool
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+Keeps the bot's recent log records, for display in the UI.
+
+oobabot's own log buffer formats every record as HTML as soon
+as it's logged, and holds a fixed number of lines no matter
+how long they are.  Instead, we keep the parts of each record
+we need, render HTML only when a line is first shown, and cap
+the buffer by its approximate size in bytes, so that memory
+use stays flat no matter how long the bot runs.
+"""
+
+import collections
+import heapq
+import html
+import itertools
+import logging
+import operator
+import time
+import typing
+
+from oobabot import fancy_logger
+
+# matches the colors oobabot uses for its own html logs
+LEVEL_COLORS = {
+    logging.DEBUG: "cyan",
+    logging.INFO: "white",
+    logging.WARNING: "yellow",
+    logging.ERROR: "red",
+    logging.CRITICAL: "red",
+}
+
+# a rough count of the bytes each entry costs beyond its text,
+# including its html once it has been rendered
+ENTRY_OVERHEAD_BYTES = 200
+
+_ArgType = typing.Union[str, int, float, bool, None]
+
+
+def format_timestamp(created: float) -> str:
+    """
+    Returns the given time in the same format as logging's
+    default asctime.
+    """
+    seconds = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(created))
+    milliseconds = int((created - int(created)) * 1000)
+    return f"{seconds},{milliseconds:03d}"
+
+
+def format_html(timestamp: str, levelno: int, levelname: str, message: str) -> str:
+    """
+    Returns a log line as html, in the same style as
+    oobabot's own html logs.
+    """
+    color = LEVEL_COLORS.get(levelno, "white")
+    return (
+        fancy_logger.apply_color_html("yellow", timestamp)
+        + fancy_logger.apply_color_html("white", f" {levelname:>5} ")
+        + fancy_logger.apply_color_html(color, html.escape(message))
+    )
+
+
+def _compact_arg(arg: typing.Any) -> _ArgType:
+    # don't hold on to the objects that were logged, which might
+    # be large, or change before we get around to rendering them
+    if arg is None or isinstance(arg, (str, int, float, bool)):
+        return arg
+    return str(arg)
+
+
+def _arg_size(arg: _ArgType) -> int:
+    if isinstance(arg, str):
+        return len(arg)
+    return 8
+
+
+class LogEntry:
+    """
+    A single log record, as compactly as we can keep it.
+    """
+
+    __slots__ = (
+        "sequence",
+        "created",
+        "levelno",
+        "levelname",
+        "logger_name",
+        "template",
+        "args",
+        "exc_text",
+        "size",
+        "_message",
+        "_html",
+        "previous",
+        "previous_at_level",
+        "previous_from_logger",
+    )
+
+    def __init__(self, record: logging.LogRecord, sequence: int):
+        self.sequence = sequence
+        self.created = record.created
+        self.levelno = record.levelno
+        self.levelname = record.levelname
+        self.logger_name = record.name
+        self.template = str(record.msg)
+
+        self.args: typing.Union[typing.Tuple[_ArgType, ...], typing.Dict[str, _ArgType]]
+        if isinstance(record.args, collections.abc.Mapping):
+            self.args = {
+                str(key): _compact_arg(value) for key, value in record.args.items()
+            }
+            args_size = sum(_arg_size(value) for value in self.args.values())
+        else:
+            self.args = tuple(_compact_arg(arg) for arg in record.args or ())
+            args_size = sum(_arg_size(arg) for arg in self.args)
+
+        # tracebacks hold on to every frame's locals, so format
+        # them now rather than keeping them around
+        self.exc_text: typing.Optional[str] = None
+        if record.exc_info:
+            self.exc_text = logging.Formatter().formatException(record.exc_info)
+        elif record.exc_text:
+            self.exc_text = record.exc_text
+
+        self.size = ENTRY_OVERHEAD_BYTES + 2 * (
+            len(self.template) + args_size + len(self.exc_text or "")
+        )
+        self._message: typing.Optional[str] = None
+        self._html: typing.Optional[str] = None
+
+        # the entries logged before this one, overall, at the same
+        # level, and from the same logger.  Searches follow these
+        # back from the newest entries, so that they don't need to
+        # copy the store.  Links to dropped entries are cut.
+        self.previous: typing.Optional[LogEntry] = None
+        self.previous_at_level: typing.Optional[LogEntry] = None
+        self.previous_from_logger: typing.Optional[LogEntry] = None
+
+    def message(self) -> str:
+        """
+        Returns the log message, with its args filled in.  Like
+        the html, this is only worked out once.
+        """
+        if self._message is None:
+            self._message = self._format_message()
+        return self._message
+
+    def _format_message(self) -> str:
+        message = self.template
+        if self.args:
+            try:
+                message = message % self.args
+            except (TypeError, ValueError, KeyError):
+                message = f"{message} {self.args}"
+        if self.exc_text:
+            message = f"{message}\n{self.exc_text}"
+        return message
+
+    def timestamp(self) -> str:
+        return format_timestamp(self.created)
+
+    def to_html(self) -> str:
+        """
+        Returns the entry as a line of html.  This is rendered
+        the first time it's asked for, and then remembered.
+        """
+        if self._html is None:
+            self._html = format_html(
+                self.timestamp(), self.levelno, self.levelname, self.message()
+            )
+        return self._html
+
+
+class LogQuery(typing.NamedTuple):
+    """
+    Which log entries to search for.  An entry must match
+    every field which is set.
+    """
+
+    # the lowest level to include
+    min_level: int = logging.NOTSET
+
+    # only entries from this logger, or its children
+    logger_name: str = ""
+
+    # only entries logged within this range of times, as
+    # seconds since the epoch
+    since: typing.Optional[float] = None
+    until: typing.Optional[float] = None
+
+    # only entries whose message matches this
+    pattern: typing.Optional[typing.Pattern[str]] = None
+
+
+def _is_logger_or_child(name: str, parent_name: str) -> bool:
+    return name == parent_name or name.startswith(parent_name + ".")
+
+
+# the links searches can follow back through the store
+_PREVIOUS = operator.attrgetter("previous")
+_PREVIOUS_AT_LEVEL = operator.attrgetter("previous_at_level")
+_PREVIOUS_FROM_LOGGER = operator.attrgetter("previous_from_logger")
+
+
+def _newest_first(
+    entry: typing.Optional[LogEntry],
+    get_previous: typing.Callable[[LogEntry], typing.Optional[LogEntry]],
+) -> typing.Iterator[LogEntry]:
+    while entry is not None:
+        yield entry
+        entry = get_previous(entry)
+
+
+class LogStore(logging.Handler):
+    """
+    A logging handler which keeps the most recent log entries,
+    up to a total size in bytes.
+
+    Each entry gets a sequence number, one more than the entry
+    before it.  The sequence number of the newest entry serves
+    as an etag for the whole store.
+
+    Entries are also indexed by level and by logger, so that
+    searches only need to look at the entries which could match.
+    """
+
+    # enough for a few hundred thousand typical lines
+    DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.entries: typing.Deque[LogEntry] = collections.deque()
+        self.total_bytes = 0
+        self.sequence = 0
+
+        # entries are always dropped oldest first, so the entry
+        # being dropped is also the oldest in each of these
+        self.by_level: typing.Dict[int, typing.Deque[LogEntry]] = {}
+        self.by_logger: typing.Dict[str, typing.Deque[LogEntry]] = {}
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # logging.Handler.handle() holds our lock while calling this
+        try:
+            entry = LogEntry(record, self.sequence + 1)
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        level_bucket = self.by_level.setdefault(entry.levelno, collections.deque())
+        logger_bucket = self.by_logger.setdefault(
+            entry.logger_name, collections.deque()
+        )
+        if self.entries:
+            entry.previous = self.entries[-1]
+        if level_bucket:
+            entry.previous_at_level = level_bucket[-1]
+        if logger_bucket:
+            entry.previous_from_logger = logger_bucket[-1]
+        self.entries.append(entry)
+        level_bucket.append(entry)
+        logger_bucket.append(entry)
+        self.total_bytes += entry.size
+        self.sequence = entry.sequence
+        # always keep the newest entry, however large it is
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            self._drop_oldest()
+
+    def _drop_oldest(self) -> None:
+        entry = self.entries.popleft()
+        self.total_bytes -= entry.size
+        # the oldest entries left no longer link back to this one,
+        # so that searches stop before it, and it can be freed
+        if self.entries:
+            self.entries[0].previous = None
+        for index, key, link in (
+            (self.by_level, entry.levelno, "previous_at_level"),
+            (self.by_logger, entry.logger_name, "previous_from_logger"),
+        ):
+            bucket = index[key]  # type: ignore
+            bucket.popleft()
+            if bucket:
+                setattr(bucket[0], link, None)
+            else:
+                del index[key]  # type: ignore
+
+    def since(
+        self,
+        since_sequence: int,
+        max_entries: typing.Optional[int] = None,
+    ) -> typing.Tuple[int, bool, typing.List[LogEntry], int]:
+        """
+        Returns the entries added after the given sequence number.
+
+        Only the newest max_entries entries are considered, if
+        it's given.  If some of the entries asked for are older
+        than that, or have already been dropped, or if
+        since_sequence is negative, returns all of those newest
+        entries instead.
+
+        Returns: (sequence, is_delta, entries, number of entries
+        considered)
+        """
+        self.acquire()
+        try:
+            sequence = self.sequence
+            retained = len(self.entries)
+            if max_entries is not None:
+                retained = min(retained, max_entries)
+            new_count = sequence - since_sequence
+            is_delta = since_sequence >= 0 and 0 <= new_count <= retained
+            count = new_count if is_delta else retained
+            newest = list(itertools.islice(reversed(self.entries), count))
+        finally:
+            self.release()
+        newest.reverse()
+        return (sequence, is_delta, newest, retained)
+
+    def logger_names(self) -> typing.List[str]:
+        """
+        Returns the names of the loggers which have entries
+        in the store, sorted.
+        """
+        self.acquire()
+        try:
+            return sorted(self.by_logger)
+        finally:
+            self.release()
+
+    def search(
+        self, query: LogQuery, limit: int
+    ) -> typing.Tuple[typing.List[LogEntry], bool]:
+        """
+        Returns the newest entries which match the query, up to
+        limit of them, oldest first.  Also returns whether there
+        were more matching entries than that.
+        """
+        self.acquire()
+        try:
+            # only the newest entry of each index that might match.
+            # Following them back doesn't need the lock, so searching
+            # doesn't hold up logging, however big the store is.
+            chains = self._candidate_chains(query)
+        finally:
+            self.release()
+
+        newest_first: typing.Iterable[LogEntry]
+        if len(chains) == 1:
+            newest_first = _newest_first(*chains[0])
+        else:
+            newest_first = heapq.merge(
+                *(_newest_first(*chain) for chain in chains),
+                key=lambda entry: -entry.sequence,
+            )
+        if query.until is not None:
+            until = query.until
+            newest_first = itertools.dropwhile(
+                lambda entry: entry.created > until, newest_first
+            )
+
+        # this loop can see every entry in the store, so keep it tight
+        min_level = query.min_level
+        logger_name = query.logger_name
+        since = query.since
+        search = query.pattern.search if query.pattern is not None else None
+        matches: typing.List[LogEntry] = []
+        for entry in newest_first:
+            if since is not None and entry.created < since:
+                # everything after this is older still
+                break
+            if entry.levelno < min_level:
+                continue
+            if logger_name and not _is_logger_or_child(entry.logger_name, logger_name):
+                continue
+            if search is not None and not search(entry.message()):
+                continue
+            if len(matches) == limit:
+                matches.reverse()
+                return (matches, True)
+            matches.append(entry)
+        matches.reverse()
+        return (matches, False)
+
+    def _candidate_chains(
+        self, query: LogQuery
+    ) -> typing.List[
+        typing.Tuple[LogEntry, typing.Callable[[LogEntry], typing.Optional[LogEntry]]]
+    ]:
+        """
+        Returns the newest entry in each index bucket which might
+        match, and how to get from each entry in the bucket to the
+        one before it.
+        """
+        level_buckets = [
+            bucket
+            for level, bucket in self.by_level.items()
+            if level >= query.min_level
+        ]
+        level_count = sum(map(len, level_buckets))
+        if not query.logger_name:
+            if level_count == len(self.entries):
+                # no need to merge the buckets back together
+                if not self.entries:
+                    return []
+                return [(self.entries[-1], _PREVIOUS)]
+            return [(bucket[-1], _PREVIOUS_AT_LEVEL) for bucket in level_buckets]
+
+        logger_buckets = [
+            bucket
+            for name, bucket in self.by_logger.items()
+            if _is_logger_or_child(name, query.logger_name)
+        ]
+        # whichever index narrows things down more
+        if sum(map(len, logger_buckets)) < level_count:
+            return [(bucket[-1], _PREVIOUS_FROM_LOGGER) for bucket in logger_buckets]
+        return [(bucket[-1], _PREVIOUS_AT_LEVEL) for bucket in level_buckets]
+
+
+_store = LogStore()
+
+
+def get() -> LogStore:
+    """
+    Returns the store which holds the bot's recent logs.
+    """
+    return _store
+
+
+def install() -> None:
+    """
+    Has the bot's logger send its records to our store, rather
+    than to oobabot's own log buffer.  oobabot re-attaches its
+    buffer every time a bot is created, so call this after that.
+
+    With its buffer detached, the bot's own logs() and log_count()
+    no longer see new records.  Read them from get() instead.
+    """
+    logger = fancy_logger.get()
+    if _store not in logger.handlers:
+        logger.addHandler(_store)
+    logger.removeHandler(fancy_logger.recent_logs)
@@ -1,17 +1,578 @@
-var keep_at_bottom = false;
-
-window.onscroll = function (_evt) {
-    keep_at_bottom = ((window.innerHeight + window.scrollY + 150) >= document.body.offsetHeight);
-};
-
 function is_visible(id) {
     var el = document.getElementById(id);
     return (el !== null) && (el.offsetParent !== null);
 }
 
-var intervalId = setInterval(function () {
-    var selected = is_visible('oobabot-tab-audio');
-    if (keep_at_bottom && selected) {
-        window.scrollTo(0, document.body.scrollHeight);
+// Virtualized views.
+//
+// The log and the transcript can grow to many thousands of rows,
+// and keeping a DOM node for each of them costs the browser a lot
+// of memory, and makes scrolling slow.  So instead, rows are kept
+// as strings of html, grouped into blocks.  Only blocks near the
+// visible part of the view are rendered.  The rest are left empty,
+// at the height they had when they were last shown, or at an
+// estimate if they haven't been shown yet.
+var VIRTUAL_BLOCK_ROWS = 50;
+// render blocks which are within this distance of being visible
+var VIRTUAL_MARGIN_PX = 1500;
+// if the view is scrolled to within this distance of the bottom,
+// keep it at the bottom as new rows arrive
+var STICK_TO_BOTTOM_PX = 150;
+
+// container: the element to put rows into.
+// scroller: the element which scrolls, or null if it's the page.
+// row_px: a guess at the height of a row, until we've seen some.
+function VirtualView(container, scroller, row_px) {
+    var view = this;
+    this.container = container;
+    this.scroller = scroller;
+    this.row_px = row_px;
+    this.blocks = [];
+    this.row_count = 0;
+    this.at_bottom = true;
+    this.scroll_pending = false;
+
+    this.visibility = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            view.set_rendered(entry.target.oobabot_block, entry.isIntersecting);
+        });
+    }, { root: scroller, rootMargin: VIRTUAL_MARGIN_PX + 'px 0px' });
+
+    // follow new content, rather than checking on a timer
+    new MutationObserver(function () {
+        view.follow();
+    }).observe(container, { childList: true, subtree: true });
+
+    (scroller || window).addEventListener('scroll', function () {
+        view.at_bottom = view.is_at_bottom();
+    }, { passive: true });
+}
+
+VirtualView.prototype.is_at_bottom = function () {
+    if (this.scroller === null) {
+        return (window.innerHeight + window.scrollY + STICK_TO_BOTTOM_PX) >=
+            document.body.offsetHeight;
+    }
+    return (this.scroller.scrollTop + this.scroller.clientHeight + STICK_TO_BOTTOM_PX) >=
+        this.scroller.scrollHeight;
+};
+
+// If we were at the bottom, scroll to the bottom again once the
+// browser has laid out whatever just changed.
+VirtualView.prototype.follow = function () {
+    var view = this;
+    if (!this.at_bottom || this.scroll_pending || this.container.offsetParent === null) {
+        return;
+    }
+    this.scroll_pending = true;
+    requestAnimationFrame(function () {
+        view.scroll_pending = false;
+        if (view.scroller === null) {
+            window.scrollTo(0, document.body.scrollHeight);
+        } else {
+            view.scroller.scrollTop = view.scroller.scrollHeight;
+        }
+    });
+};
+
+VirtualView.prototype.placeholder_height = function (block) {
+    if (block.height !== null) {
+        return block.height;
+    }
+    return block.rows.length * this.row_px;
+};
+
+VirtualView.prototype.set_rendered = function (block, rendered) {
+    if (!block || block.rendered === rendered || block.el.parentNode !== this.container) {
+        return;
+    }
+    if (rendered) {
+        block.el.innerHTML = block.rows.join('');
+        block.el.style.height = '';
+        block.rendered = true;
+        return;
+    }
+    if (this.container.offsetParent === null) {
+        // we're hidden, so can't measure anything.  Leave the
+        // block as it is until we're shown again.
+        return;
+    }
+    block.height = block.el.offsetHeight;
+    if (block.rows.length > 0) {
+        // nudge our guess at row height towards what we've seen
+        this.row_px = 0.8 * this.row_px + 0.2 * (block.height / block.rows.length);
+    }
+    block.el.style.height = block.height + 'px';
+    block.el.innerHTML = '';
+    block.rendered = false;
+};
+
+// Call after changing the rows of a block that isn't rendered.
+VirtualView.prototype.resize_placeholder = function (block) {
+    block.height = null;
+    block.el.style.height = this.placeholder_height(block) + 'px';
+};
+
+VirtualView.prototype.add_block = function () {
+    var el = document.createElement('div');
+    el.className = 'oobabot-virtual-block';
+    var block = { rows: [], el: el, rendered: false, height: null };
+    el.oobabot_block = block;
+    this.container.appendChild(el);
+    this.visibility.observe(el);
+    this.blocks.push(block);
+    return block;
+};
+
+VirtualView.prototype.remove_block = function (index) {
+    var block = this.blocks[index];
+    this.visibility.unobserve(block.el);
+    block.el.remove();
+    this.blocks.splice(index, 1);
+    this.row_count -= block.rows.length;
+};
+
+// Adds rows to the end of the view.  Each row is a string of
+// html for a single element.
+VirtualView.prototype.append = function (rows) {
+    var i = 0;
+    while (i < rows.length) {
+        var block = this.blocks[this.blocks.length - 1];
+        if (block === undefined || block.rows.length >= VIRTUAL_BLOCK_ROWS) {
+            block = this.add_block();
+        }
+        var added = rows.slice(i, i + VIRTUAL_BLOCK_ROWS - block.rows.length);
+        Array.prototype.push.apply(block.rows, added);
+        if (block.rendered) {
+            block.el.insertAdjacentHTML('beforeend', added.join(''));
+        } else {
+            this.resize_placeholder(block);
+        }
+        i += added.length;
+        this.row_count += added.length;
+    }
+};
+
+// Removes the oldest count rows.
+VirtualView.prototype.drop_first = function (count) {
+    while (count > 0 && this.blocks.length > 0) {
+        var block = this.blocks[0];
+        if (block.rows.length <= count) {
+            count -= block.rows.length;
+            this.remove_block(0);
+            continue;
+        }
+        block.rows.splice(0, count);
+        this.row_count -= count;
+        if (block.rendered) {
+            for (var i = 0; i < count; i++) {
+                block.el.firstElementChild.remove();
+            }
+        } else {
+            this.resize_placeholder(block);
+        }
+        count = 0;
+    }
+};
+
+// Removes rows from the end, until only length are left.
+VirtualView.prototype.truncate = function (length) {
+    while (this.row_count > length) {
+        var last = this.blocks.length - 1;
+        var block = this.blocks[last];
+        var excess = this.row_count - length;
+        if (block.rows.length <= excess) {
+            this.remove_block(last);
+            continue;
+        }
+        block.rows.length -= excess;
+        this.row_count -= excess;
+        if (block.rendered) {
+            for (var i = 0; i < excess; i++) {
+                block.el.lastElementChild.remove();
+            }
+        } else {
+            this.resize_placeholder(block);
+        }
+    }
+};
+
+// Replaces all rows.  Rows which are the same as before, from
+// the start up to the first one which changed, are left alone.
+VirtualView.prototype.set_rows = function (rows) {
+    var same = 0;
+    for (var b = 0; b < this.blocks.length; b++) {
+        var block_rows = this.blocks[b].rows;
+        var i = 0;
+        while (i < block_rows.length && same < rows.length && block_rows[i] === rows[same]) {
+            i++;
+            same++;
+        }
+        if (i < block_rows.length) {
+            break;
+        }
+    }
+    this.truncate(same);
+    this.append(rows.slice(same));
+};
+
+// Returns the view attached to the element, creating one if
+// needed.  Gradio may re-create our elements, in which case
+// they'll get a new, empty view.
+function get_virtual_view(container, scroller, row_px) {
+    if (!container.oobabot_view) {
+        container.oobabot_view = new VirtualView(container, scroller, row_px);
+    }
+    return container.oobabot_view;
+}
+
+// the etag of the last log update applied to the page
+var log_etag = -1;
+
+// Applies a log update from the server to the log panel.
+// The update is either a full snapshot of the log, or only
+// the lines appended since some earlier etag.
+//
+// Updates can arrive both from the status feed and from the
+// fallback polling, so skip any lines we've already shown.
+function apply_log_update(update) {
+    var log = document.querySelector('#oobabot-log-output .oobabot-log');
+    if (log === null) {
+        return;
+    }
+    if (!log.oobabot_view) {
+        // nothing has been shown here yet
+        log_etag = -1;
+    }
+    var view = get_virtual_view(log, log, 20);
+    var lines = update.lines;
+    if (update.is_delta) {
+        var new_line_count = update.etag - log_etag;
+        if (new_line_count <= 0 || new_line_count > lines.length) {
+            // either old news, or we've missed some lines, in which
+            // case the next snapshot will catch us up
+            return;
+        }
+        lines = lines.slice(lines.length - new_line_count);
+    } else if (update.etag < log_etag) {
+        return;
+    }
+    var rows = lines.map(function (line) {
+        return '<div class="oobabot-log-line">' + line + '</div>';
+    });
+    if (update.is_delta) {
+        view.append(rows);
+    } else {
+        view.set_rows(rows);
+    }
+    log_etag = update.etag;
+
+    // the server only holds on to so many lines, so do the same
+    if (view.row_count > update.retained) {
+        view.drop_first(view.row_count - update.retained);
+    }
+}
+
+window.oobabot_apply_log_update = function (update_json) {
+    if (update_json) {
+        apply_log_update(JSON.parse(update_json));
+    }
+};
+
+// Splits the polled status versions into the hidden textboxes
+// they belong to.  This is only called when they've changed.
+// Returns the values for those textboxes, in the same order as
+// keys.  Versions which haven't moved keep
+// their textbox's current value, so that no update fires.
+window.oobabot_split_status_versions = function (versions_json, keys, current) {
+    if (!versions_json) {
+        return current;
+    }
+    var versions = JSON.parse(versions_json);
+    note_activity();
+    return keys.map(function (key, i) {
+        return (key in versions) ? String(versions[key]) : current[i];
+    });
+};
+
+// The running state drives which buttons are enabled, and
+// that logic lives on the server.  So rather than applying
+// it here, ask the server to refresh it.
+function apply_running_state(running_state) {
+    var textbox = document.querySelector('#oobabot-is-running textarea');
+    if (textbox !== null && textbox.value === running_state) {
+        return;
+    }
+    var refresh = document.getElementById('oobabot-running-state-refresh');
+    if (refresh !== null) {
+        refresh.click();
     }
-}, 500);
+}
+
+// The transcript arrives as rows of html, one for each run of
+// messages from the same speaker.  Rows are numbered from the
+// start of the call, and an update either replaces every row,
+// or only the rows from some row number onward.
+
+// the version of the transcript shown on the page, and the
+// number of the first row it's showing
+var transcript_version = -1;
+var transcript_row_base = 0;
+
+function apply_transcript(update) {
+    var transcript = document.querySelector('.prose.oobabot-audio-output');
+    if (transcript === null) {
+        return;
+    }
+    if (!transcript.oobabot_view) {
+        // nothing has been shown here yet
+        transcript_version = -1;
+    }
+    var view = get_virtual_view(transcript, null, 100);
+    // updates can arrive both from the status feed and from the
+    // fallback polling.  Skip any we've already applied, and any
+    // deltas from a version we haven't seen, since we've missed
+    // something in between.  The next poll will catch us up.
+    if (update.version <= transcript_version ||
+        (update.is_delta && update.since > transcript_version)) {
+        return;
+    }
+    if (!update.is_delta) {
+        view.set_rows(update.rows);
+        transcript_row_base = update.row_base;
+        transcript_version = update.version;
+        return;
+    }
+    if (update.row_base > transcript_row_base) {
+        view.drop_first(update.row_base - transcript_row_base);
+        transcript_row_base = update.row_base;
+    }
+    view.truncate(Math.max(update.first_row - transcript_row_base, 0));
+    view.append(update.rows);
+    transcript_version = update.version;
+}
+
+window.oobabot_apply_transcript = function (update_json) {
+    if (update_json) {
+        apply_transcript(JSON.parse(update_json));
+    }
+};
+
+window.oobabot_shown_transcript_version = function () {
+    var transcript = document.querySelector('.prose.oobabot-audio-output');
+    if (transcript === null || !transcript.oobabot_view) {
+        return -1;
+    }
+    return transcript_version;
+};
+
+// Runs of tokens with similar confidence are rendered as a single
+// span, with the length and confidence of each token in its
+// data-tokens attribute, or just its confidence if it's the only
+// token in the run.  Show the confidence of whichever token is
+// under the mouse as the span's tooltip.
+function text_offset_at_point(el, x, y) {
+    var node = null;
+    var offset = null;
+    if (document.caretPositionFromPoint) {
+        var position = document.caretPositionFromPoint(x, y);
+        if (position) {
+            node = position.offsetNode;
+            offset = position.offset;
+        }
+    } else if (document.caretRangeFromPoint) {
+        var range = document.caretRangeFromPoint(x, y);
+        if (range) {
+            node = range.startContainer;
+            offset = range.startOffset;
+        }
+    }
+    return (node !== null && node.parentNode === el) ? offset : null;
+}
+
+function describe_token_at_point(run, x, y) {
+    var data = run.dataset.tokens;
+    if (data.indexOf(':') === -1) {
+        return data + '% confidence';
+    }
+    var tokens = data.split(' ').map(function (pair) {
+        return pair.split(':').map(Number);
+    });
+    var offset = text_offset_at_point(run, x, y);
+    if (offset === null) {
+        return 'confidence: ' + tokens.map(function (token) {
+            return token[1] + '%';
+        }).join(', ');
+    }
+    // token lengths count characters, while offset counts
+    // UTF-16 code units
+    var chars = Array.from(run.textContent);
+    var start = 0;
+    var units = 0;
+    for (var i = 0; i < tokens.length; i++) {
+        var text = chars.slice(start, start + tokens[i][0]).join('');
+        units += text.length;
+        start += tokens[i][0];
+        if (offset < units || i === tokens.length - 1) {
+            return '"' + text.trim() + '": ' + tokens[i][1] + '% confidence';
+        }
+    }
+    return '';
+}
+
+document.addEventListener('mousemove', function (evt) {
+    var run = evt.target;
+    if (!run.dataset || run.dataset.tokens === undefined ||
+        !run.parentNode.classList.contains('oobabot_token_runs')) {
+        return;
+    }
+    run.title = describe_token_at_point(run, evt.clientX, evt.clientY);
+}, { passive: true });
+
+var status_feed = null;
+
+// Subscribe to changes pushed from the server.  If the feed
+// isn't available, the page falls back to polling.
+function connect_status_feed() {
+    if (typeof EventSource === 'undefined' || status_feed !== null) {
+        return;
+    }
+    var feed = new EventSource(new URL('oobabot/feed', window.location.href));
+    status_feed = feed;
+    feed.addEventListener('log', function (evt) {
+        apply_log_update(JSON.parse(evt.data));
+    });
+    feed.addEventListener('running_state', function (evt) {
+        apply_running_state(JSON.parse(evt.data));
+    });
+    feed.addEventListener('transcript', function (evt) {
+        apply_transcript(JSON.parse(evt.data));
+    });
+    feed.onerror = function (_evt) {
+        // EventSource retries dropped connections by itself, but
+        // gives up if the server refused us, as it will if the
+        // feed hasn't been set up yet.  Try again in a while.
+        if (feed.readyState === EventSource.CLOSED && status_feed === feed) {
+            status_feed = null;
+            setTimeout(connect_status_feed, 10000);
+        }
+    };
+}
+
+function disconnect_status_feed() {
+    if (status_feed !== null) {
+        status_feed.close();
+        status_feed = null;
+    }
+}
+
+function is_feed_connected() {
+    return status_feed !== null && status_feed.readyState === EventSource.OPEN;
+}
+
+// Polling for status, in case the feed isn't connected.
+//
+// Polls quickly while things are changing, and backs off while
+// they aren't.  When nobody can see the updates, because the
+// browser tab is hidden or none of our panels are shown, or when
+// the feed is already delivering them, it only polls occasionally.
+var POLL_FAST_MS = 500;
+var POLL_BACKOFF_MAX_MS = 8000;
+var POLL_HEARTBEAT_MS = 30000;
+
+// the delay to use for the next poll, while backing off
+var poll_delay_ms = POLL_FAST_MS;
+var poll_timer = null;
+var poll_stats = {
+    started: Date.now(),
+    polls: 0,
+    changes: 0,
+    mode: 'fast',
+    delay_ms: POLL_FAST_MS,
+};
+
+function is_panel_shown() {
+    return !document.hidden && (
+        is_visible('oobabot-status-heading') || is_visible('oobabot-tab-audio')
+    );
+}
+
+function next_poll_delay() {
+    var mode;
+    var delay;
+    if (!is_panel_shown() || is_feed_connected()) {
+        mode = 'heartbeat';
+        delay = POLL_HEARTBEAT_MS;
+    } else {
+        delay = poll_delay_ms;
+        mode = (delay <= POLL_FAST_MS) ? 'fast' : 'backoff';
+        // back off a little more each time nothing changes
+        poll_delay_ms = Math.min(delay * 2, POLL_BACKOFF_MAX_MS);
+    }
+    if (poll_stats.mode !== mode) {
+        console.debug('oobabot: status polling is now ' + mode);
+    }
+    poll_stats.mode = mode;
+    poll_stats.delay_ms = delay;
+    return delay;
+}
+
+function schedule_poll(delay_ms) {
+    clearTimeout(poll_timer);
+    poll_timer = setTimeout(poll_status, delay_ms);
+}
+
+function poll_status() {
+    var button = document.getElementById('oobabot-status-poll');
+    if (button !== null) {
+        button.click();
+        poll_stats.polls += 1;
+    }
+    schedule_poll(next_poll_delay());
+}
+
+// Something changed, so expect more changes soon.
+function note_activity() {
+    poll_stats.changes += 1;
+    poll_delay_ms = POLL_FAST_MS;
+    if (poll_stats.mode === 'backoff') {
+        schedule_poll(next_poll_delay());
+    }
+}
+
+// Checks whether we've just become visible, and if so,
+// catches up right away.
+function check_visibility() {
+    if (document.hidden) {
+        // nobody is looking, so don't tie up a connection
+        disconnect_status_feed();
+        return;
+    }
+    connect_status_feed();
+    if (poll_stats.mode === 'heartbeat' && is_panel_shown()) {
+        poll_delay_ms = POLL_FAST_MS;
+        schedule_poll(next_poll_delay());
+    }
+}
+
+// Reports how often we're polling, so that the savings can
+// be checked from the browser console.
+window.oobabot_polling_stats = function () {
+    var minutes = (Date.now() - poll_stats.started) / 60000;
+    return {
+        mode: poll_stats.mode,
+        delay_ms: poll_stats.delay_ms,
+        polls: poll_stats.polls,
+        changes: poll_stats.changes,
+        polls_per_minute: minutes > 0 ? poll_stats.polls / minutes : 0,
+    };
+};
+
+document.addEventListener('visibilitychange', check_visibility);
+// switching tabs doesn't have an event of its own
+document.addEventListener('click', function (_evt) {
+    setTimeout(check_visibility, 100);
+});
+
+connect_status_feed();
+schedule_poll(POLL_FAST_MS);
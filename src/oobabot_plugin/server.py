@@ -4,28 +4,76 @@
 Standalone main for oobabot_plugin
 """
 
-import gradio
+import typing
 
-from oobabot_plugin import bootstrap
+import oobabot_plugin
 
+DEFAULT_HOST = oobabot_plugin.DEFAULT_SERVER_HOST
+DEFAULT_PORT = oobabot_plugin.DEFAULT_SERVER_PORT
+DEFAULT_CONCURRENCY_COUNT = oobabot_plugin.DEFAULT_SERVER_CONCURRENCY_COUNT
+DEFAULT_MAX_THREADS = oobabot_plugin.DEFAULT_SERVER_MAX_THREADS
+
+
+def web_main(
+    _cwd: str,
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    concurrency_count: int = DEFAULT_CONCURRENCY_COUNT,
+    max_size: typing.Optional[int] = None,
+    max_threads: int = DEFAULT_MAX_THREADS,
+    run_in_subprocess: bool = False,
+    log_spool: bool = False,
+    transcript_archive: bool = False,
+    transcript_window_messages: typing.Optional[int] = None,
+    transcript_window_minutes: typing.Optional[float] = None,
+    coalesce_transcript_tokens: bool = False,
+    fake_bot: typing.Optional[str] = None,
+) -> None:
+    # pylint: disable=import-outside-toplevel
+    # gradio is slow to import, so only do it once we know
+    # we're serving
+    import gradio
+
+    from oobabot_plugin import bootstrap
+
+    # pylint: enable=import-outside-toplevel
 
-def web_main(_cwd: str) -> None:
     gradio_server = gradio.Blocks(
         analytics_enabled=False,
         title="oobabot",
         css=bootstrap.custom_css(script_py_version="standalone"),
     )
     with gradio_server as gradio_block:
-        bootstrap.plugin_ui()
+        ui_controller = bootstrap.plugin_ui(
+            params={
+                "run_in_subprocess": run_in_subprocess,
+                "log_spool": log_spool,
+                "transcript_archive": transcript_archive,
+                "transcript_window_messages": transcript_window_messages,
+                "transcript_window_minutes": transcript_window_minutes,
+                "coalesce_transcript_tokens": coalesce_transcript_tokens,
+                "fake_bot": fake_bot,
+            },
+        )
 
         custom_js = bootstrap.custom_js()
         gradio_block.load(lambda: None, None, None, _js=f"() => {{{custom_js}}}")
 
-    gradio_server.queue()
+    # concurrency_count is how many queued events run at once,
+    # and max_size how many can wait before new ones are turned
+    # away.  max_threads bounds the thread pool which runs both
+    # those and the events which skip the queue.
+    gradio_server.queue(
+        concurrency_count=concurrency_count,
+        max_size=max_size,
+    )
     gradio_server.launch(
         prevent_thread_lock=True,
-        server_name="0.0.0.0",
-        server_port=1234,
+        server_name=host,
+        server_port=port,
+        max_threads=max_threads,
     )
     gradio_server.server.config.timeout_graceful_shutdown = 1
+    if ui_controller.status_feed is not None:
+        ui_controller.status_feed.mount(gradio_server.server_app)
     gradio_server.block_thread()
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+Writes the settings file in the background.
+"""
+
+import atexit
+import os
+import tempfile
+import threading
+import time
+import typing
+
+from oobabot import fancy_logger
+
+
+class SettingsWriter:
+    """
+    Writes a file from a background thread, whenever asked to.
+
+    Requests which arrive while a write is already pending are
+    folded into it, so a burst of saves costs a single write.
+
+    The file is written to a temporary file first, and then
+    renamed over the original, so that a crash part way through
+    never leaves a truncated settings file behind.
+    """
+
+    # wait this long after a request for more to arrive
+    COALESCE_SECONDS = 0.25
+
+    def __init__(
+        self,
+        filename: str,
+        fn_write: typing.Callable[[typing.TextIO], None],
+        fn_write_failed: typing.Optional[typing.Callable[[], None]] = None,
+    ):
+        """
+        fn_write: writes the file's contents to the given stream.
+        fn_write_failed: called after a write fails, so that the
+            caller can ask for it again with its next save.
+        """
+        self.filename = filename
+        self.fn_write = fn_write
+        self.fn_write_failed = fn_write_failed
+
+        self.condition = threading.Condition()
+        # each request bumps requested.  Once a write which started
+        # after a request finishes, written catches up to it.
+        self.requested = 0
+        self.written = 0
+        self.thread: typing.Optional[threading.Thread] = None
+
+    def request_write(self) -> None:
+        """
+        Asks for the file to be written soon.  Returns immediately.
+        """
+        with self.condition:
+            self.requested += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+                # don't lose a save that's still pending when we exit
+                atexit.register(self.flush)
+            self.condition.notify_all()
+
+    def flush(self, timeout: typing.Optional[float] = None) -> bool:
+        """
+        Waits until every write requested so far has finished.
+        Returns False if that didn't happen within timeout seconds.
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.written == self.requested,
+                timeout=timeout,
+            )
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.written != self.requested)
+            time.sleep(self.COALESCE_SECONDS)
+
+            with self.condition:
+                target = self.requested
+            try:
+                self._write()
+            except Exception as err:  # pylint: disable=broad-except
+                fancy_logger.get().error(
+                    "oobabot_plugin: could not save settings to %s: %s",
+                    self.filename,
+                    err,
+                )
+                if self.fn_write_failed is not None:
+                    self.fn_write_failed()
+            with self.condition:
+                self.written = target
+                self.condition.notify_all()
+
+    def _write(self) -> None:
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        temp_fd, temp_path = tempfile.mkstemp(
+            dir=directory,
+            prefix=os.path.basename(self.filename) + ".",
+            suffix=".tmp",
+        )
+        try:
+            with os.fdopen(temp_fd, "w", encoding="utf-8") as file:
+                self.fn_write(file)
+                file.flush()
+                os.fsync(file.fileno())
+            # mkstemp makes the file private to us, keep whatever
+            # permissions the original had
+            if os.path.exists(self.filename):
+                os.chmod(temp_path, os.stat(self.filename).st_mode)
+            os.replace(temp_path, self.filename)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        fancy_logger.get().debug("oobabot_plugin: saved settings to %s", self.filename)
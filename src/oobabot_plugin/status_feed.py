@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+"""
+Pushes changes in the bot's state to the browser, so that
+the UI doesn't need to poll for them.
+
+Browsers subscribe with a server-sent event stream on the
+gradio app, and receive an event only when the logs, running
+state, or voice transcript actually change.  oobabot_log.js
+applies the events to the page.
+"""
+
+import asyncio
+import json
+import threading
+import time
+import typing
+
+import fastapi
+import fastapi.responses
+from oobabot import fancy_logger
+
+from oobabot_plugin import strings
+from oobabot_plugin import transcript_view
+from oobabot_plugin import worker as oobabot_worker
+
+
+class _Subscriber:
+    """
+    A single browser connection to the feed.
+
+    Events are queued from the publishing thread, and consumed
+    from the event loop serving the connection.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue: "asyncio.Queue[typing.Optional[str]]" = asyncio.Queue()
+
+    def send(self, event: typing.Optional[str]) -> None:
+        # can be called from any thread
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+
+class StatusFeed:
+    """
+    Watches the worker for changes, and publishes them to every
+    subscribed browser.
+
+    There is a single watcher thread no matter how many browsers
+    are connected, and it sleeps whenever nobody is listening.
+    """
+
+    FEED_PATH = "/oobabot/feed"
+
+    # send a comment this often, so that proxies don't decide
+    # an idle connection is dead
+    KEEPALIVE_SECONDS = 15.0
+
+    # if a browser falls this far behind, disconnect it.  It will
+    # reconnect and get a fresh snapshot.
+    MAX_QUEUED_EVENTS = 200
+
+    # check for changes this often while things are changing, backing
+    # off to the slower interval while they aren't
+    FAST_CHECK_SECONDS = strings.QUICK_UPDATE_INTERVAL_SECONDS
+    IDLE_CHECK_SECONDS = 2.0
+
+    def __init__(
+        self,
+        worker: oobabot_worker.OobabotWorker,
+        get_running_state: typing.Callable[[], str],
+        get_transcript_update: typing.Optional[
+            typing.Callable[[int], transcript_view.TranscriptUpdate]
+        ],
+    ):
+        self.worker = worker
+        self.get_running_state = get_running_state
+        self.get_transcript_update = get_transcript_update
+
+        self.lock = threading.Lock()
+        self.has_subscribers = threading.Event()
+        self.subscribers: typing.List[_Subscriber] = []
+        self.thread: typing.Optional[threading.Thread] = None
+
+        # the last state we published.  Held while publishing, so
+        # that a snapshot can't be taken halfway through.
+        self.publish_lock = threading.Lock()
+        self.log_etag = -1
+        self.running_state = ""
+        self.transcript_version = -1
+        self.last_error = ""
+
+    def mount(self, app: fastapi.FastAPI) -> None:
+        """
+        Adds the feed's route to the given gradio app, and starts
+        watching for changes.  Safe to call after the app has
+        started serving.
+        """
+        app.add_api_route(
+            self.FEED_PATH,
+            self._make_request_handler(app),
+            methods=["GET"],
+        )
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._watch, daemon=True)
+            self.thread.start()
+
+    def _make_request_handler(self, app: fastapi.FastAPI):
+        async def handle_feed_request(request: fastapi.Request):
+            # respect gradio's login, if one is configured.  This
+            # mirrors gradio's own login_check dependency.
+            if getattr(app, "auth", None) is not None:
+                token = request.cookies.get("access-token") or request.cookies.get(
+                    "access-token-unsecure"
+                )
+                if app.tokens.get(token) is None:  # type: ignore
+                    raise fastapi.HTTPException(
+                        status_code=401, detail="Not authenticated"
+                    )
+
+            # subscribe before taking the snapshot, so that no change
+            # can slip in between the two.  The browser ignores any
+            # queued events which turn out to be older than the snapshot.
+            subscriber = _Subscriber(asyncio.get_running_loop())
+            self._subscribe(subscriber)
+
+            # run the snapshot off the event loop, since rendering
+            # the transcript can take a moment
+            try:
+                initial_events = await subscriber.loop.run_in_executor(
+                    None, self._snapshot_events, subscriber
+                )
+            except BaseException:
+                self._unsubscribe(subscriber)
+                raise
+            return fastapi.responses.StreamingResponse(
+                self._stream(subscriber, initial_events),
+                media_type="text/event-stream",
+                headers={
+                    "Cache-Control": "no-cache",
+                    "X-Accel-Buffering": "no",
+                },
+            )
+
+        return handle_feed_request
+
+    async def _stream(
+        self,
+        subscriber: _Subscriber,
+        initial_events: typing.List[str],
+    ) -> typing.AsyncIterator[str]:
+        try:
+            for event in initial_events:
+                yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscriber.queue.get(),
+                        timeout=self.KEEPALIVE_SECONDS,
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    # we've been told to disconnect
+                    return
+                yield event
+        finally:
+            self._unsubscribe(subscriber)
+
+    def _subscribe(self, subscriber: _Subscriber) -> None:
+        with self.lock:
+            self.subscribers.append(subscriber)
+            self.has_subscribers.set()
+
+    def _unsubscribe(self, subscriber: _Subscriber) -> None:
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            if not self.subscribers:
+                self.has_subscribers.clear()
+
+    def _snapshot_events(self, subscriber: _Subscriber) -> typing.List[str]:
+        """
+        Returns the events a new subscriber needs to get up to date.
+        """
+        with self.publish_lock:
+            log_update = self.worker.get_logs()
+            running_state = self.get_running_state()
+            transcript_update = None
+            if self.get_transcript_update is not None:
+                transcript_update = self.get_transcript_update(-1)
+
+            # if nobody else is listening, the snapshot is all that's
+            # been seen, so the next changes can be relative to it
+            # rather than repeating it.  Otherwise the others still
+            # need whatever changed since our last publish.
+            with self.lock:
+                is_only_subscriber = self.subscribers == [subscriber]
+            if is_only_subscriber:
+                self.log_etag = log_update.etag
+                self.running_state = running_state
+                if transcript_update is not None:
+                    self.transcript_version = transcript_update.version
+
+        events = [
+            format_event("log", log_update._asdict()),
+            format_event("running_state", running_state),
+        ]
+        if transcript_update is not None:
+            events.append(format_event("transcript", transcript_update._asdict()))
+        return events
+
+    def _changed_events(self) -> typing.List[str]:
+        """
+        Returns events for anything that has changed since the
+        last time this was called.
+        """
+        # gather everything before noting any of it as published,
+        # so that if one part fails, none of the changes are lost
+        log_update = self.worker.get_logs(since_etag=self.log_etag)
+        running_state = self.get_running_state()
+        transcript_update = None
+        if self.get_transcript_update is not None:
+            # only the rows which changed since the last event
+            transcript_update = self.get_transcript_update(self.transcript_version)
+
+        events = []
+        if log_update.etag != self.log_etag:
+            self.log_etag = log_update.etag
+            events.append(format_event("log", log_update._asdict()))
+
+        if running_state != self.running_state:
+            self.running_state = running_state
+            events.append(format_event("running_state", running_state))
+
+        if (
+            transcript_update is not None
+            and transcript_update.version != self.transcript_version
+        ):
+            self.transcript_version = transcript_update.version
+            events.append(format_event("transcript", transcript_update._asdict()))
+
+        return events
+
+    def _publish_changes(self) -> bool:
+        """
+        Sends any changes to every subscriber.  Returns True if
+        there were any.
+        """
+        with self.publish_lock:
+            events = self._changed_events()
+            if not events:
+                return False
+            with self.lock:
+                subscribers = list(self.subscribers)
+            for subscriber in subscribers:
+                if subscriber.queue.qsize() > self.MAX_QUEUED_EVENTS:
+                    subscriber.send(None)
+                    continue
+                for event in events:
+                    subscriber.send(event)
+        return True
+
+    def _watch(self) -> None:
+        check_seconds = self.FAST_CHECK_SECONDS
+        while True:
+            # new subscribers get a snapshot of their own, so
+            # there's nothing to do while nobody is listening
+            self.has_subscribers.wait()
+
+            try:
+                if self._publish_changes():
+                    check_seconds = self.FAST_CHECK_SECONDS
+                else:
+                    check_seconds = min(check_seconds * 2, self.IDLE_CHECK_SECONDS)
+                self.last_error = ""
+            except Exception as err:  # pylint: disable=broad-except
+                # keep watching, or every browser would silently stop
+                # getting updates.  Don't repeat the same complaint
+                # on every check, though.
+                if str(err) != self.last_error:
+                    self.last_error = str(err)
+                    fancy_logger.get().warning(
+                        "oobabot_plugin: could not publish status: %s", err
+                    )
+                check_seconds = self.IDLE_CHECK_SECONDS
+
+            # there's no notification from the bot when these
+            # change, so check on them periodically.  But there's
+            # only one of us, no matter how many browsers are open.
+            time.sleep(check_seconds)
+
+
+def format_event(event_name: str, data: typing.Any) -> str:
+    """
+    Formats a server-sent event.  The data is sent as JSON,
+    which also guarantees it fits on a single line.
+    """
+    return f"event: {event_name}\ndata: {json.dumps(data)}\n\n"
@@ -9,6 +9,8 @@ Including:
 """
 
 # import importlib.resources
+import datetime
+import html
 import importlib
 import logging
 import os
@@ -19,6 +21,10 @@ import typing
 
 import oobabot.fancy_logger
 
+from oobabot_plugin import character_catalog
+from oobabot_plugin import log_store
+from oobabot_plugin import transcript_archive
+
 # the discord token has this format:
 # AAAAAAAAAAAAAAAAAAAAAAAAAA.BBBBBB.CCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCCC
 #
@@ -106,6 +112,54 @@ def format_save_result(yaml_error: typing.Optional[str]) -> str:
     return "✔️ **Saved**"
 
 
+def format_log_lines(lines: typing.List[str]) -> str:
+    """
+    Wraps already-formatted log lines the same way the log
+    panel does.
+    """
+    return (
+        '<div class="oobabot-log">'
+        + "".join(f'<div class="oobabot-log-line">{line}</div>' for line in lines)
+        + "</div>"
+    )
+
+
+def format_log_search_results(lines: typing.List[str], has_more: bool) -> str:
+    if not lines:
+        summary = "No matching log lines."
+    elif has_more:
+        summary = f"Showing the newest {len(lines)} matching lines."
+    else:
+        summary = f"{len(lines)} matching lines."
+    return f"<p>{summary}</p>" + format_log_lines(lines)
+
+
+def format_log_search_error(error: str) -> str:
+    return f"<p>❌ <b>Error</b>: {html.escape(error)}</p>"
+
+
+def format_transcript_search_results(
+    hits: typing.List[transcript_archive.SearchHit], has_more: bool
+) -> str:
+    if not hits:
+        summary = "No matching messages."
+    elif has_more:
+        summary = f"Showing the newest {len(hits)} matching messages."
+    else:
+        summary = f"{len(hits)} matching messages."
+    lines = []
+    for hit in hits:
+        call_started = datetime.datetime.fromtimestamp(hit.call_started)
+        spoken = datetime.datetime.fromtimestamp(hit.start_time)
+        lines.append(
+            '<div class="oobabot-transcript-hit">'
+            + f"<b>#{hit.call_id}</b> {call_started:%Y-%m-%d %H:%M}, "
+            + f"{spoken:%H:%M:%S} <b>{html.escape(hit.author_name)}</b>: "
+            + f"{hit.snippet_html}</div>"
+        )
+    return f"<p>{summary}</p>" + "".join(lines)
+
+
 def make_link_from_token(
     token: str,
     fn_calc_invite_url: typing.Optional[typing.Callable[[str], str]],
@@ -153,13 +207,7 @@ def get_available_characters() -> typing.List[str]:
     The list is then sorted alphabetically, and 'None' is added to
     the start.
     """
-    characters = []
-    for extension in ["yml", "yaml", "json"]:
-        for filepath in pathlib.Path("characters").glob(f"*.{extension}"):
-            characters.append(filepath.stem)
-    characters.sort()
-    characters.insert(0, CHARACTER_NONE)
-    return characters
+    return [CHARACTER_NONE] + character_catalog.get().character_names()
 
 
 OTHER_HACKED_LOGGING_ATTRIBUTES = [
@@ -200,6 +248,9 @@ def repair_logging() -> typing.Optional[logging.Logger]:
     oobabot.fancy_logger.init_logging(logging.DEBUG, True)
     ooba_logger = oobabot.fancy_logger.get()
 
+    # keep the logs we show in the UI in our own store
+    log_store.install()
+
     # manually apply the "correct" emit to each of the StreamHandlers
     # that fancy_logger created
     for handler in ooba_logger.handlers:
@@ -217,15 +268,20 @@ def repair_logging() -> typing.Optional[logging.Logger]:
 STATUS_PREFIX = "<h3>Oobabot Status</h3>"
 
 
+STATUS_LABELS = {
+    "starting": "Starting&hellip;",
+    "running": "Running",
+    "stopping": "Stopping&hellip;",
+    "stopped": "Stopped",
+    "failed": "Failed",
+}
+
+
 def status_heading(status: str) -> str:
-    if status == "running":
-        return (
-            STATUS_PREFIX
-            + '<div class="oobabot_status oobabot_status_running">Running</div>'
-        )
-    if status == "stopped":
-        return (
-            STATUS_PREFIX
-            + '<div class="oobabot_status oobabot_status_stopped">Stopped</div>'
-        )
-    return STATUS_PREFIX
+    label = STATUS_LABELS.get(status)
+    if label is None:
+        return STATUS_PREFIX
+    return (
+        STATUS_PREFIX
+        + f'<div class="oobabot_status oobabot_status_{status}">{label}</div>'
+    )
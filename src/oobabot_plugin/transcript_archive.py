@@ -0,0 +1,515 @@
+# -*- coding: utf-8 -*-
+"""
+Keeps the transcripts of past voice calls on disk, so that they
+can be paged through and searched once the call is over.
+
+The bot only holds on to the latest messages of the current
+call, in memory.  We watch its transcript, and write each new
+message to a SQLite database next to the config file, along
+with a full-text index over its text.  Only the page of
+messages being looked at is ever read back into memory.
+"""
+
+import datetime
+import html
+import json
+import os
+import sqlite3
+import threading
+import time
+import typing
+
+from oobabot import fancy_logger
+from oobabot import types
+
+DEFAULT_FILE_NAME = "oobabot-transcripts.db"
+
+# marks the matching words in search snippets.  These can't
+# appear in html, so they're safe to find again after escaping.
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS calls (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    ended REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS authors (
+    user_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    is_bot INTEGER NOT NULL,
+    avatar_url TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    call_id INTEGER NOT NULL REFERENCES calls (id),
+    user_id INTEGER NOT NULL,
+    is_bot INTEGER NOT NULL,
+    start_time REAL NOT NULL,
+    duration REAL NOT NULL,
+    text TEXT NOT NULL,
+    -- [[text, confidence], ...] for transcribed messages,
+    -- NULL for the bot's own
+    tokens TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_by_call
+    ON messages (call_id, start_time, id);
+"""
+
+# the full-text index only stores the index itself, and reads
+# the text from the messages table
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+    text,
+    content='messages',
+    content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS messages_fts_insert
+    AFTER INSERT ON messages
+BEGIN
+    INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+END;
+"""
+
+
+class ArchivedMessage(types.VoiceMessage):
+    """
+    A message from the bot, read back from the archive.
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        start_time: datetime.datetime,
+        duration: datetime.timedelta,
+        text: str,
+    ):
+        super().__init__(user_id, start_time, duration)
+        self._text = text
+
+    @property
+    def text(self) -> str:
+        return self._text
+
+    @property
+    def is_bot(self) -> bool:
+        return True
+
+
+class ArchivedUserMessage(types.VoiceMessageWithTokens):
+    """
+    A transcribed message, read back from the archive.
+    """
+
+    def __init__(
+        self,
+        user_id: int,
+        start_time: datetime.datetime,
+        duration: datetime.timedelta,
+        tokens: typing.List[typing.Tuple[str, int]],
+    ):
+        super().__init__(user_id, start_time, duration)
+        self._tokens = tokens
+
+    @property
+    def text(self) -> str:
+        return "".join(token_text for token_text, _ in self._tokens)
+
+    @property
+    def is_bot(self) -> bool:
+        return False
+
+    @property
+    def tokens_with_confidence(self) -> typing.List[typing.Tuple[str, int]]:
+        return self._tokens
+
+
+class CallSummary(typing.NamedTuple):
+    """
+    A past call, without its messages.
+    """
+
+    call_id: int
+
+    # as seconds since the epoch
+    started: float
+    ended: float
+
+    message_count: int
+
+    def describe(self) -> str:
+        started = datetime.datetime.fromtimestamp(self.started)
+        ended = datetime.datetime.fromtimestamp(self.ended)
+        return (
+            f"#{self.call_id} {started:%Y-%m-%d %H:%M} - {ended:%H:%M} "
+            + f"({self.message_count} messages)"
+        )
+
+
+class CallsPage(typing.NamedTuple):
+    """
+    A page of past calls, newest first.
+    """
+
+    calls: typing.List[CallSummary]
+
+    # pass this back to get the page of calls before these, or
+    # None if this page reaches the first call
+    older_cursor: typing.Optional[int]
+
+
+class MessagesPage(typing.NamedTuple):
+    """
+    A page of messages from a past call, in the order they
+    were spoken.
+    """
+
+    messages: typing.List[types.VoiceMessage]
+
+    # the display information we have for everyone who spoke
+    # in these messages
+    authors: typing.Dict[int, types.FancyAuthor]
+
+    # pass this back to get the page after this one, or None if
+    # this page reaches the end of the call
+    next_cursor: typing.Optional[str]
+
+
+class SearchHit(typing.NamedTuple):
+    """
+    A message which matched a search.
+    """
+
+    call_id: int
+    call_started: float
+    author_name: str
+    start_time: float
+
+    # the part of the message around the match, as html, with
+    # the matching words in <mark> tags
+    snippet_html: str
+
+
+class TranscriptArchive:
+    """
+    A SQLite database of the messages from past voice calls.
+    """
+
+    # how often to look for new messages in the bot's transcript
+    RECORD_INTERVAL_SECONDS = 1.0
+
+    def __init__(self, path: str):
+        self.path = path
+        # the connection is shared between the recording thread
+        # and the UI's threads, one at a time
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(_SCHEMA)
+        try:
+            self.connection.executescript(_FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            # this sqlite was built without fts5.  Search still
+            # works, just by scanning every message.
+            fancy_logger.get().warning(
+                "oobabot_plugin: sqlite has no full-text search, "
+                + "transcript searches will be slow"
+            )
+            self.has_fts = False
+        self.connection.commit()
+
+        # the call new messages are being added to, and the
+        # messages from the bot's transcript we've already added.
+        # Keeping hold of the messages means their ids can't be
+        # reused by new ones.
+        self.call_id: typing.Optional[int] = None
+        self.recorded: typing.Dict[int, types.VoiceMessage] = {}
+
+        self.thread: typing.Optional[threading.Thread] = None
+        self.last_error = ""
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    def start_recording(
+        self,
+        get_transcript: typing.Callable[[], typing.List[types.VoiceMessage]],
+        get_fancy_author: typing.Callable[[int], typing.Optional[types.FancyAuthor]],
+    ) -> None:
+        """
+        Starts a background thread which adds new messages from
+        the bot's transcript to the archive as they arrive.
+        """
+        if self.thread is not None:
+            return
+
+        def record_forever() -> None:
+            while True:
+                try:
+                    self.record(get_transcript(), get_fancy_author)
+                    self.last_error = ""
+                except Exception as err:  # pylint: disable=broad-except
+                    # don't repeat the same complaint every second
+                    if str(err) != self.last_error:
+                        self.last_error = str(err)
+                        fancy_logger.get().warning(
+                            "oobabot_plugin: could not archive transcript: %s", err
+                        )
+                time.sleep(self.RECORD_INTERVAL_SECONDS)
+
+        self.thread = threading.Thread(
+            target=record_forever,
+            name="oobabot-transcript-archive",
+            daemon=True,
+        )
+        self.thread.start()
+
+    def record(
+        self,
+        messages: typing.List[types.VoiceMessage],
+        get_fancy_author: typing.Callable[[int], typing.Optional[types.FancyAuthor]],
+    ) -> None:
+        """
+        Adds any messages we haven't seen before to the archive.
+
+        The bot's transcript only ever holds the current call, so
+        if none of its messages are ones we've seen, a new call
+        has started.  An empty transcript says nothing either way,
+        since the bot may just not have answered in time.
+        """
+        if not messages:
+            return
+        new_messages = [
+            message for message in messages if id(message) not in self.recorded
+        ]
+        if len(new_messages) == len(messages):
+            self.call_id = None
+        self.recorded = {id(message): message for message in messages}
+        if not new_messages:
+            return
+
+        authors = {}
+        for user_id in {message.user_id for message in new_messages}:
+            fancy_author = get_fancy_author(user_id)
+            if fancy_author is not None:
+                authors[user_id] = fancy_author
+
+        with self.lock:
+            with self.connection:
+                self._insert(new_messages, authors)
+
+    def _insert(
+        self,
+        messages: typing.List[types.VoiceMessage],
+        authors: typing.Dict[int, types.FancyAuthor],
+    ) -> None:
+        started = min(message.start_time for message in messages).timestamp()
+        ended = max(
+            message.start_time + message.duration for message in messages
+        ).timestamp()
+        if self.call_id is None:
+            cursor = self.connection.execute(
+                "INSERT INTO calls (started, ended) VALUES (?, ?)",
+                (started, ended),
+            )
+            self.call_id = cursor.lastrowid
+        self.connection.execute(
+            "UPDATE calls SET started = MIN(started, ?), ended = MAX(ended, ?), "
+            + "message_count = message_count + ? WHERE id = ?",
+            (started, ended, len(messages), self.call_id),
+        )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO authors (user_id, name, is_bot, avatar_url) "
+            + "VALUES (?, ?, ?, ?)",
+            [
+                (
+                    user_id,
+                    author.author_name,
+                    author.author_is_bot,
+                    author.author_avatar_url,
+                )
+                for user_id, author in authors.items()
+            ],
+        )
+        self.connection.executemany(
+            "INSERT INTO messages "
+            + "(call_id, user_id, is_bot, start_time, duration, text, tokens) "
+            + "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (
+                    self.call_id,
+                    message.user_id,
+                    message.is_bot,
+                    message.start_time.timestamp(),
+                    message.duration.total_seconds(),
+                    message.text,
+                    json.dumps(message.tokens_with_confidence)
+                    if isinstance(message, types.VoiceMessageWithTokens)
+                    else None,
+                )
+                for message in messages
+            ],
+        )
+
+    def list_calls(
+        self, count: int, before_call_id: typing.Optional[int] = None
+    ) -> CallsPage:
+        """
+        Returns up to count calls, newest first, starting just
+        before the given call, or with the newest call.
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, started, ended, message_count FROM calls "
+                + "WHERE id < ? ORDER BY id DESC LIMIT ?",
+                (before_call_id if before_call_id is not None else 2**63 - 1, count),
+            ).fetchall()
+        calls = [CallSummary(*row) for row in rows]
+        older_cursor = calls[-1].call_id if len(calls) == count else None
+        return CallsPage(calls, older_cursor)
+
+    def get_call(self, call_id: int) -> typing.Optional[CallSummary]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT id, started, ended, message_count FROM calls WHERE id = ?",
+                (call_id,),
+            ).fetchone()
+        return CallSummary(*row) if row is not None else None
+
+    def read_messages(
+        self,
+        call_id: int,
+        count: int,
+        cursor: typing.Optional[str] = None,
+    ) -> MessagesPage:
+        """
+        Returns up to count messages from the given call, starting
+        just after the cursor from an earlier page, or at the start
+        of the call if there's no cursor.
+        """
+        after_time, after_id = float("-inf"), -1
+        if cursor is not None:
+            time_text, id_text = cursor.split(":")
+            after_time, after_id = float(time_text), int(id_text)
+
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id, user_id, is_bot, start_time, duration, text, tokens "
+                + "FROM messages WHERE call_id = ? "
+                + "AND (start_time > ? OR (start_time = ? AND id > ?)) "
+                + "ORDER BY start_time, id LIMIT ?",
+                (call_id, after_time, after_time, after_id, count + 1),
+            ).fetchall()
+            user_ids = sorted({row[1] for row in rows})
+            author_rows = self.connection.execute(
+                "SELECT user_id, name, is_bot, avatar_url FROM authors "
+                + f"WHERE user_id IN ({', '.join('?' * len(user_ids))})",
+                user_ids,
+            ).fetchall()
+
+        next_cursor = None
+        if len(rows) > count:
+            rows = rows[:count]
+            next_cursor = f"{rows[-1][3]!r}:{rows[-1][0]}"
+
+        return MessagesPage(
+            [_message_from_row(row) for row in rows],
+            {
+                user_id: types.FancyAuthor(
+                    user_id, bool(is_bot), name, (0, 0, 0), avatar_url
+                )
+                for user_id, name, is_bot, avatar_url in author_rows
+            },
+            next_cursor,
+        )
+
+    def search(
+        self, text: str, limit: int
+    ) -> typing.Tuple[typing.List[SearchHit], bool]:
+        """
+        Returns the newest messages which contain every word in
+        the text, up to limit of them, newest first.  Also returns
+        whether there were more matches than that.
+        """
+        words = text.split()
+        if not words:
+            return ([], False)
+
+        if self.has_fts:
+            # quote each word, so that nothing the user types is
+            # taken as fts query syntax
+            query = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+            sql = (
+                "SELECT messages.call_id, calls.started, authors.name, "
+                + "messages.user_id, messages.start_time, "
+                + f"snippet(messages_fts, 0, '{_MATCH_START}', '{_MATCH_END}', "
+                + "'...', 16) "
+                + "FROM messages_fts "
+                + "JOIN messages ON messages.id = messages_fts.rowid "
+                + "JOIN calls ON calls.id = messages.call_id "
+                + "LEFT JOIN authors ON authors.user_id = messages.user_id "
+                + "WHERE messages_fts MATCH ? "
+                + "ORDER BY messages.start_time DESC LIMIT ?"
+            )
+            params: typing.List[typing.Any] = [query, limit + 1]
+        else:
+            sql = (
+                "SELECT messages.call_id, calls.started, authors.name, "
+                + "messages.user_id, messages.start_time, messages.text "
+                + "FROM messages "
+                + "JOIN calls ON calls.id = messages.call_id "
+                + "LEFT JOIN authors ON authors.user_id = messages.user_id "
+                + "WHERE "
+                + " AND ".join(["messages.text LIKE ? ESCAPE '\\'"] * len(words))
+                + " ORDER BY messages.start_time DESC LIMIT ?"
+            )
+            params = [
+                "%"
+                + word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                + "%"
+                for word in words
+            ] + [limit + 1]
+
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+
+        hits = [
+            SearchHit(
+                call_id=call_id,
+                call_started=call_started,
+                author_name=author_name or f"-user {user_id}-",
+                start_time=start_time,
+                snippet_html=html.escape(snippet)
+                .replace(_MATCH_START, "<mark>")
+                .replace(_MATCH_END, "</mark>"),
+            )
+            for call_id, call_started, author_name, user_id, start_time, snippet in rows
+        ]
+        return (hits[:limit], len(hits) > limit)
+
+
+def _message_from_row(row: typing.Tuple[typing.Any, ...]) -> types.VoiceMessage:
+    _, user_id, is_bot, start_time, duration, text, tokens = row
+    start = datetime.datetime.fromtimestamp(start_time)
+    length = datetime.timedelta(seconds=duration)
+    if tokens is None or is_bot:
+        return ArchivedMessage(user_id, start, length, text)
+    return ArchivedUserMessage(
+        user_id,
+        start,
+        length,
+        [(token_text, confidence) for token_text, confidence in json.loads(tokens)],
+    )
+
+
+def path_for_config(config_file: str) -> str:
+    """
+    Returns where to keep the archive, given the config file.
+    """
+    return os.path.join(
+        os.path.dirname(os.path.abspath(config_file)), DEFAULT_FILE_NAME
+    )
@@ -3,87 +3,45 @@
 Renders a transcript of the current audio conversation.
 """
 
+import bisect
+import collections
 import datetime
 import html
+import threading
 import typing
 
+from oobabot import fancy_logger
 from oobabot import types
 
+from oobabot_plugin import ttl_cache
+
 SEPARATE_MESSAGE_DELTA = datetime.timedelta(seconds=1)
 
+# how many rendered user headers to remember, and for how long.
+# Headers are re-rendered after this time, to pick up changes
+# to the user's name or avatar, and the rows showing them are
+# sent again if they've changed.  Headers for users who can't
+# be found yet are re-rendered each time the view is updated.
+HEADER_CACHE_MAX_ENTRIES = 256
+HEADER_CACHE_TTL_SECONDS = 60.0
+
 DATETIME_NONE = datetime.datetime.min
 
 
 def get_transcript_html(
     messages: typing.List["types.VoiceMessage"],
     get_fancy_author: typing.Callable[[int], typing.Optional["types.FancyAuthor"]],
+    coalesce_tokens: bool = False,
 ) -> typing.Tuple[str, datetime.datetime]:
     """
     Formats a transcript into a string.
-    """
-    user_id_to_header: typing.Dict[int, str] = {}
-
-    # tuple is: (start_time, user_id, end_time, message_html)
-    message_list: typing.List[
-        typing.Tuple[datetime.datetime, int, datetime.datetime, str]
-    ] = []
-
-    for message in messages:
-        # create a header for this user if we don't have one
-        if message.user_id not in user_id_to_header:
-            fancy_author = get_fancy_author(message.user_id)
-            if fancy_author is None:
-                user_id_to_header[message.user_id] = format_unknown_user_header(
-                    message.user_id,
-                    message.is_bot,
-                )
-            else:
-                user_id_to_header[message.user_id] = format_header(
-                    fancy_author, message.is_bot
-                )
-        # add the message itself to our list
-        if isinstance(message, types.VoiceMessageWithTokens):
-            formatted_message = format_user_message(message)
-        else:
-            formatted_message = format_bot_message(message)
-
-        message_list.append(
-            (
-                message.start_time,
-                message.user_id,
-                message.start_time + message.duration,
-                formatted_message,
-            )
-        )
-
-    # order by timestamp
-    message_list.sort(key=lambda x: x[0])
-
-    html = ""
-
-    last_uid = -2
-    last_timestamp = DATETIME_NONE
-
-    for timestamp, user_id, end_timestamp, message in message_list:
-        new_user = False
-        time_since_last_message = timestamp - last_timestamp
-        if user_id != last_uid or time_since_last_message > SEPARATE_MESSAGE_DELTA:
-            if html != "":
-                html += format_footer()
-            new_user = True
-
-        if new_user:
-            html += user_id_to_header[user_id]
-            last_uid = user_id
 
-        html += message
-
-        last_timestamp = end_timestamp
-
-    if len(message_list) > 0:
-        html += format_footer()
-
-    return (html, last_timestamp)
+    Returns: (html, end time of the last message)
+    """
+    view = TranscriptView(
+        lambda: messages, get_fancy_author, coalesce_tokens=coalesce_tokens
+    )
+    return (view.get_html(), view.last_timestamp)
 
 
 CONFIDENCE_RANGES = [
@@ -115,6 +73,44 @@ def format_token(text: str, confidence: int) -> str:
     return f'<div class="oobabot_token {confidence_class}">{html.escape(text)}</div>'
 
 
+# the confidence range of every percentage, so that we don't
+# need to search CONFIDENCE_RANGES for each token
+_CONFIDENCE_RANGE_BY_PERCENTAGE = {
+    percentage: percentage_to_confidence_range(percentage) for percentage in range(101)
+}
+
+
+def _confidence_range(percentage: int) -> str:
+    return _CONFIDENCE_RANGE_BY_PERCENTAGE.get(
+        percentage
+    ) or percentage_to_confidence_range(percentage)
+
+
+def format_token_run(
+    tokens: typing.List[typing.Tuple[str, int]], confidence_range: str
+) -> str:
+    """
+    Formats several tokens, which all fall in the same confidence
+    range, as a single span.
+
+    The length and confidence of each token is kept in the span's
+    data-tokens attribute, as "length:confidence" pairs, so that
+    oobabot_log.js can show each token's confidence on hover.  If
+    there's only one token, the length is left out.
+    """
+    text = "".join(token_text for token_text, _ in tokens)
+    if len(tokens) == 1:
+        token_data = str(tokens[0][1])
+    else:
+        token_data = " ".join(
+            f"{len(token_text)}:{confidence}" for token_text, confidence in tokens
+        )
+    return (
+        f'<span class="oobabot_confidence_{confidence_range}" '
+        + f'data-tokens="{token_data}">{html.escape(text)}</span>'
+    )
+
+
 def header_class(is_bot: bool) -> str:
     if is_bot:
         return "oobabot_bot_message"
@@ -155,13 +151,39 @@ def format_footer() -> str:
 
 def format_user_message(
     user_message: "types.VoiceMessageWithTokens",
+    coalesce_tokens: bool = False,
 ) -> str:
-    message_html = ""
+    """
+    Formats the tokens of a user's message.
+
+    coalesce_tokens: if True, runs of tokens in the same confidence
+    range are merged into a single element, which carries each
+    token's confidence for the tooltip.  That halves the raw size
+    and the element count of a typical transcript, but compresses
+    worse and takes longer to render than one element per token.
+    """
+    tokens = user_message.tokens_with_confidence
+    if not coalesce_tokens:
+        return "".join(
+            format_token(token_text, confidence) for token_text, confidence in tokens
+        )
 
-    for token_text, confidence in user_message.tokens_with_confidence:
-        message_html += format_token(token_text, confidence)
+    run_html = []
+    run: typing.List[typing.Tuple[str, int]] = []
+    run_range = ""
+    for token in tokens:
+        token_range = _confidence_range(token[1])
+        if token_range != run_range and run:
+            run_html.append(format_token_run(run, run_range))
+            run = []
+        run.append(token)
+        run_range = token_range
+    if run:
+        run_html.append(format_token_run(run, run_range))
 
-    return message_html
+    # important to have no whitespace between the spans, or it
+    # will show up in between the tokens
+    return '<span class="oobabot_token_runs">' + "".join(run_html) + "</span>"
 
 
 def format_bot_message(
@@ -170,30 +192,592 @@ def format_bot_message(
     return html.escape(message.text)
 
 
+class RenderedMessage:
+    """
+    A message from the transcript, along with the HTML we've
+    rendered for it.
+    """
+
+    def __init__(self, message: "types.VoiceMessage", coalesce_tokens: bool = False):
+        self.message = message
+        self.user_id = message.user_id
+        self.start_time = message.start_time
+        self.end_time = message.start_time + message.duration
+
+        if isinstance(message, types.VoiceMessageWithTokens):
+            self.message_html = format_user_message(message, coalesce_tokens)
+        else:
+            self.message_html = format_bot_message(message)
+
+        # the number of the row this message was last shown in
+        self.row = -1
+
+
+class TranscriptUpdate(typing.NamedTuple):
+    """
+    A change to the transcript to send to the UI.
+
+    The transcript is sent as rows, one for each run of messages
+    from the same speaker.  Rows are numbered from the start of
+    the call, so each row keeps its number as older rows drop off
+    the front of the transcript.
+    """
+
+    # the version of the transcript after this update
+    version: int
+
+    # the version the caller asked for the changes since.  Deltas
+    # can only be applied on top of that version, or a later one.
+    since: int
+
+    # if True, rows replaces the caller's rows from first_row
+    # onward.  Otherwise rows is a full snapshot, and replaces
+    # everything the caller has shown so far.
+    is_delta: bool
+
+    # the number of the oldest row still in the transcript.
+    # Callers holding older rows than this should drop them.
+    row_base: int
+
+    # the number of the first row in rows
+    first_row: int
+
+    # each row is already formatted as HTML
+    rows: typing.List[str]
+
+
+def _runs_of_rows(rows: typing.Iterable[int]) -> typing.List[typing.Tuple[int, int]]:
+    """
+    Returns (first, last) for each run of consecutive row numbers.
+    """
+    runs: typing.List[typing.Tuple[int, int]] = []
+    for row in sorted(rows):
+        if runs and runs[-1][1] + 1 >= row:
+            runs[-1] = (runs[-1][0], row)
+        else:
+            runs.append((row, row))
+    return runs
+
+
 class TranscriptView:
     """
     A rendering of a voice transcript to HTML.
+
+    The transcript is rendered incrementally: each message is
+    formatted once, when it first appears, and only the rows
+    whose messages have changed are put back together.
+
+    Each change to the rows gets a new version number, and viewers
+    can ask for just the rows which have changed since the version
+    they last saw.  Usually that's only the newest row or two.
+    Only starting a new call makes them start over.
     """
 
+    # how many changes to remember, so that viewers which are up
+    # to this many versions behind can still be sent just the rows
+    # which changed
+    MAX_REMEMBERED_CHANGES = 100
+
+    # how many more messages from before the window to show each
+    # time a viewer asks for earlier ones
+    EARLIER_MESSAGES_PAGE_SIZE = 100
+
     def __init__(
         self,
         get_transcript: typing.Callable[[], typing.List["types.VoiceMessage"]],
         get_fancy_author: typing.Callable[[int], typing.Optional["types.FancyAuthor"]],
+        coalesce_tokens: bool = False,
+        window_messages: typing.Optional[int] = None,
+        window_age: typing.Optional[datetime.timedelta] = None,
     ):
-        self.last_transcript_html = ""
-        self.last_timestamp = DATETIME_NONE
+        """
+        coalesce_tokens: if True, runs of tokens with similar
+        confidence are rendered as a single element.
+        window_messages: if set, only the newest this many messages
+            are shown.
+        window_age: if set, only messages which ended within this
+            long of the newest message are shown.
+
+        Messages outside the window aren't kept by the view at all.
+        They can be rendered on request with get_earlier_html.
+        """
         self.get_transcript = get_transcript
         self.get_fancy_author = get_fancy_author
+        self.coalesce_tokens = coalesce_tokens
+        self.window_messages = window_messages
+        self.window_age = window_age
+
+        # (user_id, is_bot) -> header html, or None if the user
+        # couldn't be found
+        self.header_cache: ttl_cache.TTLCache[
+            typing.Tuple[int, bool], typing.Optional[str]
+        ] = ttl_cache.TTLCache(
+            HEADER_CACHE_MAX_ENTRIES,
+            HEADER_CACHE_TTL_SECONDS,
+        )
+        # (user_id, is_bot) -> the header html the rows were last
+        # rendered with, so that we can tell when it's changed
+        self.shown_headers: typing.Dict[typing.Tuple[int, bool], str] = {}
+
+        # the view can be asked for updates from several threads
+        self.lock = threading.Lock()
+
+        # messages in the order they arrived, which is also the
+        # order they will be dropped from the bot's transcript
+        self.arrived: typing.Deque[RenderedMessage] = collections.deque()
+        self.known_messages: typing.Set[int] = set()
+
+        # messages ordered by start time, which is the order we
+        # display them in.  start_times is kept in parallel, so that
+        # we can bisect it.
+        self.ordered: typing.List[RenderedMessage] = []
+        self.start_times: typing.List[datetime.datetime] = []
+
+        # the html of each row, along with the messages in it, so
+        # that we can tell which rows have changed.  row_base is the
+        # number of the first of them.
+        self.rows: typing.List[str] = []
+        self.row_messages: typing.List[typing.Tuple[RenderedMessage, ...]] = []
+        self.row_base = 0
+
+        # rows, numbered as they were before the current update,
+        # which have had messages added or removed next to them
+        self.dirty_rows: typing.Set[int] = set()
+
+        # (version, number of the first row it changed) for recent
+        # changes, oldest first.  None means every row changed.
+        self.changes: typing.Deque[
+            typing.Tuple[int, typing.Optional[int]]
+        ] = collections.deque(maxlen=self.MAX_REMEMBERED_CHANGES)
+
+        # the whole transcript as a single string, only put together
+        # when someone asks for it
+        self.last_transcript_html: typing.Optional[str] = ""
+        self.last_timestamp = DATETIME_NONE
+        self.version = 0
 
     def get_html(self) -> str:
-        messages = self.get_transcript()
-        if not messages:
-            return ""
-
-        latest_end_timestamp = messages[-1].start_time + messages[-1].duration
-        if latest_end_timestamp != self.last_timestamp:
-            self.last_transcript_html, self.last_timestamp = get_transcript_html(
-                messages,
-                self.get_fancy_author,
+        messages, _ = self._split_window(self.get_transcript())
+        with self.lock:
+            self._update(messages)
+            if self.last_transcript_html is None:
+                self.last_transcript_html = "".join(self.rows)
+            return self.last_transcript_html
+
+    def get_version(self) -> int:
+        """
+        Returns a number which changes whenever the html does,
+        except when the oldest row only loses messages off the front.
+        """
+        messages, _ = self._split_window(self.get_transcript())
+        with self.lock:
+            self._update(messages)
+            return self.version
+
+    def get_update(self, since_version: int) -> TranscriptUpdate:
+        """
+        Returns the rows which have changed since the given version,
+        or a full snapshot if we can't tell, or if since_version
+        is negative.
+        """
+        messages, _ = self._split_window(self.get_transcript())
+        with self.lock:
+            self._update(messages)
+            first_row = self._first_row_changed_since(since_version)
+            if first_row is None:
+                return TranscriptUpdate(
+                    version=self.version,
+                    since=since_version,
+                    is_delta=False,
+                    row_base=self.row_base,
+                    first_row=self.row_base,
+                    rows=list(self.rows),
+                )
+            # rows which have since dropped off the front don't
+            # need to be sent
+            first_row = max(first_row, self.row_base)
+            return TranscriptUpdate(
+                version=self.version,
+                since=since_version,
+                is_delta=True,
+                row_base=self.row_base,
+                first_row=first_row,
+                rows=self.rows[first_row - self.row_base :],
             )
-        return self.last_transcript_html
+
+    def get_earlier_html(self, count: int) -> typing.Tuple[str, bool]:
+        """
+        Renders the newest count messages from before the window,
+        which are still in the bot's transcript.
+
+        Returns: (html, whether there are more earlier messages)
+        """
+        _, earlier = self._split_window(self.get_transcript())
+        shown = earlier[-count:] if count > 0 else []
+        # these are rendered from scratch every time, rather than
+        # remembered, but there are only ever as many of them as
+        # the bot keeps in its transcript
+        view = TranscriptView(
+            lambda: shown,
+            self.get_fancy_author,
+            coalesce_tokens=self.coalesce_tokens,
+        )
+        return (view.get_html(), len(shown) < len(earlier))
+
+    def _split_window(
+        self, messages: typing.List["types.VoiceMessage"]
+    ) -> typing.Tuple[
+        typing.List["types.VoiceMessage"], typing.List["types.VoiceMessage"]
+    ]:
+        """
+        Splits the bot's transcript into the messages in the window,
+        and those from before it.  The bot adds messages to the end
+        of its transcript as they arrive, so the window is always
+        the end of the list.
+        """
+        first = 0
+        if self.window_messages is not None:
+            first = max(len(messages) - self.window_messages, 0)
+        if self.window_age is not None and len(messages) > first:
+            newest = messages[-1]
+            cutoff = newest.start_time + newest.duration - self.window_age
+            while (
+                first < len(messages)
+                and messages[first].start_time + messages[first].duration < cutoff
+            ):
+                first += 1
+        if first == 0:
+            # without a window, don't copy the whole transcript
+            return (messages, [])
+        return (messages[first:], messages[:first])
+
+    def _first_row_changed_since(self, since_version: int) -> typing.Optional[int]:
+        end_row = self.row_base + len(self.rows)
+        if since_version == self.version:
+            return end_row
+        if (
+            since_version < 0
+            or since_version > self.version
+            or not self.changes
+            or self.changes[0][0] > since_version + 1
+        ):
+            # from before the oldest change we remember
+            return None
+        first_row = end_row
+        for version, changed_row in reversed(self.changes):
+            if version <= since_version:
+                break
+            if changed_row is None:
+                return None
+            first_row = min(first_row, changed_row)
+        return first_row
+
+    def _update(self, messages: typing.List["types.VoiceMessage"]) -> None:
+        self._update_messages(messages)
+        self._update_headers()
+
+    def _update_messages(self, messages: typing.List["types.VoiceMessage"]) -> None:
+        # the bot's transcript is a ring buffer, so new messages only
+        # ever show up at the end, and old ones drop off the front.
+        first_new = len(messages)
+        while first_new > 0 and id(messages[first_new - 1]) not in self.known_messages:
+            first_new -= 1
+
+        is_new_call = first_new == 0
+        first_known = 0
+        if is_new_call:
+            # nothing in common with what we've shown, so this must
+            # be a new call.  Start over.
+            dropped = len(self.arrived)
+            if dropped:
+                fancy_logger.get().debug(
+                    "oobabot_plugin: transcript header cache: %s",
+                    self.header_cache.stats(),
+                )
+        else:
+            # with a time window, the front of the window can also
+            # move back to include messages we've already let go of,
+            # if the newest message ended before the one before it.
+            while id(messages[first_known]) not in self.known_messages:
+                first_known += 1
+            oldest_id = id(messages[first_known])
+            dropped = 0
+            for rendered in self.arrived:
+                if id(rendered.message) == oldest_id:
+                    break
+                dropped += 1
+        self._remove_arrived(dropped)
+
+        if first_new == len(messages) and dropped == 0 and first_known == 0:
+            return
+
+        for message in reversed(messages[:first_known]):
+            self.arrived.appendleft(self._add_message(message, arrived_first=True))
+        for message in messages[first_new:]:
+            self.arrived.append(self._add_message(message))
+
+        self._update_rows(is_new_call)
+
+    def _add_message(
+        self, message: "types.VoiceMessage", arrived_first: bool = False
+    ) -> RenderedMessage:
+        """
+        Adds a message to the display order.  Messages which start
+        at the same time are shown in the order they arrived, so
+        arrived_first says whether this one arrived before all the
+        others, rather than after them.
+        """
+        rendered = RenderedMessage(message, self.coalesce_tokens)
+        self.known_messages.add(id(message))
+        if arrived_first:
+            index = bisect.bisect_left(self.start_times, rendered.start_time)
+        else:
+            index = bisect.bisect_right(self.start_times, rendered.start_time)
+        self.ordered.insert(index, rendered)
+        self.start_times.insert(index, rendered.start_time)
+        self._mark_neighbors_dirty(index - 1, index + 1)
+        return rendered
+
+    def _remove_arrived(self, count: int) -> None:
+        """
+        Removes the oldest count messages from the transcript.
+        """
+        for _ in range(count):
+            rendered = self.arrived.popleft()
+            self.known_messages.discard(id(rendered.message))
+            index = self._index_of(rendered)
+            del self.ordered[index]
+            del self.start_times[index]
+            if rendered.row >= 0:
+                self.dirty_rows.add(rendered.row)
+            self._mark_neighbors_dirty(index - 1, index)
+
+    def _index_of(self, rendered: RenderedMessage) -> int:
+        index = bisect.bisect_left(self.start_times, rendered.start_time)
+        while self.ordered[index] is not rendered:
+            index += 1
+        return index
+
+    def _mark_neighbors_dirty(self, before: int, after: int) -> None:
+        # the messages on either side of an addition or removal are
+        # now next to something else, so whether they're in the same
+        # row may have changed
+        for index in (before, after):
+            if 0 <= index < len(self.ordered) and self.ordered[index].row >= 0:
+                self.dirty_rows.add(self.ordered[index].row)
+
+    def _group_messages(
+        self, start: int, end: int
+    ) -> typing.List[typing.Tuple[RenderedMessage, ...]]:
+        """
+        Splits the messages from start to end into runs from the
+        same speaker, which will each become a row.
+        """
+        groups: typing.List[typing.List[RenderedMessage]] = []
+        previous = None
+        for rendered in self.ordered[start:end]:
+            if (
+                previous is None
+                or rendered.user_id != previous.user_id
+                or rendered.start_time - previous.end_time > SEPARATE_MESSAGE_DELTA
+            ):
+                groups.append([])
+            groups[-1].append(rendered)
+            previous = rendered
+        return [tuple(group) for group in groups]
+
+    def _update_rows(self, is_new_call: bool) -> None:
+        """
+        Brings the rows up to date with the messages, and records
+        which rows changed.  Only the rows next to where messages
+        were added or removed are regrouped, so that this costs
+        about the same however long the call has gone on.
+        """
+        dirty_rows = self.dirty_rows
+        self.dirty_rows = set()
+        old_base = self.row_base
+        old_end = old_base + len(self.rows)
+
+        if is_new_call or not self.rows:
+            self.shown_headers.clear()
+            groups = self._group_messages(0, len(self.ordered))
+            self.rows = [self._format_row(messages) for messages in groups]
+            self.row_messages = groups
+            # number the new rows after the old ones, so that
+            # the numbers never go backwards
+            self.row_base = old_end
+            for row, messages in enumerate(groups, start=self.row_base):
+                for rendered in messages:
+                    rendered.row = row
+            self._record_change(None)
+            return
+
+        # regroup each run of neighboring dirty rows, last run first,
+        # so that the rows of the runs still to come keep their numbers
+        first_changed: typing.Optional[int] = None
+        for first_row, last_row in reversed(_runs_of_rows(dirty_rows)):
+            changed = self._regroup_rows(first_row, last_row)
+            if changed is not None and (
+                first_changed is None or changed < first_changed
+            ):
+                first_changed = changed
+
+        # the html has changed even if it's only lost messages from
+        # the front, which isn't worth telling viewers about
+        self.last_transcript_html = None
+        end_row = self.row_base + len(self.rows)
+        if first_changed is None:
+            if self.row_base == old_base and end_row == old_end:
+                return
+            # rows were only dropped
+            first_changed = end_row
+        self._record_change(first_changed)
+
+    def _regroup_rows(self, first_row: int, last_row: int) -> typing.Optional[int]:
+        """
+        Regroups the messages which were in rows first_row through
+        last_row, along with any new messages among them, and
+        renumbers the rows after them if there are now more or fewer.
+        Returns the number of the first row which changed, if any.
+        """
+        old_first = first_row - self.row_base
+        old_end = last_row - self.row_base + 1
+        is_front = old_first == 0
+
+        # the rows on either side haven't changed, so the messages
+        # to regroup are the ones between them
+        start = 0
+        if not is_front:
+            start = self._index_of(self.row_messages[old_first - 1][-1]) + 1
+        end = len(self.ordered)
+        if old_end < len(self.rows):
+            end = self._index_of(self.row_messages[old_end][0])
+        groups = self._group_messages(start, end)
+
+        new_first = first_row
+        if is_front:
+            # rows only move when the ones before them drop off
+            new_first = max(first_row, groups[0][0].row) if groups else last_row + 1
+
+        old_messages = self.row_messages[old_first:old_end]
+        old_html = dict(zip(old_messages, self.rows[old_first:old_end]))
+        first_changed: typing.Optional[int] = None
+        rows = []
+        for row, messages in enumerate(groups, start=new_first):
+            old_index = row - first_row
+            old_row_messages = (
+                old_messages[old_index] if old_index < len(old_messages) else ()
+            )
+            # the oldest row can lose messages as they drop off the
+            # front of the transcript.  Viewers are welcome to keep
+            # showing them, so that doesn't count as a change.
+            is_same = old_row_messages == messages or (
+                is_front
+                and row == new_first
+                and old_row_messages[-len(messages) :] == messages
+            )
+            if not is_same and first_changed is None:
+                first_changed = row
+
+            row_html = old_html.get(messages)
+            if row_html is None:
+                row_html = self._format_row(messages)
+            rows.append(row_html)
+            for rendered in messages:
+                rendered.row = row
+
+        self.rows[old_first:old_end] = rows
+        self.row_messages[old_first:old_end] = groups
+        if is_front:
+            self.row_base = new_first
+
+        # the rows after these move up or down if there are now
+        # more or fewer of them
+        new_end = new_first + len(groups)
+        shift = new_end - (last_row + 1)
+        if shift:
+            moved = self.row_messages[new_end - self.row_base :]
+            for messages in moved:
+                for rendered in messages:
+                    rendered.row += shift
+            if moved and first_changed is None:
+                first_changed = new_end
+        return first_changed
+
+    def _record_change(self, first_changed: typing.Optional[int]) -> None:
+        self.version += 1
+        self.changes.append((self.version, first_changed))
+        self.last_transcript_html = None
+        if self.ordered:
+            self.last_timestamp = self.ordered[-1].end_time
+        else:
+            self.last_timestamp = DATETIME_NONE
+
+    def _update_headers(self) -> None:
+        """
+        Re-renders the rows whose header has changed since they
+        were rendered, either because the cached header expired and
+        the user's name or avatar is now different, or because a
+        user who couldn't be found before now can be.
+        """
+        changed_keys = {
+            key
+            for key, shown_header in self.shown_headers.items()
+            if self._format_header(key) != shown_header
+        }
+        if not changed_keys:
+            return
+
+        first_changed: typing.Optional[int] = None
+        shown_keys = set()
+        for index, messages in enumerate(self.row_messages):
+            key = _header_key(messages)
+            if key not in changed_keys:
+                continue
+            self.rows[index] = self._format_row(messages)
+            shown_keys.add(key)
+            if first_changed is None:
+                first_changed = self.row_base + index
+        # speakers whose rows have all dropped off needn't be
+        # checked again
+        for key in changed_keys - shown_keys:
+            del self.shown_headers[key]
+        if first_changed is not None:
+            self._record_change(first_changed)
+
+    def _format_row(self, messages: typing.Tuple[RenderedMessage, ...]) -> str:
+        key = _header_key(messages)
+        header = self._format_header(key)
+        self.shown_headers[key] = header
+        return (
+            header
+            + "".join(rendered.message_html for rendered in messages)
+            + format_footer()
+        )
+
+    def _format_header(self, key: typing.Tuple[int, bool]) -> str:
+        user_id, is_bot = key
+
+        def render_header() -> typing.Optional[str]:
+            fancy_author = self.get_fancy_author(user_id)
+            if fancy_author is None:
+                return None
+            return format_header(fancy_author, is_bot)
+
+        # don't remember that a user couldn't be found, so that
+        # their header can be fixed as soon as they can be
+        header = self.header_cache.get(
+            key,
+            render_header,
+            fn_should_cache=lambda header: header is not None,
+        )
+        if header is None:
+            return format_unknown_user_header(user_id, is_bot)
+        return header
+
+
+def _header_key(
+    messages: typing.Tuple[RenderedMessage, ...]
+) -> typing.Tuple[int, bool]:
+    message = messages[0].message
+    return (message.user_id, message.is_bot)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+A small, thread-safe cache with a bounded size and
+time-based expiry.
+"""
+
+import collections
+import threading
+import time
+import typing
+
+K = typing.TypeVar("K")
+V = typing.TypeVar("V")
+
+
+class TTLCache(typing.Generic[K, V]):
+    """
+    Caches the results of a lookup function, by key.
+
+    Entries expire ttl_seconds after they were loaded.  When the
+    cache holds max_entries, the least recently used entry is
+    evicted to make room for a new one.
+
+    Keeps counts of hits and misses, so that we can tell whether
+    the cache is earning its keep.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        fn_now: typing.Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.fn_now = fn_now
+
+        self.lock = threading.Lock()
+        # key -> (expiry time, value), in least to most recently used order
+        self.entries: "collections.OrderedDict[K, typing.Tuple[float, V]]" = (
+            collections.OrderedDict()
+        )
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(
+        self,
+        key: K,
+        fn_load: typing.Callable[[], V],
+        fn_should_cache: typing.Optional[typing.Callable[[V], bool]] = None,
+    ) -> V:
+        """
+        Returns the cached value for key, calling fn_load to
+        get it if it isn't cached or has expired.
+
+        fn_should_cache: if given, a loaded value is only cached
+        if this returns True for it.  Otherwise it's loaded again
+        on the next get.
+        """
+        now = self.fn_now()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # don't hold the lock while loading, since the loader
+        # may be slow, or need locks of its own
+        value = fn_load()
+        if fn_should_cache is not None and not fn_should_cache(value):
+            return value
+
+        with self.lock:
+            self.entries[key] = (now + self.ttl_seconds, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def invalidate(self, key: typing.Optional[K] = None) -> None:
+        """
+        Removes key from the cache, or everything if key is None.
+        """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def stats(self) -> str:
+        """
+        Returns a human-readable summary of how the cache is doing.
+        """
+        total = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / total if total else 0.0
+        return (
+            f"{self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), "
+            + f"{self.evictions} evictions, {len(self)} entries"
+        )
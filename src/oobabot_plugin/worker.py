@@ -3,76 +3,389 @@
 This manages the oobabot worker thread, as well
 as creating the bot itself.
 """
+from concurrent import futures
 import io
 import os
+import tempfile
 import threading
 import typing
 
-import gradio as gr
+from oobabot import fancy_logger
 from oobabot import oobabot
 
 import oobabot_plugin
-from oobabot_plugin import input_handlers
-from oobabot_plugin import layout
+from oobabot_plugin import bot_process
+from oobabot_plugin import character_catalog
+from oobabot_plugin import fake_bot as fake_bot_module
+from oobabot_plugin import live_settings
+from oobabot_plugin import log_spool as log_spool_module
+from oobabot_plugin import log_store
+from oobabot_plugin import settings_writer
+from oobabot_plugin import transcript_archive as transcript_archive_module
+from oobabot_plugin import transcript_view
+from oobabot_plugin import ttl_cache
+
+if typing.TYPE_CHECKING:
+    # the UI modules bring in gradio, which the bot doesn't need
+    # when it's run without the UI
+    import gradio as gr
+
+    from oobabot_plugin import input_handlers
+    from oobabot_plugin import layout as layout_module
+
+# lifecycle states of the bot.  These are also what the
+# UI shows as the bot's running state.
+STOPPED = "stopped"
+STARTING = "starting"
+RUNNING = "running"
+STOPPING = "stopping"
+FAILED = "failed"
+
+
+class LogUpdate(typing.NamedTuple):
+    """
+    A batch of log lines to send to the UI.
+    """
+
+    # the etag of the log after these lines were appended
+    etag: int
+
+    # if True, lines only contains the lines appended since the
+    # etag the caller asked about.  Otherwise lines is a full
+    # snapshot, and replaces whatever the caller has shown so far.
+    is_delta: bool
+
+    # each line is already formatted as HTML
+    lines: typing.List[str]
+
+    # the number of lines the log panel should be holding.
+    # Callers showing more lines than this should drop the oldest.
+    retained: int
+
+
+class LogSearchResult(typing.NamedTuple):
+    """
+    The log lines which matched a search.
+    """
+
+    # the newest matching lines, oldest first, formatted as HTML
+    lines: typing.List[str]
+
+    # True if there were more matching lines than we returned
+    has_more: bool
+
+
+class LogHistoryPage(typing.NamedTuple):
+    """
+    A page of log lines read back from the log spool.
+    """
+
+    # oldest first, formatted as HTML
+    lines: typing.List[str]
+
+    # pass this back to get the page before this one.  None if
+    # this is the oldest page.
+    older_cursor: typing.Optional[str]
+
+
+class ArchivedCallPage(typing.NamedTuple):
+    """
+    A page of messages from a past voice call.
+    """
+
+    # rendered the same way as the live transcript
+    html: str
+
+    # pass this back to get the page after this one.  None if
+    # this is the last page of the call.
+    next_cursor: typing.Optional[str]
+
+
+class TranscriptSearchResult(typing.NamedTuple):
+    """
+    The messages from past voice calls which matched a search.
+    """
+
+    # newest first
+    hits: typing.List[transcript_archive_module.SearchHit]
+
+    # True if there were more matches than we're returning
+    has_more: bool
 
 
 class OobabotWorker:
     """
-    This class is responsible for running oobabot in a worker thread.
-    It also connects the plugin's input fields to the oobabot's internal
-    settings representation.
+    This class is responsible for running oobabot in a worker thread,
+    or optionally in a child process.  It also connects the plugin's
+    input fields to the oobabot's internal settings representation.
     """
 
+    # how many users' display information to remember, and for how
+    # long.  Looking these up touches the bot's discord state, which
+    # contends with the bot's own thread.
+    AUTHOR_CACHE_MAX_ENTRIES = 256
+    AUTHOR_CACHE_TTL_SECONDS = 60.0
+
+    # how many persona previews to remember.  The key includes the
+    # character file's mtime and size, so entries can't go stale;
+    # the ttl just lets memory from old edits be reclaimed.
+    PERSONA_CACHE_MAX_ENTRIES = 256
+    PERSONA_CACHE_TTL_SECONDS = 3600.0
+
+    # how long to wait for the bot to stop before giving up on it
+    DEFAULT_STOP_TIMEOUT_SECONDS = 10.0
+
+    # the log store keeps far more than is worth showing in the
+    # log panel, so only show the newest lines there.  Older ones
+    # can be found by searching.
+    LOG_PANEL_MAX_LINES = 5000
+    LOG_SEARCH_MAX_LINES = 500
+
+    # how many lines of history from the log spool to show at once
+    LOG_HISTORY_PAGE_LINES = 200
+
+    # how many past calls, messages from a past call, and search
+    # results from the transcript archive to show at once
+    ARCHIVE_CALLS_PAGE_SIZE = 50
+    ARCHIVE_MESSAGES_PAGE_SIZE = 100
+    ARCHIVE_SEARCH_MAX_RESULTS = 100
+
     bot: oobabot.Oobabot
     handlers: typing.Dict[
-        gr.components.IOComponent,
-        input_handlers.ComponentToSetting,
+        "gr.components.IOComponent",
+        "input_handlers.ComponentToSetting",
     ]
 
     def __init__(
         self,
         port: int,
         config_file: str,
-        layout: layout.OobabotLayout,
+        layout: typing.Optional["layout_module.OobabotLayout"],
+        run_in_subprocess: bool = False,
+        stop_timeout_seconds: float = DEFAULT_STOP_TIMEOUT_SECONDS,
+        log_spool: bool = False,
+        transcript_archive: bool = False,
+        fake_bot: typing.Optional[fake_bot_module.FakeBotOptions] = None,
     ):
         """
         port: The port the streaming API is running on
+        layout: The UI whose inputs edit the settings, or None when
+            the bot is run without a UI
+        run_in_subprocess: If True, the bot runs in a child process
+            rather than a thread.  Settings are still loaded in this
+            process, so the child reads them from the config file.
+        stop_timeout_seconds: How long to wait for the bot to stop.
+            A child process is killed after this long; a thread
+            can't be, so the bot is marked as failed instead.
+        log_spool: If True, the bot's logs are also kept on disk,
+            in a folder next to the config file.
+        transcript_archive: If True, the transcripts of voice calls
+            are kept in a database next to the config file, so that
+            they can be looked back through after the call.
+        fake_bot: If set, runs a stand-in for oobabot which makes
+            up log lines and voice transcripts at the given rates,
+            rather than connecting to Discord.  This is for load
+            testing the UI, and always runs in a thread.
         """
         self.config_file = config_file
         self.port = port
-        self.thread = None
-        self.stopping = False
+        self.fake_bot = fake_bot
+        # the child process always runs the real bot
+        self.run_in_subprocess = run_in_subprocess and fake_bot is None
+        self.stop_timeout_seconds = stop_timeout_seconds
+        self.thread: typing.Optional[threading.Thread] = None
+        self.bot_process: typing.Optional[bot_process.BotProcess] = None
         self.layout = layout
+        self.author_cache: ttl_cache.TTLCache[
+            int, typing.Optional["oobabot.types.FancyAuthor"]
+        ] = ttl_cache.TTLCache(
+            self.AUTHOR_CACHE_MAX_ENTRIES,
+            self.AUTHOR_CACHE_TTL_SECONDS,
+        )
+        self.persona_cache: ttl_cache.TTLCache[
+            typing.Tuple[str, typing.Optional[typing.Tuple[int, int]], str, str],
+            typing.Tuple[str, str],
+        ] = ttl_cache.TTLCache(
+            self.PERSONA_CACHE_MAX_ENTRIES,
+            self.PERSONA_CACHE_TTL_SECONDS,
+        )
+        self.prefetch_lock = threading.Lock()
+
+        # the bot is replaced on the lifecycle thread while the UI
+        # reads it, along with the input handlers bound to its
+        # settings.  This keeps the two in step.
+        self.bot_lock = threading.Lock()
+
+        self.log_spool: typing.Optional[log_spool_module.LogSpool] = None
+        if log_spool:
+            self.log_spool = log_spool_module.install(
+                log_spool_module.folder_for_config(config_file)
+            )
+        self.last_log_export: typing.Optional[str] = None
+
+        self.transcript_archive: typing.Optional[
+            transcript_archive_module.TranscriptArchive
+        ] = None
+        if transcript_archive:
+            self.transcript_archive = transcript_archive_module.TranscriptArchive(
+                transcript_archive_module.path_for_config(config_file)
+            )
+
+        # settings are only written when something has changed,
+        # or if there's no settings file yet
+        self.settings_dirty = not os.path.exists(config_file)
+        self.settings_writer = settings_writer.SettingsWriter(
+            config_file,
+            self._write_settings,
+            self.mark_settings_changed,
+        )
+
+        # starting and stopping can take a while, so they're done
+        # on a background thread, one at a time and in the order
+        # they were asked for.  The state changes as soon as they're
+        # asked for, so that the UI can show it right away.
+        self.state_lock = threading.Lock()
+        self.state = STOPPED
+        self.lifecycle_executor = futures.ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="oobabot-lifecycle",
+        )
         self.reload()
 
+        if self.transcript_archive is not None:
+            self.transcript_archive.start_recording(
+                self.get_transcript,
+                self.get_fancy_author,
+            )
+
     def reload(self) -> None:
         """
         Stops oobabot if it's running, then reloads it.
+        This blocks until the bot has stopped, or until the
+        stop timeout has passed.
         """
-        if self.thread is not None:
-            self.stopping = True
-            self.bot.stop()
-            self.thread.join()
-            self.stopping = False
-            self.thread = None
-
+        if self.thread is not None or self.bot_process is not None:
+            if not self._stop_bot():
+                raise RuntimeError("oobabot did not stop in time")
+        self.author_cache.invalidate()
+
+        # the bot loads its settings from the file, so make sure
+        # any save that's still in flight has landed
+        self.settings_writer.flush()
+        bot: oobabot.Oobabot
+        if self.fake_bot is not None:
+            bot = fake_bot_module.FakeOobabot(self._get_cli_args(), self.fake_bot)
+        else:
+            bot = oobabot.Oobabot(self._get_cli_args())
+        # creating the bot re-attaches oobabot's own log buffer
+        log_store.install()
+        with self.bot_lock:
+            # the handlers will be made again, for the new settings
+            self.bot = bot
+            self.handlers = {}
+
+    def _get_cli_args(self) -> typing.List[str]:
         args = [
             "--config",
             os.path.abspath(self.config_file),
         ]
         if self.port != oobabot_plugin.DEFAULT_STREAMING_API_PORT:
             args.extend(["--base-url", f"ws://localhost:{str(self.port)}"])
-
-        self.bot = oobabot.Oobabot(args)
-        self.handlers = {}
+        return args
 
     def start(self) -> None:
         """
-        Stops the oobabot if it's running, then starts it.
+        Starts oobabot in the background, reloading it first.
+        Returns immediately.  Does nothing if the bot is
+        already starting or running.
         """
-        self.reload()
-        self.thread = threading.Thread(target=self.bot.start)
-        self.thread.start()
+        with self.state_lock:
+            if self.state in (STARTING, RUNNING):
+                return
+            self.state = STARTING
+        self.lifecycle_executor.submit(self._do_start)
+
+    def stop(self) -> None:
+        """
+        Stops oobabot in the background.  Returns immediately.
+        Does nothing if the bot is already stopping, or if
+        there's nothing to stop.
+        """
+        with self.state_lock:
+            if self.state in (STOPPED, STOPPING):
+                return
+            if self.state == FAILED and not self.is_running():
+                return
+            self.state = STOPPING
+        self.lifecycle_executor.submit(self._do_stop)
+
+    def get_state(self) -> str:
+        """
+        Returns the bot's lifecycle state, one of STOPPED,
+        STARTING, RUNNING, STOPPING or FAILED.
+        """
+        with self.state_lock:
+            if self.state == RUNNING and not self.is_running():
+                # the bot's main loop exited without being asked to
+                fancy_logger.get().error("oobabot_plugin: oobabot exited unexpectedly")
+                self.state = FAILED
+            return self.state
+
+    def _set_state(self, from_state: str, to_state: str) -> None:
+        # a start or stop asked for while we were busy changes the
+        # state before we're done.  Leave that in place for it.
+        with self.state_lock:
+            if self.state == from_state:
+                self.state = to_state
+
+    def _do_start(self) -> None:
+        try:
+            self.reload()
+            if self.run_in_subprocess:
+                # the child loads its settings from the config file,
+                # which is saved before every start
+                self.bot_process = bot_process.BotProcess(self._get_cli_args())
+                self.bot_process.start()
+            else:
+                self.thread = threading.Thread(target=self.bot.start)
+                self.thread.start()
+        except Exception as err:  # pylint: disable=broad-except
+            fancy_logger.get().error("oobabot_plugin: could not start oobabot: %s", err)
+            self._set_state(STARTING, FAILED)
+            return
+        self._set_state(STARTING, RUNNING)
+
+    def _do_stop(self) -> None:
+        if self._stop_bot():
+            self._set_state(STOPPING, STOPPED)
+        else:
+            self._set_state(STOPPING, FAILED)
+
+    def _stop_bot(self) -> bool:
+        """
+        Stops the bot, waiting up to the stop timeout for it.
+        Returns False if it's still running afterwards.
+        """
+        if self.bot_process is not None:
+            # kills the child if it doesn't stop in time
+            self.bot_process.stop(timeout=self.stop_timeout_seconds)
+            self.bot_process = None
+        elif self.thread is not None:
+            self.bot.stop()
+            self.thread.join(timeout=self.stop_timeout_seconds)
+            if self.thread.is_alive():
+                # there's no way to kill a thread, so hang on to it
+                # and let the next stop or start try again
+                fancy_logger.get().error(
+                    "oobabot_plugin: oobabot did not stop within %.1f seconds",
+                    self.stop_timeout_seconds,
+                )
+                return False
+            self.thread = None
+        fancy_logger.get().debug(
+            "oobabot_plugin: author cache: %s", self.author_cache.stats()
+        )
+        return True
 
     def is_running(self) -> bool:
         """
@@ -80,6 +393,8 @@ class OobabotWorker:
         This does not mean that it is connected to discord,
         only that its main loop is running.
         """
+        if self.bot_process is not None:
+            return self.bot_process.is_alive()
         return self.thread is not None and self.thread.is_alive()
 
     def has_discord_token(self) -> bool:
@@ -94,26 +409,154 @@ class OobabotWorker:
         """
         Returns an etag for the oobabot's log.
         """
-        if self.bot is None:
-            return -1
-        return self.bot.log_count()
+        return log_store.get().sequence
 
-    def get_logs(self) -> str:
+    def get_logs(self, since_etag: int = -1) -> LogUpdate:
         """
-        Returns the logs from the oobabot.
+        Returns the newest lines of the oobabot's logs, for the
+        log panel.
+
+        since_etag: the etag of the last update the caller has
+        applied.  If every line appended since then is among the
+        lines the panel shows, only those lines are returned.
+        Otherwise, this falls back to a full snapshot of them.
         """
-        if self.bot is None:
-            return ""
+        etag, is_delta, entries, retained = log_store.get().since(
+            since_etag, max_entries=self.LOG_PANEL_MAX_LINES
+        )
+        lines = [entry.to_html() for entry in entries]
+        return LogUpdate(etag, is_delta, lines, retained)
 
-        lines = self.bot.logs()
-        return (
-            '<div class="oobabot-log">' + "\n<br>".join(lines) + "</div></body></html>"
+    def search_logs(self, query: log_store.LogQuery) -> LogSearchResult:
+        """
+        Returns the newest log lines which match the query.
+        """
+        entries, has_more = log_store.get().search(query, self.LOG_SEARCH_MAX_LINES)
+        return LogSearchResult([entry.to_html() for entry in entries], has_more)
+
+    def has_log_spool(self) -> bool:
+        """
+        Returns True if the bot's logs are being kept on disk.
+        """
+        return self.log_spool is not None
+
+    def get_log_history(self, cursor: typing.Optional[str] = None) -> LogHistoryPage:
+        """
+        Returns a page of log lines from the log spool.
+
+        cursor: the older_cursor from an earlier page, to get
+        the page before it.  If None, returns the newest lines.
+        """
+        if self.log_spool is None:
+            return LogHistoryPage([], None)
+        page = self.log_spool.read_page(self.LOG_HISTORY_PAGE_LINES, cursor)
+        return LogHistoryPage(
+            [line.to_html() for line in page.lines],
+            page.older_cursor,
         )
 
+    def export_logs(self) -> typing.Optional[str]:
+        """
+        Writes everything in the log spool to a temporary file,
+        for the user to download.  Returns the file's path, or
+        None if there is no log spool.
+        """
+        if self.log_spool is None:
+            return None
+        temp_fd, temp_path = tempfile.mkstemp(prefix="oobabot-", suffix=".log")
+        with os.fdopen(temp_fd, "wb") as file:
+            self.log_spool.export(file)
+
+        # only keep the latest export around
+        if self.last_log_export is not None:
+            try:
+                os.remove(self.last_log_export)
+            except OSError:
+                pass
+        self.last_log_export = temp_path
+        return temp_path
+
+    def get_log_sources(self) -> typing.List[str]:
+        """
+        Returns the names of the loggers which have logged
+        anything we're still holding on to.
+        """
+        return log_store.get().logger_names()
+
+    def mark_settings_changed(self) -> None:
+        """
+        Notes that the settings have changed since they were
+        last saved, so that the next save_settings() writes them.
+        """
+        self.settings_dirty = True
+
     def save_settings(self):
-        if self.bot is None:
+        """
+        Writes the settings to the config file in the background,
+        if they've changed since they were last saved.
+        """
+        with self.bot_lock:
+            if self.bot is None or not self.settings_dirty:
+                return
+            # cleared before the write, so that changes made while
+            # it's under way are saved next time.  If it fails, the
+            # writer marks the settings as changed again.
+            self.settings_dirty = False
+            self.settings_writer.request_write()
+
+    def _write_settings(self, stream: typing.TextIO) -> None:
+        self.bot.settings.write_to_stream(stream)
+
+    @staticmethod
+    def is_live_applicable(handler: "input_handlers.ComponentToSetting") -> bool:
+        """
+        Returns True if every setting the handler writes can be
+        changed while the bot is running.
+        """
+        return all(live_settings.is_live(name) for name in handler.setting_names())
+
+    def apply_settings(
+        self,
+        changed_handlers: typing.List["input_handlers.ComponentToSetting"],
+    ) -> None:
+        """
+        Applies settings which were changed while the bot is running.
+        Those which can be are pushed into the running bot, without
+        restarting it.  The rest take effect the next time it starts.
+
+        The settings should already have been saved.
+        """
+        if not changed_handlers or self.get_state() not in (STARTING, RUNNING):
             return
-        self.bot.settings.write_to_file(self.config_file)
+
+        live_names = []
+        restart_names = []
+        for handler in changed_handlers:
+            for name in handler.setting_names():
+                if live_settings.is_live(name):
+                    live_names.append(name)
+                else:
+                    restart_names.append(name)
+
+        if restart_names:
+            fancy_logger.get().info(
+                "oobabot_plugin: changes to %s will take effect when oobabot restarts",
+                ", ".join(restart_names),
+            )
+        if not live_names:
+            return
+
+        if self.bot_process is not None:
+            # the child has its own copy of the settings
+            applied = self.bot_process.apply_settings(
+                self.get_settings_as_yaml(), live_names
+            )
+        else:
+            applied = live_settings.apply(self.bot, live_names)
+        if applied:
+            fancy_logger.get().info(
+                "oobabot_plugin: applied %s to the running bot", ", ".join(live_names)
+            )
 
     def is_voice_enabled(self) -> bool:
         if self.bot is None:
@@ -125,6 +568,8 @@ class OobabotWorker:
         Returns the transcript of the latest voice call from the oobabot,
         or None if there is no transcript.
         """
+        if self.bot_process is not None:
+            return self.bot_process.get_transcript()
         if self.bot is None:
             return []
         return self.bot.current_voice_transcript
@@ -136,19 +581,96 @@ class OobabotWorker:
         Returns display information about the given user id,
         or None if the user id could not be found.
         """
-        if self.bot is None:
+        if self.bot_process is not None:
+            fn_fancy_author_info = self.bot_process.fancy_author_info
+        elif self.bot is not None:
+            fn_fancy_author_info = self.bot.fancy_author_info
+        else:
             return None
-        return self.bot.fancy_author_info(user_id)
+        # a user we can't find yet may turn up later, for instance
+        # once the bot has seen them in the call, so look again
+        return self.author_cache.get(
+            user_id,
+            lambda: fn_fancy_author_info(user_id),
+            fn_should_cache=lambda fancy_author: fancy_author is not None,
+        )
+
+    def has_transcript_archive(self) -> bool:
+        """
+        Returns True if the transcripts of voice calls are being
+        kept on disk.
+        """
+        return self.transcript_archive is not None
+
+    def get_archived_calls(
+        self, before_call_id: typing.Optional[int] = None
+    ) -> transcript_archive_module.CallsPage:
+        """
+        Returns a page of past voice calls, newest first.
+
+        before_call_id: the older_cursor from an earlier page, to
+        get the page before it.  If None, starts with the newest.
+        """
+        if self.transcript_archive is None:
+            return transcript_archive_module.CallsPage([], None)
+        return self.transcript_archive.list_calls(
+            self.ARCHIVE_CALLS_PAGE_SIZE, before_call_id
+        )
+
+    def get_archived_call_page(
+        self, call_id: int, cursor: typing.Optional[str] = None
+    ) -> ArchivedCallPage:
+        """
+        Returns a page of messages from a past voice call.
+
+        cursor: the next_cursor from an earlier page, to get the
+        page after it.  If None, starts at the beginning of the call.
+        """
+        if self.transcript_archive is None:
+            return ArchivedCallPage("", None)
+        page = self.transcript_archive.read_messages(
+            call_id, self.ARCHIVE_MESSAGES_PAGE_SIZE, cursor
+        )
+        html, _ = transcript_view.get_transcript_html(page.messages, page.authors.get)
+        return ArchivedCallPage(html, page.next_cursor)
+
+    def search_transcripts(self, text: str) -> TranscriptSearchResult:
+        """
+        Returns the newest messages from past voice calls which
+        contain every word in the text.
+        """
+        if self.transcript_archive is None:
+            return TranscriptSearchResult([], False)
+        hits, has_more = self.transcript_archive.search(
+            text, self.ARCHIVE_SEARCH_MAX_RESULTS
+        )
+        return TranscriptSearchResult(hits, has_more)
 
     def get_input_handlers(
         self,
         fn_get_character_list: typing.Callable[[], typing.List[str]],
-    ) -> typing.Dict[gr.components.IOComponent, input_handlers.ComponentToSetting]:
-        if self.handlers:
+    ) -> typing.Dict["gr.components.IOComponent", "input_handlers.ComponentToSetting"]:
+        with self.bot_lock:
+            if not self.handlers:
+                self.handlers = self._make_input_handlers(
+                    self.bot.settings, fn_get_character_list
+                )
             return self.handlers
 
+    def _make_input_handlers(
+        self,
+        settings: "oobabot.settings.Settings",
+        fn_get_character_list: typing.Callable[[], typing.List[str]],
+    ) -> typing.Dict["gr.components.IOComponent", "input_handlers.ComponentToSetting"]:
+        # pylint: disable=import-outside-toplevel
+        # this imports gradio, so only do it once there's a UI
+        from oobabot_plugin import input_handlers
+
+        # pylint: enable=import-outside-toplevel
+
         layout = self.layout
-        settings = self.bot.settings
+        if layout is None:
+            raise ValueError("there's no UI to get input handlers for")
 
         components_to_settings = [
             input_handlers.SimpleComponentToSetting(
@@ -161,6 +683,7 @@ class OobabotWorker:
                 settings.persona_settings,
                 "persona_file",
                 fn_get_character_list,
+                fn_on_choices_loaded=self.prefetch_personas,
             ),
             input_handlers.SimpleComponentToSetting(
                 layout.ai_name_textbox,
@@ -215,8 +738,7 @@ class OobabotWorker:
         ]
 
         # make a map from component to setting
-        self.handlers = {c.component: c for c in components_to_settings}
-        return self.handlers
+        return {c.component: c for c in components_to_settings}
 
     def preview_persona(
         self,
@@ -230,12 +752,29 @@ class OobabotWorker:
 
         Returns: (ai_name, persona)
         """
-        persona_file = (
-            input_handlers.CharacterComponentToSetting.character_name_to_filepath(
-                character=character
-            )
+        persona_file = character_catalog.get().filepath(character)
+
+        # reading the character file is the slow part, so remember
+        # what we got for each version of it
+        file_identity = None
+        if persona_file:
+            try:
+                stat = os.stat(persona_file)
+                file_identity = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                pass
+
+        return self.persona_cache.get(
+            (persona_file, file_identity, ai_name, persona),
+            lambda: self._load_persona(persona_file, ai_name, persona),
         )
 
+    def _load_persona(
+        self,
+        persona_file: str,
+        ai_name: str,
+        persona: str,
+    ) -> typing.Tuple[str, str]:
         persona_handler = oobabot.runtime.persona.Persona(
             {
                 "ai_name": ai_name,
@@ -250,22 +789,40 @@ class OobabotWorker:
             persona_handler.persona,
         )
 
-    def is_using_character(
-        self,
-        fn_get_character_list: typing.Callable[[], typing.List[str]],
-    ) -> bool:
+    def prefetch_personas(self, characters: typing.List[str]) -> None:
+        """
+        Loads previews for the given characters in the background,
+        so that they're ready when the user picks one.  Does nothing
+        if a prefetch is already underway.
+        """
+        if not self.prefetch_lock.acquire(blocking=False):
+            return
+
+        def prefetch():
+            try:
+                persona_settings = self.bot.settings.persona_settings
+                ai_name = persona_settings.get_str("ai_name")
+                persona = persona_settings.get_str("persona")
+                # there's no point loading more than we can keep
+                for character in characters[: self.PERSONA_CACHE_MAX_ENTRIES]:
+                    self.preview_persona(character, ai_name, persona)
+            except Exception as err:  # pylint: disable=broad-except
+                fancy_logger.get().debug(
+                    "oobabot_plugin: could not prefetch characters: %s", err
+                )
+            finally:
+                self.prefetch_lock.release()
+
+        threading.Thread(target=prefetch, daemon=True).start()
+
+    def is_using_character(self) -> bool:
         # get the filename out of the settings.  If it is
         # not empty, make sure it's one of the options in the
         # dropdown.
         persona_file = self.bot.settings.persona_settings.get_str("persona_file")
         if not persona_file:
             return False
-        character_name = (
-            input_handlers.CharacterComponentToSetting.filename_to_character_name(
-                persona_file,
-                fn_get_character_list,
-            ),
-        )
+        character_name = character_catalog.get().character_name(persona_file)
         return "" != character_name
 
     def get_settings_as_yaml(self) -> str:
@@ -290,4 +847,6 @@ class OobabotWorker:
         if self.is_running():
             raise RuntimeError("Cannot set settings while running")
 
+        # even a failed load may have changed some settings
+        self.mark_settings_changed()
         return self.bot.settings.load_from_yaml_stream(io.StringIO(yaml_str))
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Checks the log store's byte cap, and that searching it by
+following each entry's links back matches a plain scan of
+the entries it holds.
+"""
+
+import logging
+import random
+import re
+import typing
+
+import pytest
+
+from oobabot_plugin import log_store
+
+LOGGER_NAMES = ["oobabot", "oobabot.discord", "oobabot.voice", "discord.gateway"]
+START_TIME = 1_700_000_000.0
+
+
+def make_record(
+    rnd: random.Random, number: int, message: str = "message %d %s"
+) -> logging.LogRecord:
+    record = logging.LogRecord(
+        rnd.choice(LOGGER_NAMES),
+        rnd.choice([logging.DEBUG, logging.INFO, logging.INFO, logging.WARNING]),
+        __file__,
+        0,
+        message,
+        (number, rnd.choice("abc")),
+        None,
+    )
+    record.created = START_TIME + number
+    return record
+
+
+def fill(store: log_store.LogStore, rnd: random.Random, count: int) -> None:
+    for number in range(count):
+        store.handle(make_record(rnd, number))
+
+
+def scan(
+    entries: typing.List[log_store.LogEntry], query: log_store.LogQuery
+) -> typing.List[log_store.LogEntry]:
+    return [
+        entry
+        for entry in entries
+        if entry.levelno >= query.min_level
+        and (
+            not query.logger_name
+            or entry.logger_name == query.logger_name
+            or entry.logger_name.startswith(query.logger_name + ".")
+        )
+        and (query.since is None or entry.created >= query.since)
+        and (query.until is None or entry.created <= query.until)
+        and (query.pattern is None or query.pattern.search(entry.message()))
+    ]
+
+
+def chain(
+    entry: typing.Optional[log_store.LogEntry], link: str
+) -> typing.List[log_store.LogEntry]:
+    entries = []
+    while entry is not None:
+        entries.append(entry)
+        entry = getattr(entry, link)
+    entries.reverse()
+    return entries
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_search_matches_scan(seed: int) -> None:
+    rnd = random.Random(seed)
+    # small stores drop most of what's logged to them
+    store = log_store.LogStore(max_bytes=rnd.choice([5_000, 50_000, 10_000_000]))
+    count = rnd.randint(0, 2000)
+    fill(store, rnd, count)
+    entries = list(store.entries)
+
+    for _ in range(30):
+        query = log_store.LogQuery(
+            min_level=rnd.choice([logging.NOTSET, logging.INFO, logging.WARNING]),
+            logger_name=rnd.choice(["", "", "oobabot", "oobabot.voice", "discord"]),
+            since=rnd.choice([None, START_TIME + rnd.randint(0, count)]),
+            until=rnd.choice([None, START_TIME + rnd.randint(0, count)]),
+            pattern=rnd.choice([None, re.compile("a"), re.compile("1")]),
+        )
+        limit = rnd.choice([1, 10, 100, 5000])
+        expected = scan(entries, query)
+        found, has_more = store.search(query, limit)
+        assert found == expected[-limit:]
+        assert has_more == (len(expected) > limit)
+
+
+def test_links_stop_at_dropped_entries() -> None:
+    rnd = random.Random(0)
+    store = log_store.LogStore(max_bytes=20_000)
+    fill(store, rnd, 5000)
+    assert store.sequence == 5000
+    assert len(store.entries) < 5000
+
+    # nothing links back to a dropped entry, so they can be freed,
+    # and searches never see them
+    assert chain(store.entries[-1], "previous") == list(store.entries)
+    for bucket in store.by_level.values():
+        assert chain(bucket[-1], "previous_at_level") == list(bucket)
+    for bucket in store.by_logger.values():
+        assert chain(bucket[-1], "previous_from_logger") == list(bucket)
+
+    found, _ = store.search(log_store.LogQuery(), 10_000)
+    assert found == list(store.entries)
+
+
+def test_keeps_newest_entries_within_max_bytes() -> None:
+    store = log_store.LogStore(max_bytes=20_000)
+    fill(store, random.Random(0), 1000)
+    everything = log_store.LogStore(max_bytes=10_000_000)
+    fill(everything, random.Random(0), 1000)
+
+    # the newest entries which fit, and no fewer
+    kept = 0
+    total_bytes = 0
+    for entry in reversed(everything.entries):
+        if total_bytes + entry.size > store.max_bytes:
+            break
+        total_bytes += entry.size
+        kept += 1
+    sequences = [entry.sequence for entry in store.entries]
+    assert sequences == list(range(1001 - kept, 1001))
+    assert store.total_bytes == total_bytes
+
+    rnd = random.Random(1)
+
+    # entries whose messages are longer take up more room
+    store.handle(make_record(rnd, 1000, "x" * 1000 + " %d %s"))
+    assert store.entries[-1].size > 2000
+    assert store.total_bytes <= store.max_bytes
+    assert len(store.entries) < kept
+
+
+def test_keeps_newest_entry_however_large() -> None:
+    rnd = random.Random(0)
+    store = log_store.LogStore(max_bytes=1000)
+    fill(store, rnd, 10)
+    store.handle(make_record(rnd, 10, "x" * 5000 + " %d %s"))
+    assert [entry.sequence for entry in store.entries] == [11]
+    assert store.entries[-1].previous is None
+    assert store.total_bytes == store.entries[-1].size
+
+
+def test_since_after_entries_dropped() -> None:
+    rnd = random.Random(0)
+    store = log_store.LogStore(max_bytes=20_000)
+    fill(store, rnd, 1000)
+    retained = len(store.entries)
+
+    sequence, is_delta, entries, considered = store.since(998)
+    assert (sequence, is_delta, considered) == (1000, True, retained)
+    assert [entry.sequence for entry in entries] == [999, 1000]
+
+    # some of the entries after 1 have been dropped, so we get
+    # everything which is left instead
+    sequence, is_delta, entries, considered = store.since(1)
+    assert not is_delta
+    assert entries == list(store.entries)
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Checks that the transcript view, which only regroups the rows
+next to each change, shows the same thing as rendering the
+whole transcript from scratch, and that viewers applying its
+deltas end up with the same rows.
+"""
+
+import datetime
+import random
+import typing
+
+import pytest
+
+from oobabot_plugin import fake_bot
+from oobabot_plugin import transcript_view
+
+
+class Viewer:
+    """
+    Applies transcript updates the way apply_transcript in
+    oobabot_log.js does, polling every lag steps.
+    """
+
+    def __init__(self, lag: int):
+        self.lag = lag
+        self.version = -1
+        self.row_base = 0
+        self.rows: typing.List[str] = []
+
+    def apply(self, update: transcript_view.TranscriptUpdate) -> None:
+        if update.version <= self.version or (
+            update.is_delta and update.since > self.version
+        ):
+            return
+        if not update.is_delta:
+            self.rows = list(update.rows)
+            self.row_base = update.row_base
+            self.version = update.version
+            return
+        if update.row_base > self.row_base:
+            del self.rows[: update.row_base - self.row_base]
+            self.row_base = update.row_base
+        first = max(update.first_row - self.row_base, 0)
+        assert first <= len(self.rows), "delta starts past the rows we have"
+        del self.rows[first:]
+        self.rows.extend(update.rows)
+        self.version = update.version
+
+
+def make_messages(
+    rnd: random.Random, count: int
+) -> typing.List["fake_bot.types.VoiceMessage"]:
+    """
+    Makes up messages in the order the bot would add them.  Some
+    started a few seconds before the one added ahead of them, as
+    when a user talks over someone, so they're out of order.
+    """
+    start_time = datetime.datetime(2023, 1, 1)
+    messages = []
+    for _ in range(count):
+        start_time += datetime.timedelta(seconds=rnd.choice([0.2, 0.5, 2, 5]))
+        overlap = datetime.timedelta(seconds=rnd.choice([0, 0, 0, 3]))
+        messages.append(fake_bot.make_voice_message(rnd, start_time - overlap))
+    return messages
+
+
+def check_rows(view: transcript_view.TranscriptView) -> None:
+    # the rows are grouped just as they would be from scratch, and
+    # every message knows which row it's in
+    assert view.row_messages == view._group_messages(0, len(view.ordered))
+    for row, messages in enumerate(view.row_messages, start=view.row_base):
+        assert all(rendered.row == row for rendered in messages)
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_matches_full_render(seed: int) -> None:
+    rnd = random.Random(seed)
+    pool = make_messages(rnd, 400)
+    # how many messages the bot keeps, before the oldest drop off
+    capacity = rnd.choice([5, 20, 300])
+    options: typing.Dict[str, typing.Any] = rnd.choice(
+        [
+            {},
+            {"window_messages": 12},
+            {"window_age": datetime.timedelta(seconds=20)},
+        ]
+    )
+
+    transcript: typing.List["fake_bot.types.VoiceMessage"] = []
+    view = transcript_view.TranscriptView(
+        lambda: transcript, fake_bot.make_fancy_author, **options
+    )
+    viewers = [Viewer(lag) for lag in (1, 2, 7, 150)]
+    added = 0
+    for step in range(150):
+        if rnd.random() < 0.02:
+            # a new call
+            transcript = []
+        else:
+            for _ in range(rnd.choice([0, 1, 1, 2, 5])):
+                if added < len(pool):
+                    transcript.append(pool[added])
+                    added += 1
+            transcript = transcript[-capacity:]
+
+        html = view.get_html()
+        version = view.get_version()
+        for viewer in viewers:
+            if step % viewer.lag == 0:
+                viewer.apply(view.get_update(viewer.version))
+
+        shown = list(transcript)
+        fresh = transcript_view.TranscriptView(
+            lambda: shown, fake_bot.make_fancy_author, **options
+        )
+        assert html == fresh.get_html()
+        assert view.get_version() == version
+        check_rows(view)
+
+        # the oldest row may still show messages which have since
+        # dropped off, but every other row is up to date
+        up_to_date = viewers[0]
+        assert up_to_date.version == view.version
+        assert up_to_date.row_base == view.row_base
+        assert len(up_to_date.rows) == len(view.rows)
+        assert up_to_date.rows[1:] == view.rows[1:]
+
+    for viewer in viewers:
+        viewer.apply(view.get_update(viewer.version))
+        assert viewer.version == view.version
+        assert viewer.row_base == view.row_base
+        assert viewer.rows[1:] == view.rows[1:]
+
+
+def test_unchanged_transcript_keeps_version() -> None:
+    transcript = make_messages(random.Random(0), 50)
+    view = transcript_view.TranscriptView(
+        lambda: transcript, fake_bot.make_fancy_author
+    )
+    version = view.get_version()
+    assert view.get_version() == version
+    update = view.get_update(version)
+    assert update.is_delta
+    assert not update.rows
+
+
+def test_new_call_sends_snapshot() -> None:
+    rnd = random.Random(0)
+    transcript = make_messages(rnd, 50)
+    view = transcript_view.TranscriptView(
+        lambda: transcript, fake_bot.make_fancy_author
+    )
+    version = view.get_version()
+    old_end = view.row_base + len(view.rows)
+
+    transcript = make_messages(rnd, 10)
+    update = view.get_update(version)
+    assert not update.is_delta
+    # rows are numbered after the old call's, so numbers never
+    # go backwards
+    assert update.row_base == old_end
+    assert "".join(update.rows) == view.get_html()